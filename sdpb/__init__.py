@@ -1,8 +1,11 @@
+import gc
 import os
 import connexion
 from flask_cors import CORS
 from flask_compress import Compress
 from flask_sqlalchemy import SQLAlchemy
+import logging
+from sdpb.util import cache_control, cursor, etag, json_provider, uri
 
 # This is a nasty way to do this.
 #
@@ -40,8 +43,31 @@ def create_app(config_override={}):
         SQLALCHEMY_ENGINE_OPTIONS={
             "pool_pre_ping": True,
         },
+        CATALOG_REFRESH_INTERVAL=int(os.getenv("CATALOG_REFRESH_INTERVAL", 60)),
+        DATA_VERSION_PROBE=os.getenv("DATA_VERSION_PROBE", "fingerprint"),
+        JSON_PROVIDER=os.getenv("JSON_PROVIDER", "auto"),
+        WEATHER_CACHE_ENTRIES=int(os.getenv("WEATHER_CACHE_ENTRIES", 120)),
+        WEATHER_CACHE_OPEN_TTL=int(os.getenv("WEATHER_CACHE_OPEN_TTL", 5 * 60)),
+        WEATHER_CACHE_CLOSED_TTL=int(
+            os.getenv("WEATHER_CACHE_CLOSED_TTL", 7 * 24 * 60 * 60)
+        ),
+        WEATHER_CACHE_WARM_MONTHS=int(os.getenv("WEATHER_CACHE_WARM_MONTHS", 0)),
+        BASELINE_CACHE_TTL=int(os.getenv("BASELINE_CACHE_TTL", 24 * 60 * 60)),
+        BASELINE_WARM_UP=os.getenv("BASELINE_WARM_UP", "false").lower() == "true",
+        CATALOG_WARM_UP=os.getenv("CATALOG_WARM_UP", "false").lower() == "true",
+        PARALLEL_QUERIES=os.getenv("PARALLEL_QUERIES", "true").lower() == "true",
+        PARALLEL_QUERIES_CONNECTIONS=int(os.getenv("PARALLEL_QUERIES_CONNECTIONS", 4)),
+        OBS_TILE_CACHE_BYTES=int(os.getenv("OBS_TILE_CACHE_BYTES", 64 * 1024 * 1024)),
+        OBS_TILE_CACHE_OPEN_TTL=int(os.getenv("OBS_TILE_CACHE_OPEN_TTL", 5 * 60)),
+        OBS_TILE_CACHE_CLOSED_TTL=int(
+            os.getenv("OBS_TILE_CACHE_CLOSED_TTL", 24 * 60 * 60)
+        ),
+        STATION_TILE_CACHE_BYTES=int(
+            os.getenv("STATION_TILE_CACHE_BYTES", 4 * 1024 * 1024)
+        ),
     )
     flask_app.config.update(config_override)
+    json_provider.init_app(flask_app)
     compress.init_app(flask_app)
 
     app_db = SQLAlchemy(flask_app)
@@ -54,10 +80,73 @@ def create_app(config_override={}):
     # ordering during setup.
 
     connexion_app.add_api("api-spec.yaml")
+    uri.init_app(flask_app)
+    etag.init_app(flask_app)
+    cursor.init_app(flask_app)
+    cache_control.init_app(flask_app)
+
+    warm_up_caches(flask_app)
 
     return connexion_app, flask_app, app_db
 
 
+def warm_up_caches(app):
+    """
+    Precompute cached data, as configured: the station catalog, its indices
+    and the observation count cube (see `warm_up_catalog`); recent months of
+    the weather collections (see `weather`); and the baseline collections
+    (see `baseline`).
+    """
+    from sdpb.api.weather.monthly import baseline, weather
+
+    warm_ups = []
+    if app.config["CATALOG_WARM_UP"]:
+        warm_ups.append(("Catalog", warm_up_catalog))
+    if app.config["WEATHER_CACHE_WARM_MONTHS"]:
+        months = app.config["WEATHER_CACHE_WARM_MONTHS"]
+        warm_ups.append(("Weather", lambda session: weather.warm_up(session, months)))
+    if app.config["BASELINE_WARM_UP"]:
+        warm_ups.append(("Baseline", baseline.warm_up))
+    for name, warm_up in warm_ups:
+        try:
+            with app.app_context():
+                warm_up(get_app_session())
+        except Exception:
+            # The caches fill on demand anyway; do not prevent the app starting.
+            logging.getLogger("sdpb").exception(f"{name} cache warm-up failed")
+
+
+def warm_up_catalog(session):
+    """
+    Load the station catalog and build its indices, including the variables
+    by history, and load the observation count cube.
+    """
+    from sdpb.util.catalog import get_catalog
+    from sdpb.util.count_cube import get_count_cube
+
+    get_catalog(session).build_indices()
+    get_count_cube(session)
+
+
+def prepare_for_fork():
+    """
+    Prepare the app, created in a server's master process, for forking
+    worker processes from it (see `docker/gunicorn.conf`).
+
+    Database connections opened while creating the app, including those for
+    parallel queries, are closed, since a connection must not be shared
+    between processes. Then all objects are moved to the garbage collector's
+    permanent generation (`gc.freeze`), so that collections in the workers do
+    not write to, and so copy, the pages holding them.
+    """
+    from sdpb.util import parallel_queries
+
+    with flask_app.app_context():
+        app_db.engine.dispose()
+    parallel_queries.dispose()
+    gc.freeze()
+
+
 def get_app_db():
     return app_db
 
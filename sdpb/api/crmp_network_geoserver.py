@@ -1,12 +1,34 @@
+"""
+/crmp_network_geoserver API implementation
+
+Items of the `crmp_network_geoserver` view, one per station history, as used
+by map layers.
+
+Filters (`network_id`, `province`, `freq`, `vars`, and the bounds of a
+`bbox` or polygon) are applied in the query, so a layer fetches only the
+items it shows. Items are ordered by (network_id, history_id), which is also
+the key for keyset pagination (see `sdpb.util.cursor`). With
+`format=geojson` the collection is a GeoJSON FeatureCollection of points.
+"""
 import logging
+from itertools import chain, islice
+from sqlalchemy import func, literal, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, TEXT
 from pycds import CrmpNetworkGeoserver
 from sdpb import get_app_session
+from sdpb.util import spatial
+from sdpb.util.cursor import decode_cursor, paginate
+from sdpb.util.streaming import json_array_chunks, streamed_response
 from sdpb.timing import log_timing
 
 
 logger = logging.getLogger("sdpb")
 
 
+# Number of rows fetched at a time from the server-side cursor when streaming.
+stream_batch_size = 1000
+
+
 item_keys = (
     "network_name",
     "native_id",
@@ -32,8 +54,17 @@ item_keys = (
 )
 
 
+# Selecting only these columns yields lightweight rows rather than ORM objects.
+item_columns = tuple(getattr(CrmpNetworkGeoserver, key) for key in item_keys)
+
+
 def single_item_rep(item):
-    """Return representation of a single network item."""
+    """
+    Return representation of a single CNG item.
+
+    :param item: Row with (at least) the attributes in `item_keys`.
+    :return: dict
+    """
     return {key: getattr(item, key) for key in item_keys}
 
 
@@ -44,19 +75,214 @@ def collection_item_rep(item):
     return single_item_rep(item)
 
 
+def iter_collection_rep(items):
+    """Yield representations of the items of networks collection."""
+    return (collection_item_rep(item) for item in items)
+
+
 def collection_rep(items):
     """Return representation of networks collection."""
-    return [collection_item_rep(item) for item in items]
+    return list(iter_collection_rep(items))
+
+
+def feature_rep(item):
+    """
+    Return the GeoJSON Feature representation of a CNG item: a Point at its
+    location, with its other attributes as properties.
+    """
+    properties = single_item_rep(item)
+    lon, lat = properties.pop("lon"), properties.pop("lat")
+    return {
+        "type": "Feature",
+        "id": item.history_id,
+        "geometry": (
+            None
+            if lon is None or lat is None
+            else {"type": "Point", "coordinates": [lon, lat]}
+        ),
+        "properties": properties,
+    }
+
+
+def feature_collection_rep(items):
+    """Return the GeoJSON FeatureCollection representation of CNG items."""
+    return {
+        "type": "FeatureCollection",
+        "features": [feature_rep(item) for item in items],
+    }
+
+
+def feature_collection_chunks(items):
+    """Yield the JSON text of the FeatureCollection of `items`, in chunks."""
+    return chain(
+        ['{"type":"FeatureCollection","features":'],
+        json_array_chunks(feature_rep(item) for item in items),
+        ["}"],
+    )
+
+
+def split(values):
+    """Return the list of values in a comma-separated string, or None."""
+    if values is None:
+        return None
+    return [value.strip() for value in values.split(",") if value.strip()]
+
+
+def vars_names(vars):
+    """
+    Return an SQL expression for the array of variable names in a `vars`
+    column, a list of names separated by commas (and spaces).
+    """
+    return func.regexp_split_to_array(vars, r"\s*,\s*", type_=ARRAY(TEXT))
+
+
+def add_filters(q, network_id=None, province=None, freq=None, vars=None):
+    """
+    Add attribute filters to a CNG query.
+
+    :param q: Query selecting from CrmpNetworkGeoserver.
+    :param network_id: List of network ids.
+    :param province: String, comma-separated list of provinces.
+    :param freq: String, comma-separated list of frequencies.
+    :param vars: String, comma-separated list of variable names. Items whose
+        `vars` includes any of them (whole names) are selected.
+    :return: Query
+    """
+    if network_id:
+        q = q.filter(CrmpNetworkGeoserver.network_id.in_(network_id))
+    if province is not None:
+        q = q.filter(CrmpNetworkGeoserver.province.in_(split(province)))
+    if freq is not None:
+        q = q.filter(CrmpNetworkGeoserver.freq.in_(split(freq)))
+    if vars is not None:
+        names = literal(split(vars), ARRAY(TEXT))
+        q = q.filter(vars_names(CrmpNetworkGeoserver.vars).overlap(names))
+    return q
+
+
+def item_key(item):
+    """Return the sort (and cursor) key of a CNG item."""
+    return item.network_id, item.history_id
+
+
+def within(items, region):
+    """Yield the items located in `region`, checking a batch at a time."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == stream_batch_size:
+            yield from within_batch(batch, region)
+            batch = []
+    yield from within_batch(batch, region)
+
 
+def within_batch(items, region):
+    inside = region.contains_points(
+        (item.lon for item in items), (item.lat for item in items)
+    )
+    return (item for item, flag in zip(items, inside) if flag)
 
-def collection():
-    with log_timing("List all CNG items", log=logger.debug):
+
+def collection(
+    stream=False,
+    bbox=None,
+    polygon=None,
+    network_id=None,
+    province=None,
+    freq=None,
+    vars=None,
+    format=None,
+    limit=None,
+    cursor=None,
+):
+    """
+    Get CNG items from database, and return their representation.
+
+    :param stream: Boolean. Return a streamed response (see
+        `sdpb.util.streaming`). Items are read from a server-side cursor
+        as the response is sent.
+    :param bbox: String, "min_lon,min_lat,max_lon,max_lat". If present, return
+        only items located in this box.
+    :param polygon: GeoJSON Polygon or MultiPolygon (see `search`). If
+        present, return only items located in it.
+    :param network_id: List of network ids. If present, return only items
+        of these networks.
+    :param province: String, comma-separated list of provinces.
+    :param freq: String, comma-separated list of frequencies.
+    :param vars: String, comma-separated list of variable names (see
+        `add_filters`).
+    :param format: String. "geojson" for a GeoJSON FeatureCollection;
+        anything else for the usual list of items.
+    :param limit: Integer. Maximum number of items to return.
+    :param cursor: String. Return items after this cursor (see
+        `sdpb.util.cursor`).
+    :return: list of dict, dict, or streamed response
+    """
+    region = spatial.region(bbox=bbox, polygon=polygon)
+    after = decode_cursor(cursor, 2)
+    q = add_filters(
+        get_app_session().query(*item_columns),
+        network_id=network_id,
+        province=province,
+        freq=freq,
+        vars=vars,
+    ).order_by(CrmpNetworkGeoserver.network_id, CrmpNetworkGeoserver.history_id)
+    if region is not None:
+        # CNG items are not in the catalog, so its spatial index does not
+        # apply. Select candidates by bounds in the query; test them exactly
+        # here.
+        bounds = region.bounds
+        q = q.filter(
+            CrmpNetworkGeoserver.lon.between(bounds.min_lon, bounds.max_lon),
+            CrmpNetworkGeoserver.lat.between(bounds.min_lat, bounds.max_lat),
+        )
+    if after is not None:
+        q = q.filter(
+            tuple_(CrmpNetworkGeoserver.network_id, CrmpNetworkGeoserver.history_id)
+            > after
+        )
+
+    if limit:
+        with log_timing("Query CNG items page", log=logger.debug):
+            if region is None:
+                items = q.limit(limit + 1).all()
+            else:
+                # Some candidates are outside the region; read just enough.
+                items = list(
+                    islice(within(q.yield_per(stream_batch_size), region), limit + 1)
+                )
+            items = paginate(items, limit, item_key)
+    elif stream:
+        items = q.yield_per(stream_batch_size)
+        if region is not None:
+            items = within(items, region)
+    else:
         with log_timing("Query all CNG items", log=logger.debug):
-            items = (
-                get_app_session()
-                .query(CrmpNetworkGeoserver)
-                .order_by(CrmpNetworkGeoserver.network_id.asc())
-                .all()
-            )
-        with log_timing("Convert CNG items to rep", log=logger.debug):
-            return collection_rep(items)
+            items = q.all()
+            if region is not None:
+                items = list(within_batch(items, region))
+
+    geojson = format == "geojson"
+    if stream:
+        if geojson:
+            chunks = feature_collection_chunks(items)
+        else:
+            chunks = json_array_chunks(iter_collection_rep(items))
+        return streamed_response(chunks, mimetype="application/json")
+    with log_timing("Convert CNG items to rep", log=logger.debug):
+        if geojson:
+            return feature_collection_rep(items)
+        return collection_rep(items)
+
+
+def search(body, **kwargs):
+    """
+    Get CNG items located in a region given in the request body (POST), and
+    return their representation.
+
+    :param body: dict with item `polygon`, a GeoJSON Polygon or MultiPolygon
+        (or a Feature with such a geometry).
+    :param kwargs: Query parameters, as for `collection`.
+    :return: list of dict
+    """
+    return collection(polygon=body.get("polygon"), **kwargs)
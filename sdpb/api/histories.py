@@ -31,17 +31,25 @@ Histories returned are always filtered by:
 - Matches province filter (for collection)
 """
 import logging
-from flask import url_for
 from pycds import History, VarsPerHistory
 from sdpb import get_app_session
 from sdpb.api import variables
-from sdpb.util.representation import date_rep, float_rep, obs_stats_rep
+from sdpb.util.representation import (
+    date_rep,
+    float_rep,
+    obs_stats_rep,
+    sparse_rep,
+)
 from sdpb.util.query import (
-    get_all_vars_by_hx,
     add_station_network_publish_filter,
-    get_all_histories_etc,
     base_history_query,
 )
+from sdpb.util import spatial
+from sdpb.util.catalog import get_catalog
+from sdpb.util.cursor import decode_cursor, paginate
+from sdpb.util.etag import etagged
+from sdpb.util.streaming import json_array_response
+from sdpb.util.uri import uri_for
 from sdpb.timing import log_timing
 
 
@@ -57,24 +65,24 @@ def id_(history):
 
 
 def uri(history):
-    # TODO: Using url_for approx doubles the time to convert
-    #  *entire record* to rep
-    return url_for("sdpb_api_histories_single", id=id_(history))
+    return uri_for("sdpb_api_histories_single", id=id_(history))
 
 
 def single_item_rep(history_etc, vars=None, compact=False, include_uri=False):
     """
     Return a representation of a single history item.
 
-    :param history_etc: A database result containing a History and its
-        associated StationObservationStats.
+    :param history_etc: A row of `base_history_query`, or a catalog
+        `HistoryRecord`, containing the attributes of a History and its
+        associated StationObservationStats. (A database result containing
+        a History and its StationObservationStats is also accepted.)
     :param vars: Iterable containing `Variable`s or variable ids (int)
         associated with this history.
     :param compact: Boolean. Return compact or full representation.
     :return: dict
     """
-    history = history_etc.History
-    sos = history_etc.StationObservationStats
+    history = getattr(history_etc, "History", history_etc)
+    sos = getattr(history_etc, "StationObservationStats", history_etc)
     rep = {
         "id": history.id,
         **({"uri": uri(history)} if include_uri else {}),
@@ -109,8 +117,7 @@ def collection_item_rep(history_etc, **kwargs):
     May conceivably be different than representation of a single a history,
     but at present they are the same.
 
-    :param history_etc: A database result containing a History and its
-        associated StationObservationStats.
+    :param history_etc: See `single_item_rep`.
     :param vars: Iterable containing `Variable`s or variable ids (int)
         associated with this history.
     :param compact: Boolean. Return compact or full representation.
@@ -119,22 +126,15 @@ def collection_item_rep(history_etc, **kwargs):
     return single_item_rep(history_etc, **kwargs)
 
 
-def collection_rep(
+def iter_collection_rep(
     histories_etc, all_vars_by_hx=None, compact=False, include_uri=False
 ):
     """
-    Return a representation of a histories collection.
+    Yield the representations of the items of a histories collection, in the
+    order of `histories_etc`. Parameters are as for `collection_rep`.
 
-    :param histories_etc: Iterable. Each element yielded is
-        a database result containing a History and its associated
-        StationObservationStats.
-    :param all_vars_by_hx: dict of variables associated to each history,
-        keyed by history id.
-    :param compact: Boolean. Return compact or full representation of each
-        history.
-    :return: list
+    :return: generator of dict
     """
-    """"""
 
     def variables_for(history):
         """Return those variables connected with a specific history."""
@@ -151,15 +151,40 @@ def collection_rep(
             except KeyError as e:
                 return []
 
-    return [
+    return (
         collection_item_rep(
             history_etc,
-            vars=variables_for(history_etc.History),
+            vars=variables_for(getattr(history_etc, "History", history_etc)),
             compact=compact,
             include_uri=include_uri,
         )
         for history_etc in histories_etc
-    ]
+    )
+
+
+def collection_rep(
+    histories_etc, all_vars_by_hx=None, compact=False, include_uri=False
+):
+    """
+    Return a representation of a histories collection.
+
+    :param histories_etc: Iterable. Each element yielded is
+        a database result containing a History and its associated
+        StationObservationStats.
+    :param all_vars_by_hx: Mapping (dict or `VarsByHistory`) of variables
+        associated to each history, keyed by history id.
+    :param compact: Boolean. Return compact or full representation of each
+        history.
+    :return: list
+    """
+    return list(
+        iter_collection_rep(
+            histories_etc,
+            all_vars_by_hx=all_vars_by_hx,
+            compact=compact,
+            include_uri=include_uri,
+        )
+    )
 
 
 def single(id=None, compact=False):
@@ -186,14 +211,83 @@ def single(id=None, compact=False):
     return single_item_rep(history_etc, hx_vars, compact=compact, include_uri=True)
 
 
+# Fields of the compact and full representations, in the order of
+# `single_item_rep`, excluding `uri` and `variable_ids`.
+compact_fields = (
+    "id",
+    "station_name",
+    "lon",
+    "lat",
+    "elevation",
+    "province",
+    "freq",
+    "min_obs_time",
+    "max_obs_time",
+)
+full_fields = compact_fields + ("sdate", "edate", "tz_offset", "country")
+
+# Representations of field values, as in `single_item_rep`.
+field_reps = {
+    "lon": float_rep,
+    "lat": float_rep,
+    "elevation": float_rep,
+    "min_obs_time": date_rep,
+    "max_obs_time": date_rep,
+    "sdate": date_rep,
+    "edate": date_rep,
+}
+
+
+def column_rep(catalog, name, indices):
+    """
+    Return the representation of the values of history column `name` at
+    positions `indices` in the catalog.
+    """
+    values = catalog.history_column(name, indices)
+    if name in field_reps:
+        return [field_reps[name](value) for value in values]
+    return values
+
+
+def columnar_rep(catalog, indices, compact=False):
+    """
+    Return the columnar representation of the histories at positions
+    `indices` in the catalog: a single object of parallel arrays, one per
+    field of the (compact or full) item representation. `variable_ids` is in
+    sparse form (see `sparse_rep`).
+
+    This is built directly from the catalog columns, without a dict per item,
+    and is much smaller and cheaper to serialize than the list of items.
+
+    :param catalog: Catalog
+    :param indices: Sequence of positions of histories in the catalog.
+    :param compact: Boolean. Fields of compact or full representation.
+    :return: dict
+    """
+    rep = {
+        name: column_rep(catalog, name, indices)
+        for name in (compact_fields if compact else full_fields)
+    }
+    vars_by_hx = catalog.vars_by_hx
+    rep["variable_ids"] = sparse_rep(vars_by_hx.get(hx_id, ()) for hx_id in rep["id"])
+    return rep
+
+
+@etagged(lambda: get_catalog(get_app_session()).version)
 def collection(
     provinces=None,
     compact=False,
     include_uri=False,
+    stream=False,
+    limit=None,
+    cursor=None,
+    format=None,
+    bbox=None,
+    polygon=None,
 ):
     """
-    Get histories and associated variables from database, and return their
-    representation.
+    Get histories and associated variables from the catalog (see
+    `sdpb.util.catalog`), and return their representation.
 
     :param provinces: String, in form of comma-separated list, no spaces.
         If present, return only histories whose `province` attribute match
@@ -202,16 +296,62 @@ def collection(
         representation is returned. A compact representation:
         - omits attributes elevation, sdate, edate, tz_offset, country
         - does not put information in attribute variables
+    :param stream: Boolean. Return a streamed response (see
+        `sdpb.util.streaming`).
+    :param limit: Integer. Maximum number of results.
+    :param cursor: String. Opaque cursor (see `sdpb.util.cursor`) from the
+        next-page link of a previous response. Return only histories after
+        the last history of that response.
+    :param format: String. "columnar" for the columnar representation (see
+        `columnar_rep`); anything else for the usual list of items. The
+        columnar representation is not streamed and does not include URIs.
+    :param bbox: String, "min_lon,min_lat,max_lon,max_lat". If present, return
+        only histories located in this box.
+    :param polygon: GeoJSON Polygon or MultiPolygon (see `search`). If
+        present, return only histories located in it.
     :return: dict
     """
     session = get_app_session()
+    region = spatial.region(bbox=bbox, polygon=polygon)
     with log_timing("List all histories", log=logger.debug):
-        histories_etc = get_all_histories_etc(session, provinces=provinces)
-        all_vars_by_hx = get_all_vars_by_hx(session)
+        catalog = get_catalog(session)
+        indices = catalog.history_indices(
+            provinces=provinces,
+            limit=limit and limit + 1,
+            after=decode_cursor(cursor, 2),
+            region=region,
+        )
+        indices = paginate(indices, limit, catalog.history_key)
+        if format == "columnar":
+            with log_timing("Convert histories to columnar rep", log=logger.debug):
+                return columnar_rep(catalog, indices, compact=compact)
+        histories_etc = (catalog.history(j) for j in indices)
+        if stream:
+            return json_array_response(
+                iter_collection_rep(
+                    histories_etc,
+                    catalog.vars_by_hx,
+                    compact=compact,
+                    include_uri=include_uri,
+                )
+            )
         with log_timing("Convert histories etc to rep", log=logger.debug):
             return collection_rep(
                 histories_etc,
-                all_vars_by_hx,
+                catalog.vars_by_hx,
                 compact=compact,
                 include_uri=include_uri,
             )
+
+
+def search(body, **kwargs):
+    """
+    Get histories located in a region given in the request body (POST), and
+    return their representation.
+
+    :param body: dict with item `polygon`, a GeoJSON Polygon or MultiPolygon
+        (or a Feature with such a geometry).
+    :param kwargs: Query parameters, as for `collection`.
+    :return: dict
+    """
+    return collection(polygon=body.get("polygon"), **kwargs)
@@ -18,16 +18,26 @@ filtering Networks by province(s))
 - Matches province filter (for collection)
 """
 
-from flask import url_for
 from sqlalchemy import distinct
 from sqlalchemy.sql import func
 from pycds import Network, Station, History
 from sdpb import get_app_session
+from sdpb.util.etag import etagged
+from sdpb.util.catalog import get_catalog_version
 from sdpb.util.query import add_province_filter
+from sdpb.util.uri import uri_for
+
+
+def id_(network):
+    """Sometimes we get a naked id, sometimes we get a database record"""
+    if isinstance(network, int):
+        return network
+    # Assume it is a Network-like object
+    return network.id
 
 
 def uri(network):
-    return url_for("sdpb_api_networks_single", id=network.id)
+    return uri_for("sdpb_api_networks_single", id=id_(network))
 
 
 def single_item_rep(network_etc):
@@ -70,6 +80,7 @@ def base_query(session):
     )
 
 
+@etagged(lambda: get_catalog_version(get_app_session()))
 def collection(provinces=None):
     q = base_query(get_app_session())
     q = add_province_filter(q, provinces)
@@ -5,6 +5,8 @@ This module provides approximate counts of observations per station
 in a specified time period.
 
 Counts are accurate to one-month periods; no finer time resolution is available.
+They are computed from an in-memory cube of monthly counts by station
+(`sdpb.util.count_cube`); the equivalent queries are given here.
 
 Results may be restricted to a subset of stations by specifying `station_ids`.
 """
@@ -17,6 +19,7 @@ from sqlalchemy.sql.expression import cast
 from flask import url_for
 from pycds import ObsCountPerMonthHistory, ClimoObsCount, History
 from sdpb import get_app_session
+from sdpb.util.count_cube import get_count_cube, month_of
 from sdpb.util.query import add_province_filter
 
 logger = logging.getLogger("sdpb")
@@ -121,19 +124,31 @@ def observations_counts_uri(start_date=None, end_date=None, station_ids=None):
 
 
 def get_counts(start_date=None, end_date=None, station_ids=None, provinces=None):
-    session = get_app_session()
-
-    obs_counts_by_station = obs_counts_by_station_query(
-        session,
-        start_date=start_date,
-        end_date=end_date,
+    """
+    Return observation and climatology counts by station, computed from the
+    in-memory count cube (see `sdpb.util.count_cube`). The results are the
+    same as those of `obs_counts_by_station_query` and
+    `climo_counts_by_station_query`.
+    """
+    cube = get_count_cube(get_app_session())
+    province_set = None if provinces is None else set(provinces.split(","))
+
+    obs_counts_by_station = cube.observation_counts(
+        start_month=(
+            month_of(datetime.datetime.fromisoformat(start_date))
+            if start_date
+            else None
+        ),
+        end_month=(
+            month_of(datetime.datetime.fromisoformat(end_date)) if end_date else None
+        ),
         station_ids=station_ids,
-        provinces=provinces,
-    ).all()
+        provinces=province_set,
+    )
 
-    climo_counts_by_station = climo_counts_by_station_query(
-        session, station_ids=station_ids, provinces=provinces
-    ).all()
+    climo_counts_by_station = cube.climatology_counts(
+        station_ids=station_ids, provinces=province_set
+    )
 
     return {
         "uri": observations_counts_uri(
@@ -143,6 +158,6 @@ def get_counts(start_date=None, end_date=None, station_ids=None, provinces=None)
         "start_date": start_date,
         "end_date": end_date,
         "station_ids": station_ids,
-        "observationCounts": {r.station_id: r.total for r in obs_counts_by_station},
-        "climatologyCounts": {r.station_id: r.total for r in climo_counts_by_station},
+        "observationCounts": obs_counts_by_station,
+        "climatologyCounts": climo_counts_by_station,
     }
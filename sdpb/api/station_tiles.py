@@ -0,0 +1,193 @@
+"""
+/stations/tiles API implementation
+
+Station and history locations as Mapbox Vector Tiles (see `sdpb.util.mvt`),
+so that a map can draw tens of thousands of stations without fetching and
+projecting them as JSON.
+
+Each tile has two point layers:
+
+- `stations`: one feature per station, located at the history given by
+  `Catalog.station_location_positions`; feature id is the station id.
+  Properties: `network_id`, `histories` (count), `has_observations`.
+- `histories`: one feature per history; feature id is the history id.
+  Properties: `station_id`, `network_id`, `freq`, `has_observations`,
+  `has_variables`.
+
+Tiles are encoded from the in-memory catalog, as used by `stations.collection`.
+Encoded tiles are cached per zoom level, each level in a byte-bounded LRU
+cache of size `STATION_TILE_CACHE_BYTES`, so that the few, large, low-zoom
+tiles are not evicted by the many small high-zoom tiles. The cache is cleared
+when the catalog changes.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from flask import abort, current_app
+from sdpb import get_app_session
+from sdpb.util import mvt
+from sdpb.util.cache_control import set_cache_control
+from sdpb.util.catalog import get_catalog, refresh_interval
+from sdpb.util.precompressed import Precompressed, precompressed_response
+from sdpb.util.spatial import BBox
+from sdpb.timing import log_timing
+
+
+logger = logging.getLogger("sdpb")
+
+mimetype = "application/vnd.mapbox-vector-tile"
+
+default_max_bytes = 4 * 1024 * 1024
+
+# Points this far (fraction of the tile size) outside a tile are included in
+# it, so that symbols drawn at the edge of a tile are not clipped.
+buffer = 1 / 64
+
+
+def encode_station_tile(catalog, z, x, y):
+    """
+    Return the vector tile `z`/`x`/`y` of the stations and histories in a
+    catalog.
+
+    :param catalog: sdpb.util.catalog.Catalog
+    :param z: Integer. Zoom level.
+    :param x: Integer. Tile column.
+    :param y: Integer. Tile row.
+    :return: bytes
+    """
+    hits = catalog.history_grid.search(BBox(*mvt.tile_bounds(z, x, y, buffer)))
+    history_columns = catalog.history_columns
+    station_columns = catalog.station_columns
+    station_positions = catalog.history_station_positions
+    location_positions = catalog.station_location_positions
+    lons, lats = history_columns["lon"], history_columns["lat"]
+
+    stations = mvt.Layer("stations")
+    histories = mvt.Layer("histories")
+    for j in hits:
+        i = station_positions[j]
+        history_id = history_columns["id"][j]
+        px, py = mvt.project(lons[j], lats[j], z, x, y, histories.extent)
+        histories.add_point(
+            px,
+            py,
+            {
+                "station_id": history_columns["station_id"][j],
+                "network_id": station_columns["network_id"][i],
+                "freq": history_columns["freq"][j],
+                "has_observations": history_columns["max_obs_time"][j] is not None,
+                "has_variables": bool(catalog.vars_by_hx.get(history_id)),
+            },
+            id=history_id,
+        )
+        if location_positions[i] == j:
+            stations.add_point(
+                px,
+                py,
+                {
+                    "network_id": station_columns["network_id"][i],
+                    "histories": station_columns["hx_stop"][i]
+                    - station_columns["hx_start"][i],
+                    "has_observations": station_columns["max_obs_time"][i] is not None,
+                },
+                id=station_columns["id"][i],
+            )
+    return mvt.encode_tile([stations, histories])
+
+
+class VectorTileCache:
+    """
+    Byte-bounded LRU caches of encoded tiles, one per zoom level, for a single
+    catalog version. Thread safe.
+    """
+
+    def __init__(self, max_bytes=default_max_bytes):
+        """
+        :param max_bytes: Integer. Maximum size of the tiles cached for each
+            zoom level.
+        """
+        self.max_bytes = max_bytes
+        self.version = None
+        self._levels = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def size(self, z):
+        """Return the size of the tiles cached for zoom level `z`."""
+        return self._sizes.get(z, 0)
+
+    def get(self, version, z, x, y):
+        """
+        Return the tile cached for catalog version `version`, or None. A
+        different version clears the cache.
+        """
+        with self._lock:
+            if version != self.version:
+                self._levels.clear()
+                self._sizes.clear()
+                self.version = version
+                return None
+            level = self._levels.get(z, {})
+            tile = level.get((x, y))
+            if tile is not None:
+                level.move_to_end((x, y))
+            return tile
+
+    def put(self, version, z, x, y, tile):
+        """Cache `tile` (Precompressed), unless it is for another version."""
+        if tile.size > self.max_bytes:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            level = self._levels.setdefault(z, OrderedDict())
+            previous = level.pop((x, y), None)
+            size = self.size(z) - (previous.size if previous else 0) + tile.size
+            level[(x, y)] = tile
+            while size > self.max_bytes:
+                _, evicted = level.popitem(last=False)
+                size -= evicted.size
+            self._sizes[z] = size
+
+    def clear(self):
+        with self._lock:
+            self._levels.clear()
+            self._sizes.clear()
+            self.version = None
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the tile cache, or None if it is disabled."""
+    global _cache
+    max_bytes = current_app.config.get("STATION_TILE_CACHE_BYTES", default_max_bytes)
+    if not max_bytes:
+        return None
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = VectorTileCache(max_bytes)
+    return _cache
+
+
+def station_tile(catalog, z, x, y):
+    """Return tile `z`/`x`/`y` (Precompressed), from the cache if possible."""
+    cache = get_cache()
+    tile = cache and cache.get(catalog.version, z, x, y)
+    if tile is None:
+        with log_timing(f"Encode station tile {z}/{x}/{y}", log=logger.debug):
+            tile = Precompressed.of(encode_station_tile(catalog, z, x, y))
+        if cache is not None:
+            cache.put(catalog.version, z, x, y, tile)
+    return tile
+
+
+def tile(z=None, x=None, y=None):
+    if not mvt.is_tile(z, x, y):
+        abort(404, description=f"No such tile: {z}/{x}/{y}")
+    catalog = get_catalog(get_app_session())
+    set_cache_control(public=True, max_age=refresh_interval())
+    return precompressed_response(station_tile(catalog, z, x, y), mimetype=mimetype)
@@ -16,8 +16,9 @@ start date and end data are provided as URL parameters
 
 import logging
 import datetime
-from flask import url_for
+from flask import json, url_for
 from sqlalchemy import func
+from sqlalchemy.orm.exc import NoResultFound
 from pycds import (
     Station,
     History,
@@ -32,13 +33,19 @@ from sdpb.api import histories
 from sdpb.api import variables
 from sdpb.util.representation import date_rep, is_expanded
 from sdpb.util.query import (
-    get_all_histories_etc_by_station,
-    get_all_vars_by_hx,
     add_station_network_publish_filter,
     add_province_filter,
 )
+from sdpb.util.downsampling import downsample
+from sdpb.util.json_provider import datetime_rep
+from sdpb.util.parallel_queries import parallel_queries
+from sdpb.util.streaming import streamed_response, text_chunks
+from sdpb.util.tile_cache import get_tile_cache
+from sdpb.util.uri import uri_for
 from sdpb.timing import log_timing
-from sdpb.api.stations import single_item_rep
+
+
+logger = logging.getLogger("sdpb")
 
 ####
 # /stations/{station_id}/variables/{var_id}
@@ -65,6 +72,25 @@ def station_variable_timespan_query(session, station_id, var_id):
     )
 
 
+def station_variable_rep(station_id, variable, tags, timespan):
+    """
+    Return representation of a variable in the context of a station: the usual
+    variable representation plus the timespan of its observations at the
+    station.
+
+    :param station_id: (int) Station id
+    :param variable: Variable
+    :param tags: (list) Variable tags
+    :param timespan: Object with attributes `min_obs_time`, `max_obs_time`.
+    :return: dict
+    """
+    var = variables.single_item_rep(variable, tags)
+    var["min_obs_time"] = timespan.min_obs_time
+    var["max_obs_time"] = timespan.max_obs_time
+    var["station_id"] = station_id
+    return var
+
+
 def get_station_variable(station_id, var_id):
     """
     Metadata about a variable specifically in the context of a station.
@@ -75,12 +101,10 @@ def get_station_variable(station_id, var_id):
     assert var_id is not None, "var_id must be specified"
     session = get_app_session()
     timespan = station_variable_timespan_query(session, station_id, var_id).one()
-
-    var = variables.single(var_id)
-    var["min_obs_time"] = timespan.min_obs_time
-    var["max_obs_time"] = timespan.max_obs_time
-    var["station_id"] = station_id
-    return var
+    row = (
+        variables.published_variables_query(session).filter(Variable.id == var_id).one()
+    )
+    return station_variable_rep(station_id, row.Variable, row.tags, timespan)
 
 
 ####
@@ -88,39 +112,81 @@ def get_station_variable(station_id, var_id):
 ####
 
 
+def station_variables_timespan_query(session, station_id):
+    """
+    Returns a query with the minimum and maximum timestamps for
+    observations of each variable at this station, as in
+    `station_variable_timespan_query`, over all the station's histories.
+    Rows have attributes `vars_id`, `min_obs_time`, `max_obs_time`, and
+    `has_stats`, which is true if any of the station's histories with the
+    variable has observation stats.
+    """
+    return (
+        session.query(
+            VarsPerHistory.vars_id.label("vars_id"),
+            func.min(VarsPerHistory.start_time).label("min_obs_time"),
+            func.max(VarsPerHistory.end_time).label("max_obs_time"),
+            func.bool_or(StationObservationStats.history_id.isnot(None)).label(
+                "has_stats"
+            ),
+        )
+        .select_from(History)
+        .join(VarsPerHistory, VarsPerHistory.history_id == History.id)
+        .outerjoin(
+            StationObservationStats,
+            StationObservationStats.history_id == History.id,
+        )
+        .filter(History.station_id == station_id)
+        .group_by(VarsPerHistory.vars_id)
+    )
+
+
 def get_station_variables(station_id=None):
+    """
+    Metadata about all variables of a station, as in
+    /stations/{station_id}/variables/{var_id}.
+
+    The variables are those of the station's histories with observation
+    stats (as in the /stations/{id} representation); the timespan of each
+    is over all the station's histories. As for a single station variable,
+    a variable that is not published is an error.
+
+    The response is built from a fixed number of queries, independent of the
+    number of variables: one for the station, one for the timespans of all
+    its variables, and one for the variables themselves.
+    """
     assert station_id is not None
     session = get_app_session()
     q = session.query(Station).select_from(Station).filter(Station.id == station_id)
     q = add_station_network_publish_filter(q)
     station = q.one()
-    station_histories_etc = (
-        session.query(History, StationObservationStats)
-        .select_from(History)
-        .join(
-            StationObservationStats,
-            StationObservationStats.history_id == History.id,
-        )
-        .filter_by(station_id=station_id)
-        .order_by(History.id)
-        .all()
-    )
-    all_vars_by_hx = get_all_vars_by_hx(session)
-
-    vars_by_history = single_item_rep(
-        station,
-        station_histories_etc,
-        all_vars_by_hx,
-        compact=True,
-        expand="histories",
-    )
 
-    variables = [h["variable_ids"] for h in vars_by_history["histories"]]
-    variables = set([v for h in variables for v in h])
+    with log_timing("Query station variable timespans", log=logger.debug):
+        timespans = {
+            row.vars_id: row
+            for row in station_variables_timespan_query(session, station.id)
+            if row.has_stats
+        }
+
+    with log_timing("Query station variables", log=logger.debug):
+        rows = (
+            variables.published_variables_query(session)
+            .filter(Variable.id.in_(list(timespans)))
+            .order_by(Variable.id)
+            .all()
+        )
+    unpublished = timespans.keys() - {row.Variable.id for row in rows}
+    if unpublished:
+        raise NoResultFound(f"Variables {sorted(unpublished)} are not published")
 
     return {
         "station_id": station_id,
-        "variables": [get_station_variable(station_id, v) for v in variables],
+        "variables": [
+            station_variable_rep(
+                station_id, row.Variable, row.tags, timespans[row.Variable.id]
+            )
+            for row in rows
+        ],
     }
 
 
@@ -144,7 +210,7 @@ def obs_values_by_station_query(
 ):
     """
     Return a query for observations over a range. The query can include filters
-    for start and end date, stations of interest, and province(s) of interest.
+    for start and end date. Rows have attributes `time` and `datum`.
 
     :param session: SQLAlchemy db session
     :param station_id: (int) Station id
@@ -154,14 +220,14 @@ def obs_values_by_station_query(
     :return: SQLAchemy query object
     """
 
-    # Fundamental query: Sum observation counts by month and history id over history
-    # id's for each station, yielding counts per station.
+    # Select only the columns needed, so that rows are lightweight and can be
+    # streamed from a server-side cursor (see `export_observations`).
     q = (
-        session.query(Obs)
-        .filter(Variable.id == var_id)
+        session.query(Obs.time.label("time"), Obs.datum.label("datum"))
+        .select_from(Obs)
+        .join(History, Obs.history_id == History.id)
+        .filter(Obs.vars_id == var_id)
         .filter(History.station_id == station_id)
-        .join(History)
-        .join(Variable)
         .order_by(Obs.time)
     )
 
@@ -174,7 +240,133 @@ def obs_values_by_station_query(
     return q
 
 
-def get_observations(station_id, var_id, start_date=None, end_date=None):
+def start_of_day(date):
+    """Return the start (datetime) of the day of a date or datetime."""
+    return datetime.datetime(date.year, date.month, date.day)
+
+
+def observation_series(session, station_id, var_id, start_date, end_date):
+    """
+    Return the observations of a station variable over a range, from the
+    observation tile cache if it is enabled (see `sdpb.util.tile_cache`).
+    Rows have attributes `time` and `datum`, and are in time order.
+
+    The range is the same as for `obs_values_by_station_query`: from the
+    start of the day of `start_date` to the start of the day of `end_date`,
+    inclusive.
+
+    :param session: SQLAlchemy db session
+    :param station_id: (int) Station id
+    :param var_id: (int) Variable id
+    :param start_date: (date or datetime) Start date for observations.
+    :param end_date: (date or datetime) End date for observations.
+    :return: list
+    """
+    cache = get_tile_cache()
+    if cache is None:
+        return obs_values_by_station_query(
+            session,
+            station_id=station_id,
+            var_id=var_id,
+            start_date=start_date,
+            end_date=end_date,
+        ).all()
+
+    def fetch(lo, hi):
+        return (
+            obs_values_by_station_query(
+                session,
+                station_id=station_id,
+                var_id=var_id,
+                start_date=None,
+                end_date=None,
+            )
+            .filter(Obs.time >= lo, Obs.time < hi)
+            .all()
+        )
+
+    return cache.series(
+        (int(station_id), int(var_id)),
+        start_of_day(start_date),
+        start_of_day(end_date),
+        fetch,
+    )
+
+
+# Number of rows fetched at a time from the server-side cursor when exporting.
+export_batch_size = 10000
+
+
+def csv_lines(rows):
+    """Yield the lines of the CSV export of observation rows."""
+    yield "time,value\n"
+    for row in rows:
+        value = "" if row.datum is None else repr(row.datum)
+        yield f"{datetime_rep(row.time)},{value}\n"
+
+
+def ndjson_lines(rows):
+    """Yield the lines of the NDJSON export of observation rows."""
+    for row in rows:
+        yield json.dumps(
+            {"time": row.time, "value": row.datum}, separators=(",", ":")
+        ) + "\n"
+
+
+# Export formats: line generator and mimetype.
+export_formats = {
+    "csv": (csv_lines, "text/csv"),
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+}
+
+
+def export_observations(
+    station_id, var_id, start_date=None, end_date=None, format="csv"
+):
+    """
+    Return a streamed response containing all the observations for a station
+    and variable over a range, in CSV or NDJSON format.
+
+    Unlike the JSON representation, the range is not limited. Rows are read
+    from a server-side cursor and written as they arrive, so memory use does
+    not depend on the size of the range.
+
+    :param station_id: (int) Station id
+    :param var_id: (int) Variable id
+    :param start_date: (str) Start date for observations. Default: earliest.
+    :param end_date: (str) End date for observations. Default: latest.
+    :param format: (str) "csv" or "ndjson".
+    :return: flask.Response
+    """
+    lines, mimetype = export_formats[format]
+    session = get_app_session()
+    # Fail before streaming starts if the station or variable does not exist.
+    station = session.query(Station).filter(Station.id == station_id).one()
+    variable = session.query(Variable).filter(Variable.id == var_id).one()
+    rows = obs_values_by_station_query(
+        session,
+        station_id=station.id,
+        var_id=variable.id,
+        start_date=datetime.datetime.fromisoformat(start_date) if start_date else None,
+        end_date=datetime.datetime.fromisoformat(end_date) if end_date else None,
+    ).yield_per(export_batch_size)
+    filename = f"station-{station.id}-variable-{variable.id}-observations.{format}"
+    return streamed_response(
+        text_chunks(lines(rows)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def get_observations(
+    station_id,
+    var_id,
+    start_date=None,
+    end_date=None,
+    format=None,
+    max_points=None,
+    downsample_method="lttb",
+):
     """
     Return a dict containing observations for a station and variable over a range.
 
@@ -187,11 +379,23 @@ def get_observations(station_id, var_id, start_date=None, end_date=None):
     :param var_id: (int) Variable id
     :param start_date: (datetime) Start date for observations.
     :param end_date: (datetime) End date for observations.
+    :param format: (str) "csv" or "ndjson" to export all observations in the
+        range, without the 26-week limit (see `export_observations`); anything
+        else for the JSON representation.
+    :param max_points: (int) If specified, downsample the observations to at
+        most this many points (see `sdpb.util.downsampling`). Observations
+        with no value are omitted from a downsampled series.
+    :param downsample_method: (str) Downsampling method: "lttb" or "minmax".
     :return: dict
     """
     assert station_id is not None, "station_id must be specified"
     assert var_id is not None, "var_id must be specified"
 
+    if format in export_formats:
+        return export_observations(
+            station_id, var_id, start_date=start_date, end_date=end_date, format=format
+        )
+
     start_date_obj = datetime.datetime.fromisoformat(start_date) if start_date else None
     end_date_obj = datetime.datetime.fromisoformat(end_date) if end_date else None
 
@@ -208,16 +412,27 @@ def get_observations(station_id, var_id, start_date=None, end_date=None):
 
     session = get_app_session()
 
-    obs_vals_by_station = obs_values_by_station_query(
+    # Independent queries; run concurrently where possible.
+    obs_vals_by_station, station, variable = parallel_queries(
         session,
-        station_id=station_id,
-        var_id=var_id,
-        start_date=start_date_obj,
-        end_date=end_date_obj,
-    ).all()
+        lambda s: observation_series(
+            s, station_id, var_id, start_date_obj, end_date_obj
+        ),
+        lambda s: s.query(Station).filter(Station.id == station_id).one(),
+        lambda s: s.query(Variable).filter(Variable.id == var_id).one(),
+    )
 
-    station = session.query(Station).filter(Station.id == station_id).one()
-    variable = session.query(Variable).filter(Variable.id == var_id).one()
+    downsampling = None
+    if max_points is not None:
+        obs_vals_by_station = [o for o in obs_vals_by_station if o.datum is not None]
+        indices, bucket_size = downsample(
+            [o.time for o in obs_vals_by_station],
+            [o.datum for o in obs_vals_by_station],
+            max_points,
+            method=downsample_method,
+        )
+        obs_vals_by_station = [obs_vals_by_station[i] for i in indices]
+        downsampling = {"method": downsample_method, "bucket_size": bucket_size}
 
     return {
         "uri": observations_span_uri(
@@ -227,16 +442,17 @@ def get_observations(station_id, var_id, start_date=None, end_date=None):
         "end_date": end_date_obj,
         "station": {
             "id": station.id,
-            "uri": url_for("sdpb_api_stations_single", id=station.id),
-            "network_uri": networks.uri(station.network),
+            "uri": uri_for("sdpb_api_stations_single", id=station.id),
+            "network_uri": networks.uri(station.network_id),
         },
         "variable": {
             "id": variable.id,
-            "uri": url_for("sdpb_api_variables_single", id=variable.id),
+            "uri": uri_for("sdpb_api_variables_single", id=variable.id),
             "name": variable.display_name,
             "unit": variable.unit,
         },
         "observations": [
             {"value": o.datum, "time": o.time} for o in obs_vals_by_station
         ],  # list of observations
+        "downsampling": downsampling,
     }
@@ -23,7 +23,6 @@ Stations returned are always filtered by:
 """
 import logging
 import datetime
-from flask import url_for
 from sqlalchemy import func
 from pycds import (
     Station,
@@ -37,13 +36,18 @@ from sdpb import get_app_session
 from sdpb.api import networks
 from sdpb.api import histories
 from sdpb.api import variables
-from sdpb.util.representation import date_rep, is_expanded
+from sdpb.util import spatial
+from sdpb.util.representation import date_rep, is_expanded, sparse_rep
 from sdpb.util.query import (
-    get_all_histories_etc_by_station,
-    get_all_vars_by_hx,
+    base_history_query,
+    get_station_vars_by_hx,
     add_station_network_publish_filter,
-    add_province_filter,
 )
+from sdpb.util.catalog import get_catalog
+from sdpb.util.cursor import decode_cursor, paginate
+from sdpb.util.etag import etagged
+from sdpb.util.streaming import json_array_response
+from sdpb.util.uri import uri_for
 from sdpb.timing import log_timing
 
 
@@ -52,7 +56,7 @@ logger = logging.getLogger("sdpb")
 
 def uri(station):
     """Return uri for a station"""
-    return url_for("sdpb_api_stations_single", id=station.id)
+    return uri_for("sdpb_api_stations_single", id=station.id)
 
 
 def single_item_rep(
@@ -65,12 +69,13 @@ def single_item_rep(
     """
     Return a representation of a single station item.
 
-    :param station_etc: Database result containing a Station.
+    :param station_etc: Database result containing a Station, or a catalog
+        `StationRecord`.
     :param station_histories_etc: Iterable containing histories etc.,
         associated with the station. For definition of histories etc.,
         see histories module.
-    :param all_vars_by_hx: dict of variables associated to each history,
-        keyed by history id.
+    :param all_vars_by_hx: Mapping (dict or `VarsByHistory`) of variables
+        associated to each history, keyed by history id.
     :param compact: Boolean. Return compact or full representation.
     :return: dict
     """
@@ -95,7 +100,7 @@ def single_item_rep(
         "id": station.id,
         "uri": uri(station),
         "native_id": station.native_id,
-        "network_uri": networks.uri(station.network),
+        "network_uri": networks.uri(station.network_id),
         "histories": histories_rep,
     }
     if compact:
@@ -123,8 +128,8 @@ def collection_item_rep(
     :param station_histories_etc: Iterable containing histories etc.,
         associated with the station. For definition of histories etc.,
         see histories module.
-    :param all_vars_by_hx: dict of variables associated to each history,
-        keyed by history id.
+    :param all_vars_by_hx: Mapping (dict or `VarsByHistory`) of variables
+        associated to each history, keyed by history id.
     :param compact: Boolean. Return compact or full representation.
     :return: dict
     """
@@ -137,7 +142,7 @@ def collection_item_rep(
     )
 
 
-def collection_rep(
+def iter_collection_rep(
     stations,
     all_histories_etc_by_station,
     all_vars_by_hx=None,
@@ -145,18 +150,10 @@ def collection_rep(
     expand=None,
 ):
     """
-    Return a representation of a stations collection.
+    Yield the representations of the items of a stations collection, in the
+    order of `stations`. Parameters are as for `collection_rep`.
 
-    :param stations: Iterable. Each item is a database result from a
-        Station query.
-    :param all_histories_etc_by_station: dict of histories etc. assocated to
-        each station, keyed by station id.
-    :param all_vars_by_hx: dict of variables associated to each history,
-        keyed by history id.
-    :param compact: Boolean. Return compact or full representation of each
-        station.
-    :param expand:
-    :return: dict
+    :return: generator of dict
     """
 
     def histories_etc_for(station_etc):
@@ -176,7 +173,7 @@ def collection_rep(
                 result = []
         return result
 
-    return [
+    return (
         collection_item_rep(
             station,
             histories_etc_for(station),
@@ -185,7 +182,39 @@ def collection_rep(
             expand=expand,
         )
         for station in stations
-    ]
+    )
+
+
+def collection_rep(
+    stations,
+    all_histories_etc_by_station,
+    all_vars_by_hx=None,
+    compact=False,
+    expand=None,
+):
+    """
+    Return a representation of a stations collection.
+
+    :param stations: Iterable. Each item is a database result from a
+        Station query.
+    :param all_histories_etc_by_station: dict of histories etc. assocated to
+        each station, keyed by station id.
+    :param all_vars_by_hx: Mapping (dict or `VarsByHistory`) of variables
+        associated to each history, keyed by history id.
+    :param compact: Boolean. Return compact or full representation of each
+        station.
+    :param expand:
+    :return: dict
+    """
+    return list(
+        iter_collection_rep(
+            stations,
+            all_histories_etc_by_station,
+            all_vars_by_hx=all_vars_by_hx,
+            compact=compact,
+            expand=expand,
+        )
+    )
 
 
 ####
@@ -200,17 +229,14 @@ def single(id=None, compact=True, expand="histories"):
     q = add_station_network_publish_filter(q)
     station = q.one()
     station_histories_etc = (
-        session.query(History, StationObservationStats)
-        .select_from(History)
-        .join(
-            StationObservationStats,
-            StationObservationStats.history_id == History.id,
-        )
-        .filter_by(station_id=id)
+        base_history_query(session)
+        .filter(History.station_id == id)
+        # Only histories with observation stats.
+        .filter(StationObservationStats.history_id.isnot(None))
         .order_by(History.id)
         .all()
     )
-    all_vars_by_hx = get_all_vars_by_hx(session)
+    all_vars_by_hx = get_station_vars_by_hx(session, id)
     return single_item_rep(
         station,
         station_histories_etc,
@@ -225,6 +251,55 @@ def single(id=None, compact=True, expand="histories"):
 ####
 
 
+# Fields of the compact and full columnar representations.
+compact_fields = ("id", "native_id", "network_id")
+full_fields = compact_fields + ("min_obs_time", "max_obs_time")
+
+
+def columnar_rep(catalog, indices, provinces=None, compact=False, expand=None):
+    """
+    Return the columnar representation of the stations at positions
+    `indices` in the catalog: a single object of parallel arrays, one per
+    field. Networks are given by id rather than by URI.
+
+    `histories` is in sparse form (see `sparse_rep`): the histories of all
+    stations, concatenated, and the offsets of each station's histories.
+    If histories are expanded, they are in columnar form (see
+    `histories.columnar_rep`); otherwise they are history ids.
+
+    :param catalog: Catalog
+    :param indices: Sequence of positions of stations in the catalog.
+    :param provinces: String, comma-separated list of provinces. Include only
+        the histories in these provinces.
+    :param compact: Boolean. Return compact or full representation.
+    :param expand: Associated items to expand. Valid values: "histories".
+    :return: dict
+    """
+    rep = {
+        name: catalog.station_column(name, indices)
+        for name in (compact_fields if compact else full_fields)
+    }
+    for name in ("min_obs_time", "max_obs_time"):
+        if name in rep:
+            rep[name] = [date_rep(value) for value in rep[name]]
+    if is_expanded("histories", expand):
+
+        def histories_rep(positions):
+            return histories.columnar_rep(catalog, positions, compact=compact)
+
+    else:
+
+        def histories_rep(positions):
+            return catalog.history_column("id", positions)
+
+    rep["histories"] = sparse_rep(
+        (catalog.station_history_indices(i, provinces) for i in indices),
+        values_rep=histories_rep,
+    )
+    return rep
+
+
+@etagged(lambda: get_catalog(get_app_session()).version)
 def collection(
     stride=None,
     limit=None,
@@ -232,9 +307,15 @@ def collection(
     provinces=None,
     compact=True,
     expand="histories",
+    stream=False,
+    cursor=None,
+    format=None,
+    bbox=None,
+    polygon=None,
 ):
     """
-    Get stations from database, and return their representation.
+    Get stations from the catalog (see `sdpb.util.catalog`), and return their
+    representation.
 
     :param stride: Integer. Include only (roughly) every stride-th station.
     :param limit: Integer. Maximum number of results.
@@ -245,49 +326,72 @@ def collection(
         occurs in list.
     :param compact: Boolean. Return compact rep?
     :param expand: Associated items to expand. Valid values: "histories".
+    :param stream: Boolean. Return a streamed response (see
+        `sdpb.util.streaming`).
+    :param cursor: String. Opaque cursor (see `sdpb.util.cursor`) from the
+        next-page link of a previous response. Return only stations after
+        the last station of that response.
+    :param format: String. "columnar" for the columnar representation (see
+        `columnar_rep`); anything else for the usual list of items. The
+        columnar representation is not streamed.
+    :param bbox: String, "min_lon,min_lat,max_lon,max_lat". If present, return
+        only stations with a history located in this box.
+    :param polygon: GeoJSON Polygon or MultiPolygon (see `search`). If
+        present, return only stations with a history located in it.
     :return: list of dict
     """
     # TODO: Add include_uri param. See histories.
     logger.debug(
         f"stations.list(stride={stride}, limit={limit}, offset={offset}, "
-        f"provinces={provinces}, compact={compact}, expand={expand})"
+        f"provinces={provinces}, compact={compact}, expand={expand}, "
+        f"stream={stream}, cursor={cursor}, format={format}, bbox={bbox})"
     )
     session = get_app_session()
     expand_histories = is_expanded("histories", expand)
+    region = spatial.region(bbox=bbox, polygon=polygon)
 
     with log_timing("List all stations", log=logger.debug):
         with log_timing("Query all stations", log=logger.debug):
-            # Note: Station is always joined with History, and stations with
-            # no associated history records are not returned.
+            # Note: Stations with no associated history records are not
+            # returned.
+            catalog = get_catalog(session)
+            indices = catalog.station_indices(
+                provinces=provinces,
+                stride=stride,
+                limit=limit and limit + 1,
+                offset=offset,
+                after=decode_cursor(cursor, 1),
+                region=region,
+            )
+            indices = paginate(indices, limit, catalog.station_key)
+            if format == "columnar":
+                return columnar_rep(
+                    catalog,
+                    indices,
+                    provinces=provinces,
+                    compact=compact,
+                    expand=expand,
+                )
+            stations = (catalog.station(i, provinces) for i in indices)
             if expand_histories:
-                stations_query = session.query(Station).select_from(Station).distinct()
-                all_histories_etc_by_station = get_all_histories_etc_by_station(
-                    session, provinces=provinces
+                all_histories_etc_by_station = catalog.histories_by_station(
+                    provinces=provinces
                 )
-                all_vars_by_hx = get_all_vars_by_hx(session)
+                all_vars_by_hx = catalog.vars_by_hx
             else:
-                stations_query = (
-                    session.query(
-                        Station, func.array_agg(History.id).label("history_ids")
-                    )
-                    .select_from(Station)
-                    .group_by(Station.id)
-                )
                 all_histories_etc_by_station = None
                 all_vars_by_hx = None
-            stations_query = stations_query.join(
-                History, History.station_id == Station.id
+
+        if stream:
+            return json_array_response(
+                iter_collection_rep(
+                    stations,
+                    all_histories_etc_by_station,
+                    all_vars_by_hx=all_vars_by_hx,
+                    compact=compact,
+                    expand=expand,
+                )
             )
-            stations_query = add_station_network_publish_filter(stations_query)
-            stations_query = add_province_filter(stations_query, provinces)
-            stations_query = stations_query.order_by(Station.id.asc())
-            if stride:
-                stations_query = stations_query.filter(Station.id % stride == 0)
-            if limit:
-                stations_query = stations_query.limit(limit)
-            if offset:
-                stations_query = stations_query.offset(offset)
-            stations = stations_query.all()
 
         with log_timing("Convert stations to rep", log=logger.debug):
             return collection_rep(
@@ -297,3 +401,123 @@ def collection(
                 compact=compact,
                 expand=expand,
             )
+
+
+def search(body, **kwargs):
+    """
+    Get stations located in a region given in the request body (POST), and
+    return their representation.
+
+    :param body: dict with item `polygon`, a GeoJSON Polygon or MultiPolygon
+        (or a Feature with such a geometry).
+    :param kwargs: Query parameters, as for `collection`.
+    :return: list of dict
+    """
+    return collection(polygon=body.get("polygon"), **kwargs)
+
+
+####
+# /stations/nearest
+####
+
+
+def nearest_station_indices(
+    catalog, lon, lat, k, variable_id=None, freq=None, provinces=None
+):
+    """
+    Return the positions of the `k` stations nearest to a point that have a
+    history matching the filters, with their distances, nearest first. The
+    distance of a station is that of its nearest matching history.
+
+    :param catalog: Catalog
+    :param lon: Longitude (degrees).
+    :param lat: Latitude (degrees).
+    :param k: Integer. Number of stations.
+    :param variable_id: Integer. If present, only histories with this variable
+        match.
+    :param freq: String. If present, only histories with this frequency match.
+    :param provinces: String, comma-separated list of provinces. If present,
+        only histories with one of these provinces match.
+    :return: list of (station position, distance in km)
+    """
+    tests = []
+    if variable_id is not None:
+        history_ids = set(catalog.vars_by_hx.histories_for(variable_id))
+        id_column = catalog.history_columns["id"]
+        tests.append(lambda j: id_column[j] in history_ids)
+    if freq is not None:
+        freq_column = catalog.history_columns["freq"]
+        tests.append(lambda j: freq_column[j] == freq)
+    if provinces is not None:
+        province_set = set(provinces.split(","))
+        province_column = catalog.history_columns["province"]
+        tests.append(lambda j: province_column[j] in province_set)
+
+    def accept(j):
+        return all(test(j) for test in tests)
+
+    result = {}
+    for distance, j in catalog.history_tree.nearest(
+        lon, lat, accept=accept if tests else None
+    ):
+        if len(result) == k:
+            break
+        result.setdefault(catalog.history_station_positions[j], distance)
+    return list(result.items())
+
+
+def nearest(
+    lon,
+    lat,
+    k=10,
+    variable_id=None,
+    freq=None,
+    provinces=None,
+    compact=True,
+    expand="histories",
+):
+    """
+    Get the stations nearest to a point that have a history matching the
+    filters, and return their representation, nearest first. Each item is
+    the representation of the station in the stations collection, with the
+    additional attribute `distance` (km) to its nearest matching history.
+
+    :param lon: Longitude (degrees).
+    :param lat: Latitude (degrees).
+    :param k: Integer. Number of stations.
+    :param variable_id: Integer. Only stations with a history reporting this
+        variable.
+    :param freq: String. Only stations with a history with this frequency.
+    :param provinces: String, comma-separated list of provinces.
+    :param compact: Boolean. Return compact rep?
+    :param expand: Associated items to expand. Valid values: "histories".
+    :return: list of dict
+    """
+    catalog = get_catalog(get_app_session())
+    with log_timing("Find nearest stations", log=logger.debug):
+        nearest_stations = nearest_station_indices(
+            catalog,
+            lon,
+            lat,
+            k,
+            variable_id=variable_id,
+            freq=freq,
+            provinces=provinces,
+        )
+    if is_expanded("histories", expand):
+        all_histories_etc_by_station = catalog.histories_by_station(provinces=provinces)
+        all_vars_by_hx = catalog.vars_by_hx
+    else:
+        all_histories_etc_by_station = None
+        all_vars_by_hx = None
+    items = iter_collection_rep(
+        (catalog.station(i, provinces) for i, _ in nearest_stations),
+        all_histories_etc_by_station,
+        all_vars_by_hx=all_vars_by_hx,
+        compact=compact,
+        expand=expand,
+    )
+    return [
+        {**item, "distance": distance}
+        for item, (_, distance) in zip(items, nearest_stations)
+    ]
@@ -1,4 +1,3 @@
-from flask import url_for
 from sqlalchemy import distinct, func, text
 from sqlalchemy.dialects.postgresql import ARRAY, TEXT
 
@@ -6,7 +5,10 @@ from pycds import Network, Variable, Station, History
 
 from sdpb import get_app_session
 from sdpb.api import networks
+from sdpb.util.etag import etagged
+from sdpb.util.catalog import get_catalog_version
 from sdpb.util.query import add_province_filter
+from sdpb.util.uri import uri_for
 
 
 def id_(variable):
@@ -18,7 +20,7 @@ def id_(variable):
 
 
 def uri(variable):
-    return url_for("sdpb_api_variables_single", id=id_(variable))
+    return uri_for("sdpb_api_variables_single", id=id_(variable))
 
 
 # Invoke the user-defined database function variable_tags on the Variable table.
@@ -37,21 +39,27 @@ def single_item_rep(variable, tags):
         "cell_method": variable.cell_method,
         "unit": variable.unit,
         "precision": variable.precision,
-        "network_uri": networks.uri(variable.network),
+        "network_uri": networks.uri(variable.network_id),
         "tags": tags,
     }
 
 
-def single(id=None):
-    assert id is not None
-    row = (
-        get_app_session()
-        .query(Variable, variable_tags.label("tags"))
+def published_variables_query(session):
+    """
+    Return a query for published variables (those in a published network), with
+    their tags. Rows have attributes `Variable` and `tags`.
+    """
+    return (
+        session.query(Variable, variable_tags.label("tags"))
         .select_from(Variable)
         .join(Network, Variable.network_id == Network.id)
-        .filter(Variable.id == id, Network.publish == True)
-        .one()
+        .filter(Network.publish == True)
     )
+
+
+def single(id=None):
+    assert id is not None
+    row = published_variables_query(get_app_session()).filter(Variable.id == id).one()
     return single_item_rep(row.Variable, row.tags)
 
 
@@ -66,6 +74,7 @@ def collection_rep(rows):
     return [collection_item_rep(row.Variable, row.tags) for row in rows]
 
 
+@etagged(lambda: get_catalog_version(get_app_session()))
 def collection(provinces=None):
     """Get variables from database, and return their representation."""
     session = get_app_session()
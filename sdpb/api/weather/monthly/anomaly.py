@@ -0,0 +1,74 @@
+"""
+/weather/monthly/anomaly API implementation
+
+Monthly weather anomalies by station: the monthly weather statistic (see
+`weather`) less the climate baseline value for the same month (see
+`baseline`), for each history having both.
+
+This saves the client fetching both full collections and joining them. The
+join is a single pass over the weather items, looking up each history's
+baseline value in a dict; both inputs come from their in-memory caches when
+those are enabled.
+"""
+from sdpb import get_app_session
+from sdpb.api.weather.monthly import baseline, weather
+from sdpb.util.cache_control import set_cache_control
+
+
+# Keys of the weather item copied to an anomaly item.
+weather_keys = (
+    "network_name",
+    "station_db_id",
+    "station_native_id",
+    "history_db_id",
+    "station_name",
+    "lon",
+    "lat",
+    "elevation",
+    "statistic",
+)
+
+
+def anomaly_item(weather_item, baseline_datum):
+    """
+    Return an anomaly item from a weather collection item and the baseline
+    value for its history.
+    """
+    item = {key: weather_item[key] for key in weather_keys}
+    statistic = item["statistic"]
+    item["baseline"] = baseline_datum
+    item["anomaly"] = (
+        None
+        if statistic is None or baseline_datum is None
+        else float(statistic) - float(baseline_datum)
+    )
+    item["data_coverage"] = weather_item["data_coverage"]
+    return item
+
+
+def anomalies(weather_items, baseline_datums):
+    """
+    Return the anomaly items for the weather items whose histories have a
+    baseline value.
+
+    :param weather_items: Iterable of weather collection items (dicts).
+    :param baseline_datums: dict of history id to baseline datum.
+    :return: list of dict
+    """
+    return [
+        anomaly_item(item, baseline_datums[item["history_db_id"]])
+        for item in weather_items
+        if item["history_db_id"] in baseline_datums
+    ]
+
+
+def collection(variable=None, year=None, month=None):
+    session = get_app_session()
+    closed = weather.is_closed(year, month)
+    set_cache_control(
+        public=True, max_age=min(weather.cache_ttl(closed), baseline.cache_ttl())
+    )
+    return anomalies(
+        weather.cached_collection_rep(session, variable, year, month, closed),
+        baseline.datums(session, variable, month),
+    )
@@ -1,13 +1,60 @@
+"""
+/weather/monthly/baseline API implementation
+
+Climate baseline (climatology) values by station, for a variable and month.
+
+There are only 36 baseline collections (3 variables x 12 months), and the
+climatology they are drawn from rarely changes. Selecting one collection
+filters `DerivedValue` by `date_part('month', time)`, which no index serves,
+so instead all 36 are loaded with a single query, on first use or at startup
+(`warm_up`), and held in memory as serialized and gzip-compressed response
+bodies (`BaselineStore`). Each is served with a strong ETag computed from its
+body and with `Cache-Control: max-age` of `BASELINE_CACHE_TTL`, after which
+the store is reloaded.
+"""
+import logging
+import threading
+from time import monotonic
+from flask import current_app, json
 from sqlalchemy import func, cast, Float
 from pycds import Network, Station, History, Variable, DerivedValue
 from pycds.climate_baseline_helpers import pcic_climate_variable_network_name
 from sdpb import get_app_session
-from sdpb.util.representation import dict_from_row
+from sdpb.util.cache_control import set_cache_control
+from sdpb.util.precompressed import Precompressed, precompressed_response
+from sdpb.timing import log_timing
+
+
+logger = logging.getLogger("sdpb")
+
+variables = ("tmax", "tmin", "precip")
+months = tuple(range(1, 13))
+
+db_variable_names = {
+    "tmax": "Tx_Climatology",
+    "tmin": "Tn_Climatology",
+    "precip": "Precip_Climatology",
+}
+
+default_cache_ttl = 24 * 60 * 60
+
+# Keys of a collection item, in order.
+item_keys = (
+    "network_name",
+    "station_db_id",
+    "station_native_id",
+    "history_db_id",
+    "station_name",
+    "lon",
+    "lat",
+    "elevation",
+    "datum",
+)
 
 
 def single_item_rep(item):
     """Return representation of a single network item."""
-    return dict_from_row(item)
+    return {key: getattr(item, key) for key in item_keys}
 
 
 def collection_item_rep(baseline_with_station_info):
@@ -23,33 +70,35 @@ def collection_rep(baselines_with_station_info):
     return [collection_item_rep(item) for item in baselines_with_station_info]
 
 
-def baseline(session, variable, month):
-    """Returns list of climate baseline data.
+def baseline_query(session, variables=variables, month=None):
+    """
+    Return a query for climate baseline values with station info. In addition
+    to the collection item columns, rows have `variable` (the database
+    variable name, e.g., 'Tx_Climatology') and `month`.
 
     :param session: (sqlalchemy.orm.session.Session) database session
-    :param variable: (string) requested baseline climate variable ('tmax' | 'tmin' | 'precip')
-    :param month: (int) requested baseline month (1...12)
-    :return: list
+    :param variables: (iterable of string) baseline climate variables
+    :param month: (int) baseline month (1...12), or None for all months
+    :return: sqlalchemy.orm.Query
     """
-
-    db_variable_name = {
-        "tmax": "Tx_Climatology",
-        "tmin": "Tn_Climatology",
-        "precip": "Precip_Climatology",
-    }
-
     values = (
-        session.query(DerivedValue)
+        session.query(
+            DerivedValue.history_id.label("history_id"),
+            DerivedValue.datum.label("datum"),
+            Variable.name.label("db_variable_name"),
+            func.date_part("month", DerivedValue.time).label("month"),
+        )
         .select_from(DerivedValue)
         .join(Variable, DerivedValue.vars_id == Variable.id)
         .join(Network, Variable.network_id == Network.id)
         .filter(Network.name == pcic_climate_variable_network_name)
-        .filter(Variable.name == db_variable_name[variable])
-        .filter(func.date_part("month", DerivedValue.time) == float(month))
-        .subquery()
+        .filter(Variable.name.in_([db_variable_names[v] for v in variables]))
     )
+    if month is not None:
+        values = values.filter(func.date_part("month", DerivedValue.time) == month)
+    values = values.subquery()
 
-    values_with_station_info = (
+    return (
         session.query(
             Network.name.label("network_name"),
             Station.id.label("station_db_id"),
@@ -60,6 +109,8 @@ def baseline(session, variable, month):
             cast(History.lat, Float).label("lat"),
             cast(History.elevation, Float).label("elevation"),
             values.c.datum.label("datum"),
+            values.c.db_variable_name.label("variable"),
+            values.c.month.label("month"),
         )
         .select_from(values)
         .join(History, values.c.history_id == History.id)
@@ -67,9 +118,140 @@ def baseline(session, variable, month):
         .join(Network, Station.network_id == Network.id)
     )
 
-    return values_with_station_info.all()
+
+def baseline(session, variable, month):
+    """Returns list of climate baseline data.
+
+    :param session: (sqlalchemy.orm.session.Session) database session
+    :param variable: (string) requested baseline climate variable ('tmax' | 'tmin' | 'precip')
+    :param month: (int) requested baseline month (1...12)
+    :return: list
+    """
+    return baseline_query(session, (variable,), float(month)).all()
+
+
+def baselines(session):
+    """
+    Return the climate baseline data for all variables and months.
+
+    :param session: (sqlalchemy.orm.session.Session) database session
+    :return: dict of (variable, month) to list
+    """
+    variable_by_db_name = {db_name: v for v, db_name in db_variable_names.items()}
+    result = {(variable, month): [] for variable in variables for month in months}
+    for row in baseline_query(session).all():
+        result[(variable_by_db_name[row.variable], int(row.month))].append(row)
+    return result
+
+
+def datums_by_history(rows):
+    """Return a dict of history id to baseline datum for baseline rows."""
+    return {row.history_db_id: row.datum for row in rows}
+
+
+def representation_of(rep):
+    """Return the serialized (`Precompressed`) form of a representation."""
+    return Precompressed.of(json.dumps(rep, separators=(",", ":")).encode("utf-8"))
+
+
+class BaselineStore:
+    """
+    The representations of all baseline collections, and their values by
+    history id.
+    """
+
+    def __init__(self, representations, datums):
+        """
+        :param representations: dict of (variable, month) to Precompressed
+        :param datums: dict of (variable, month) to dict of history id to datum
+        """
+        self.representations = representations
+        self.datums = datums
+
+    @classmethod
+    def load(cls, session):
+        """Load and serialize all baseline collections."""
+        with log_timing("Load baseline store", log=logger.debug):
+            collections = baselines(session)
+            return cls(
+                {
+                    key: representation_of(collection_rep(rows))
+                    for key, rows in collections.items()
+                },
+                {key: datums_by_history(rows) for key, rows in collections.items()},
+            )
+
+    def __getitem__(self, key):
+        return self.representations[key]
+
+
+def cache_ttl():
+    """Return the time (seconds) the baseline store is held before reloading."""
+    return current_app.config.get("BASELINE_CACHE_TTL", default_cache_ttl)
+
+
+_store = None
+_loaded_at = None
+_lock = threading.Lock()
+
+
+def get_store(session):
+    """
+    Return the baseline store, loading it first if there is none yet or it is
+    older than `cache_ttl()`; None if the store is disabled. As for the
+    catalog, other requests are served the current store during a reload.
+
+    :param session: SQLAlchemy database session
+    :return: BaselineStore or None
+    """
+    global _store, _loaded_at
+    ttl = cache_ttl()
+    if not ttl:
+        return None
+    store = _store
+    if store is not None and monotonic() - _loaded_at < ttl:
+        return store
+    if not _lock.acquire(blocking=store is None):
+        return store
+    try:
+        store = _store
+        if store is None or monotonic() - _loaded_at >= ttl:
+            store = _store = BaselineStore.load(session)
+            _loaded_at = monotonic()
+        return store
+    finally:
+        _lock.release()
+
+
+def representation(session, variable, month):
+    """Return the serialized representation of a baseline collection."""
+    store = get_store(session)
+    if store is None:
+        return representation_of(collection_rep(baseline(session, variable, month)))
+    return store[(variable, month)]
+
+
+def datums(session, variable, month):
+    """
+    Return the baseline values for a variable and month.
+
+    :param session: SQLAlchemy database session
+    :param variable: (string) baseline climate variable
+    :param month: (int) baseline month (1...12)
+    :return: dict of history id to datum
+    """
+    store = get_store(session)
+    if store is None:
+        return datums_by_history(baseline(session, variable, month))
+    return store.datums[(variable, month)]
+
+
+def warm_up(session):
+    """Load the baseline store, if it is enabled."""
+    get_store(session)
 
 
 def collection(variable=None, month=None):
-    baselines_with_station_info = baseline(get_app_session(), variable, month)
-    return collection_rep(baselines_with_station_info)
+    rep = representation(get_app_session(), variable, month)
+    set_cache_control(public=True, max_age=cache_ttl())
+    return precompressed_response(rep, mimetype="application/json")
@@ -1,4 +1,23 @@
+"""
+/weather/monthly/weather API implementation
+
+Monthly aggregates of weather observations by station, from the monthly
+weather views.
+
+Responses are cached in memory per (variable, year, month). A month is
+"closed" once it ended more than `settle_period` ago; its values no longer
+change, so its cache entry lives long (`WEATHER_CACHE_CLOSED_TTL`) and its
+responses are marked `Cache-Control: immutable`. Responses for later months
+(the current month) are cached for a short time (`WEATHER_CACHE_OPEN_TTL`).
+`warm_up` precomputes recent months.
+
+`series` answers a range of months in one query, as a series per station
+history. It is not cached, but is marked immutable if its last month is
+closed.
+"""
 import datetime
+import logging
+from flask import abort, current_app
 from sqlalchemy import cast, Float
 
 from pycds import Network, Station, History, Variable
@@ -9,7 +28,22 @@ from pycds import (
 )
 
 from sdpb import get_app_session
+from sdpb.util.cache_control import immutable_max_age, set_cache_control
 from sdpb.util.representation import dict_from_row
+from sdpb.util.ttl_cache import TTLCache
+from sdpb.timing import log_timing
+
+
+logger = logging.getLogger("sdpb")
+
+variables = ("tmax", "tmin", "precip")
+
+# A month's values are treated as final this long after it ends.
+settle_period = datetime.timedelta(weeks=4)
+
+default_cache_entries = 120
+default_open_ttl = 5 * 60
+default_closed_ttl = 7 * 24 * 60 * 60
 
 
 def single_item_rep(item):
@@ -30,21 +64,23 @@ def collection_rep(items):
     return [collection_item_rep(item) for item in items]
 
 
-def weather(session, variable, year, month):
-    """Returns a list of aggregated weather observations.
+view_for_variable = {
+    "tmax": MonthlyAverageOfDailyMaxTemperature,
+    "tmin": MonthlyAverageOfDailyMinTemperature,
+    "precip": MonthlyTotalPrecipitation,
+}
 
-    :param session: (sqlalchemy.orm.session.Session) database session
-    :param variable: (string) requested weather variable ('tmax' | 'tmin' | 'precip')
-    :param year: (int) requested year
-    :param month: (int) requested month (1...12)
-    :return: (list)
+
+def weather_query(session, variable, *columns):
     """
-    view_for_variable = {
-        "tmax": MonthlyAverageOfDailyMaxTemperature,
-        "tmin": MonthlyAverageOfDailyMinTemperature,
-        "precip": MonthlyTotalPrecipitation,
-    }
+    Return a query for aggregated weather observations of a variable, for all
+    months, with station and variable info.
 
+    :param session: (sqlalchemy.orm.session.Session) database session
+    :param variable: (string) weather variable ('tmax' | 'tmin' | 'precip')
+    :param columns: Additional columns to select.
+    :return: sqlalchemy.orm.Query
+    """
     WeatherView = view_for_variable[variable]
 
     q = (
@@ -62,21 +98,208 @@ def weather(session, variable, year, month):
             Variable.cell_method.label("cell_method"),
             WeatherView.statistic.label("statistic"),
             WeatherView.data_coverage.label("data_coverage"),
+            *columns,
         )
         .select_from(WeatherView)
         .join(History, WeatherView.history_id == History.id)
         .join(History.station)
         .join(Station.network)
         .join(Variable, WeatherView.vars_id == Variable.id)
-        .filter(WeatherView.obs_month == datetime.datetime(year, month, 1))
     )
 
     if WeatherView == MonthlyTotalPrecipitation:
         q = q.filter(Variable.standard_name == "lwe_thickness_of_precipitation_amount")
 
-    return q.all()
+    return q
+
+
+def weather(session, variable, year, month):
+    """Returns a list of aggregated weather observations.
+
+    :param session: (sqlalchemy.orm.session.Session) database session
+    :param variable: (string) requested weather variable ('tmax' | 'tmin' | 'precip')
+    :param year: (int) requested year
+    :param month: (int) requested month (1...12)
+    :return: (list)
+    """
+    WeatherView = view_for_variable[variable]
+    return (
+        weather_query(session, variable)
+        .filter(WeatherView.obs_month == datetime.datetime(year, month, 1))
+        .all()
+    )
+
+
+def weather_range(session, variable, start, end, station_ids=None, min_coverage=None):
+    """
+    Returns a list of aggregated weather observations over a range of months,
+    ordered by history, variable name and month. Rows also have `obs_month`.
+
+    :param session: (sqlalchemy.orm.session.Session) database session
+    :param variable: (string) weather variable ('tmax' | 'tmin' | 'precip')
+    :param start: (datetime) first month (inclusive)
+    :param end: (datetime) last month (inclusive)
+    :param station_ids: (iterable) stations of interest, or None for all
+    :param min_coverage: (float) minimum data coverage, or None
+    :return: (list)
+    """
+    WeatherView = view_for_variable[variable]
+    q = weather_query(
+        session, variable, WeatherView.obs_month.label("obs_month")
+    ).filter(WeatherView.obs_month.between(start, end))
+    if station_ids:
+        q = q.filter(History.station_id.in_(station_ids))
+    if min_coverage is not None:
+        q = q.filter(WeatherView.data_coverage >= min_coverage)
+    return q.order_by(History.id, Variable.name, WeatherView.obs_month).all()
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def is_closed(year, month, now=None):
+    """Return boolean indicating whether a month is closed (see module doc)."""
+    next_month = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    return next_month + settle_period <= (now or utc_now())
+
+
+def cache_ttl(closed):
+    """Return the time to live of a cache entry for a closed or open month."""
+    if closed:
+        return current_app.config.get("WEATHER_CACHE_CLOSED_TTL", default_closed_ttl)
+    return current_app.config.get("WEATHER_CACHE_OPEN_TTL", default_open_ttl)
+
+
+_cache = None
+
+
+def get_cache():
+    """Return the response cache, or None if it is disabled."""
+    global _cache
+    entries = current_app.config.get("WEATHER_CACHE_ENTRIES", default_cache_entries)
+    if not entries:
+        return None
+    if _cache is None:
+        _cache = TTLCache(max_entries=entries)
+    return _cache
+
+
+def cached_collection_rep(session, variable, year, month, closed):
+    """
+    Return the collection representation for a variable and month, from the
+    cache if possible.
+    """
+    cache = get_cache()
+    key = (variable, year, month)
+    rep = cache and cache.get(key)
+    if rep is None:
+        rep = collection_rep(weather(session, variable, year, month))
+        if cache is not None:
+            cache.put(key, rep, cache_ttl(closed))
+    return rep
+
+
+def set_month_cache_control(closed):
+    """Set Cache-Control for a response for a closed or open month."""
+    if closed:
+        set_cache_control(public=True, max_age=immutable_max_age, immutable=True)
+    else:
+        set_cache_control(public=True, max_age=cache_ttl(closed))
 
 
 def collection(variable=None, year=None, month=None):
-    items = weather(get_app_session(), variable, year, month)
-    return collection_rep(items)
+    closed = is_closed(year, month)
+    set_month_cache_control(closed)
+    return cached_collection_rep(get_app_session(), variable, year, month, closed)
+
+
+# Attributes of a series item that are the same for all its months.
+series_keys = (
+    "network_name",
+    "station_db_id",
+    "station_native_id",
+    "history_db_id",
+    "station_name",
+    "lon",
+    "lat",
+    "elevation",
+    "frequency",
+    "network_variable_name",
+    "cell_method",
+)
+
+
+def month_rep(month):
+    """Return representation ("YYYY-MM") of a month."""
+    return f"{month.year:04d}-{month.month:02d}"
+
+
+def parse_month(s):
+    """
+    Return the start (datetime) of a month given as "YYYY-MM". Responds 400 Bad
+    Request if it is invalid.
+    """
+    try:
+        return datetime.datetime.strptime(s, "%Y-%m")
+    except (TypeError, ValueError):
+        abort(400, description=f"Invalid month: {s}")
+
+
+def series_rep(rows):
+    """
+    Return representation of weather over a range of months: one item per
+    history and variable, with parallel arrays `months`, `statistics` and
+    `data_coverages`.
+
+    :param rows: Rows of `weather_range`. Each item's arrays are in the order of
+        its rows; items are in the order of their first rows.
+    :return: list of dict
+    """
+    items = {}
+    for row in rows:
+        key = (row.history_db_id, row.network_variable_name)
+        item = items.get(key)
+        if item is None:
+            item = {k: getattr(row, k) for k in series_keys}
+            item.update(months=[], statistics=[], data_coverages=[])
+            items[key] = item
+        item["months"].append(month_rep(row.obs_month))
+        item["statistics"].append(row.statistic)
+        item["data_coverages"].append(row.data_coverage)
+    return list(items.values())
+
+
+def series(variable=None, start=None, end=None, station_ids=None, min_coverage=None):
+    start, end = parse_month(start), parse_month(end)
+    if start > end:
+        abort(400, description="start must not be after end")
+    set_month_cache_control(is_closed(end.year, end.month))
+    return series_rep(
+        weather_range(
+            get_app_session(), variable, start, end, station_ids, min_coverage
+        )
+    )
+
+
+def warm_up(session, months, now=None):
+    """
+    Precompute and cache the collections of all variables for the last
+    `months` months, including the current month.
+
+    :param session: SQLAlchemy database session
+    :param months: Integer. Number of months.
+    :param now: datetime. Default: the current time (UTC).
+    """
+    now = now or utc_now()
+    cache = get_cache()
+    if cache is None:
+        return
+    with log_timing(f"Warm up weather cache ({months} months)", log=logger.info):
+        for k in range(months):
+            index = now.year * 12 + now.month - 1 - k
+            year, month = index // 12, index % 12 + 1
+            closed = is_closed(year, month, now)
+            for variable in variables:
+                rep = collection_rep(weather(session, variable, year, month))
+                cache.put((variable, year, month), rep, cache_ttl(closed))
@@ -0,0 +1,49 @@
+"""
+Cache-Control headers for API responses.
+
+A handler that knows how long its response will remain valid calls
+`set_cache_control` with the directives for it; an `after_request` hook (see
+`init_app`) adds them to the response if it is successful, or if it is 304 Not
+Modified, which must carry the same Cache-Control as the full response so that
+caches renew its freshness. As with ETags, the handler's return value is not
+changed, so handlers can still be called directly.
+
+Usage:
+
+```
+set_cache_control(public=True, max_age=3600)
+```
+"""
+from flask import g, has_request_context
+
+
+# One year, the conventional maximum for immutable responses.
+immutable_max_age = 365 * 24 * 60 * 60
+
+
+def set_cache_control(**directives):
+    """
+    Set the Cache-Control directives for the response to the current request.
+    Directive names are as for `werkzeug.datastructures.ResponseCacheControl`
+    (e.g., `public`, `max_age`, `immutable`). No-op outside a request.
+    """
+    if has_request_context():
+        g.sdpb_cache_control = directives
+
+
+def add_cache_control(response):
+    """
+    `after_request` hook: Add the directives set by `set_cache_control` to a
+    200 or 304 response.
+    """
+    directives = g.pop("sdpb_cache_control", None)
+    if directives is None or response.status_code not in (200, 304):
+        return response
+    for name, value in directives.items():
+        setattr(response.cache_control, name, value)
+    return response
+
+
+def init_app(app):
+    """Register the Cache-Control hook."""
+    app.after_request(add_cache_control)
@@ -0,0 +1,660 @@
+"""
+In-memory catalog of published stations and histories.
+
+The station and history collections are built from a full scan of History
+joined with Station, Network and StationObservationStats, plus an aggregate
+over VarsPerHistory. This content changes only a few times a day, so instead of
+re-running those queries on every request we hold it in memory, in columns,
+and answer the collection filters (provinces, stride, limit, offset) from
+there.
+
+The catalog is refreshed by a cheap data-version probe (`catalog_version`), at
+most once per `CATALOG_REFRESH_INTERVAL`. When the version changes, per-history
+signatures (`history_signatures_query`) determine which histories were added,
+changed or removed, and only the changed histories are reloaded from the
+database. The refreshed catalog is a new
+object that replaces the old one in a single assignment; requests holding the
+old catalog continue to use it undisturbed.
+
+Usage:
+
+```
+catalog = get_catalog(session)
+for history in catalog.histories(provinces="BC"):
+    ...
+```
+"""
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import cached_property
+from heapq import merge
+from itertools import islice
+from operator import itemgetter
+from time import monotonic
+from flask import current_app
+from sqlalchemy import func, cast, text
+from sqlalchemy.dialects.postgresql import TEXT, aggregate_order_by
+from pycds import (
+    Network,
+    Station,
+    History,
+    Variable,
+    VarsPerHistory,
+    StationObservationStats,
+)
+from sdpb.util.parallel_queries import parallel_queries
+from sdpb.util.query import (
+    add_station_network_publish_filter,
+    base_history_query,
+    data_version,
+    history_columns,
+    get_all_vars_by_hx,
+)
+from sdpb.util.kdtree import KDTree
+from sdpb.util.spatial import GridIndex
+from sdpb.util.vars_index import VarsByHistory
+from sdpb.timing import log_timing
+
+
+logger = logging.getLogger("sdpb")
+
+
+# Default minimum interval (seconds) between data-version probes.
+default_refresh_interval = 60
+
+
+# A history as held in the catalog: a row of `base_history_query`.
+HistoryRecord = namedtuple(
+    "HistoryRecord", tuple(column.name for column in history_columns)
+)
+
+
+StationRecord = namedtuple(
+    "StationRecord",
+    (
+        "id",
+        "native_id",
+        "network_id",
+        "min_obs_time",
+        "max_obs_time",
+        "history_ids",
+    ),
+)
+
+
+# Station columns loaded alongside each history row. They are labelled to
+# avoid clashing with the history columns of the same name.
+station_fields = (
+    "station_native_id",
+    "station_network_id",
+    "station_min_obs_time",
+    "station_max_obs_time",
+)
+
+
+def catalog_query(session, history_ids=None):
+    """
+    Return a query for the catalog content of published histories, ordered by
+    station and history id. Each row contains the fields of `HistoryRecord`
+    followed by `station_fields`.
+
+    :param session: SQLAlchemy database session
+    :param history_ids: If not None, restrict the query to these histories.
+    :return: SQLAlchemy query object
+    """
+    q = base_history_query(session).add_columns(
+        Station.native_id.label("station_native_id"),
+        Station.network_id.label("station_network_id"),
+        Station.min_obs_time.label("station_min_obs_time"),
+        Station.max_obs_time.label("station_max_obs_time"),
+    )
+    q = add_station_network_publish_filter(q)
+    if history_ids is not None:
+        q = q.filter(History.id.in_(history_ids))
+    return q.order_by(History.station_id, History.id)
+
+
+def history_signatures_query(session):
+    """
+    Return a query for a signature of each published history. The signature
+    is a hash of the history, station and observation stats rows, and of the
+    variables associated with the history; it changes whenever any of the
+    catalog content for that history changes.
+
+    Rows are whole-row references cast to text, in the same way as the
+    argument to `variables.variable_tags`.
+    """
+    vars_signature = (
+        session.query(
+            VarsPerHistory.history_id.label("history_id"),
+            cast(
+                func.array_agg(
+                    aggregate_order_by(VarsPerHistory.vars_id, VarsPerHistory.vars_id)
+                ),
+                TEXT,
+            ).label("vars"),
+        )
+        .group_by(VarsPerHistory.history_id)
+        .subquery()
+    )
+    q = (
+        session.query(
+            History.id.label("history_id"),
+            func.md5(
+                func.concat(
+                    cast(text(History.__tablename__), TEXT),
+                    cast(text(Station.__tablename__), TEXT),
+                    cast(text(StationObservationStats.__tablename__), TEXT),
+                    vars_signature.c.vars,
+                )
+            ).label("signature"),
+        )
+        .select_from(History)
+        .join(Station, History.station_id == Station.id)
+        .outerjoin(
+            StationObservationStats,
+            StationObservationStats.history_id == History.id,
+        )
+        .outerjoin(vars_signature, vars_signature.c.history_id == History.id)
+    )
+    return add_station_network_publish_filter(q)
+
+
+# Tables whose content the catalog holds. Variable is not held in the
+# catalog, but is included so that the catalog version serves also as the
+# data version of the networks and variables collections (see their ETags).
+catalog_tables = (
+    Network,
+    Station,
+    History,
+    StationObservationStats,
+    VarsPerHistory,
+    Variable,
+)
+
+
+def catalog_version(session):
+    """
+    Return a cheap data version for the catalog (see `data_version`). Any
+    change to a source table changes it.
+
+    :param session: SQLAlchemy database session
+    :return: tuple
+    """
+    return data_version(session, catalog_tables)
+
+
+class HistoriesByStation:
+    """
+    Read-only mapping of station id to the catalog histories for that station,
+    optionally restricted by province. Behaves like the dict returned by
+    `get_all_histories_etc_by_station`, without building it.
+    """
+
+    def __init__(self, catalog, provinces=None):
+        self.catalog = catalog
+        self.provinces = provinces
+
+    def __getitem__(self, station_id):
+        i = self.catalog.station_index(station_id)
+        if i is None:
+            raise KeyError(station_id)
+        return [
+            self.catalog.history(j)
+            for j in self.catalog.station_history_indices(i, self.provinces)
+        ]
+
+
+class Catalog:
+    """
+    Immutable, columnar snapshot of the published stations and histories.
+
+    History columns are ordered by station id and history id, so that the
+    histories of each station are contiguous; station columns are ordered by
+    station id and record the range of history positions for each station.
+    """
+
+    def __init__(self, version, rows, vars_by_hx, signatures):
+        """
+        :param version: Data version (see `catalog_version`).
+        :param rows: Iterable of rows as yielded by `catalog_query`, ordered by
+            station id and history id.
+        :param vars_by_hx: `VarsByHistory` of the variable ids associated to
+            each history.
+        :param signatures: dict of history signatures, keyed by history id.
+        """
+        self.version = version
+        self.vars_by_hx = vars_by_hx
+        self.signatures = signatures
+
+        n_history_fields = len(HistoryRecord._fields)
+        self.history_columns = {name: [] for name in HistoryRecord._fields}
+        self.station_columns = {
+            name: [] for name in StationRecord._fields[:-1] + ("hx_start", "hx_stop")
+        }
+        history_columns = [self.history_columns[name] for name in HistoryRecord._fields]
+        station_columns = self.station_columns
+        for position, row in enumerate(rows):
+            for column, value in zip(history_columns, row[:n_history_fields]):
+                column.append(value)
+            station_id = row[1]
+            if station_columns["id"] and station_columns["id"][-1] == station_id:
+                station_columns["hx_stop"][-1] = position + 1
+                continue
+            station_columns["id"].append(station_id)
+            for name, value in zip(StationRecord._fields[1:-1], row[n_history_fields:]):
+                station_columns[name].append(value)
+            station_columns["hx_start"].append(position)
+            station_columns["hx_stop"].append(position + 1)
+
+    def __len__(self):
+        return len(self.history_columns["id"])
+
+    @classmethod
+    def load(cls, session, version):
+        """Load the entire catalog from the database."""
+        with log_timing("Load catalog", log=logger.debug):
+            signatures, rows, vars_by_hx = parallel_queries(
+                session,
+                lambda s: dict(history_signatures_query(s).all()),
+                lambda s: catalog_query(s).all(),
+                get_all_vars_by_hx,
+            )
+            return cls(version, rows, vars_by_hx, signatures)
+
+    def refreshed(self, session, version):
+        """
+        Return a catalog for data version `version`, reloading only those
+        histories whose signatures differ from this catalog's.
+        """
+        with log_timing("Refresh catalog", log=logger.debug):
+            signatures = dict(history_signatures_query(session).all())
+            changed = {
+                hx_id
+                for hx_id, signature in signatures.items()
+                if self.signatures.get(hx_id) != signature
+            }
+            logger.debug(
+                f"Catalog refresh: {len(changed)} of {len(signatures)} "
+                f"histories changed"
+            )
+            if len(changed) > len(signatures) // 2:
+                # Cheaper to reload everything in one pass.
+                return self.load(session, version)
+
+            rows = {
+                row[0]: row
+                for row in self.rows()
+                if row[0] in signatures and row[0] not in changed
+            }
+            if changed:
+                rows.update(
+                    (row[0], tuple(row))
+                    for row in catalog_query(session, history_ids=changed)
+                )
+            vars_by_hx = VarsByHistory.from_items(
+                merge(
+                    (
+                        (hx_id, variable_ids)
+                        for hx_id, variable_ids in self.vars_by_hx.items()
+                        if hx_id in rows and hx_id not in changed
+                    ),
+                    get_all_vars_by_hx(session, history_ids=changed).items()
+                    if changed
+                    else (),
+                    key=itemgetter(0),
+                )
+            )
+            ordered_rows = sorted(rows.values(), key=lambda row: (row[1], row[0]))
+            return type(self)(version, ordered_rows, vars_by_hx, signatures)
+
+    def rows(self):
+        """Yield the rows (as in `catalog_query`) this catalog was built from."""
+        station_columns = [
+            self.station_columns[name] for name in StationRecord._fields[1:-1]
+        ]
+        for i in range(len(self.station_columns["id"])):
+            station_values = tuple(column[i] for column in station_columns)
+            for j in range(
+                self.station_columns["hx_start"][i], self.station_columns["hx_stop"][i]
+            ):
+                yield tuple(self.history(j)) + station_values
+
+    def history(self, j):
+        """Return the history at position `j`."""
+        return HistoryRecord._make(
+            self.history_columns[name][j] for name in HistoryRecord._fields
+        )
+
+    def history_column(self, name, indices):
+        """
+        Return the values of history column `name` at positions `indices`,
+        as a list.
+        """
+        return column_values(self.history_columns[name], indices)
+
+    def history_key(self, j):
+        """
+        Return the sort key (station id, history id) of the history at
+        position `j`.
+        """
+        return self.history_columns["station_id"][j], self.history_columns["id"][j]
+
+    def history_position_after(self, key):
+        """
+        Return the position of the first history whose sort key (see
+        `history_key`) is greater than `key`. The key need not be that of a
+        history in this catalog.
+        """
+        station_id, history_id = key
+        ids = self.station_columns["id"]
+        i = bisect_left(ids, station_id)
+        if i == len(ids):
+            return len(self)
+        hx_start = self.station_columns["hx_start"][i]
+        if ids[i] != station_id:
+            return hx_start
+        return bisect_right(
+            self.history_columns["id"],
+            history_id,
+            hx_start,
+            self.station_columns["hx_stop"][i],
+        )
+
+    @cached_property
+    def history_grid(self):
+        """
+        Spatial index (`sdpb.util.spatial.GridIndex`) of history locations,
+        built on first use. It is refreshed with the catalog, since a
+        refreshed catalog is a new object.
+        """
+        with log_timing("Build history grid index", log=logger.debug):
+            return GridIndex(self.history_columns["lon"], self.history_columns["lat"])
+
+    @cached_property
+    def history_tree(self):
+        """
+        Nearest-neighbour index (`sdpb.util.kdtree.KDTree`) of history
+        locations, built on first use. Like `history_grid`, it is refreshed
+        with the catalog.
+        """
+        with log_timing("Build history KD-tree", log=logger.debug):
+            return KDTree(self.history_columns["lon"], self.history_columns["lat"])
+
+    @cached_property
+    def history_station_positions(self):
+        """The position of the station of each history, by history position."""
+        positions = array("q", bytes(array("q").itemsize * len(self)))
+        for i, (start, stop) in enumerate(
+            zip(self.station_columns["hx_start"], self.station_columns["hx_stop"])
+        ):
+            positions[start:stop] = array("q", [i]) * (stop - start)
+        return positions
+
+    @cached_property
+    def station_location_positions(self):
+        """
+        The position of the history that locates each station, by station
+        position: its last history having a location, or -1 if none has.
+        """
+        lons, lats = self.history_columns["lon"], self.history_columns["lat"]
+        positions = array("q")
+        for start, stop in zip(
+            self.station_columns["hx_start"], self.station_columns["hx_stop"]
+        ):
+            positions.append(
+                next(
+                    (
+                        j
+                        for j in range(stop - 1, start - 1, -1)
+                        if lons[j] is not None and lats[j] is not None
+                    ),
+                    -1,
+                )
+            )
+        return positions
+
+    def build_indices(self):
+        """
+        Build now the indices that are otherwise built on first use (e.g., in
+        a server's master process, so that workers share them).
+        """
+        for name in (
+            "history_grid",
+            "history_tree",
+            "history_station_positions",
+            "station_location_positions",
+        ):
+            getattr(self, name)
+        self.vars_by_hx.histories_by_var
+
+    def history_indices(self, provinces=None, limit=None, after=None, region=None):
+        """
+        Return positions of histories matching the province and spatial
+        filters, ordered by station id and history id.
+
+        :param provinces: String, comma-separated list of provinces.
+        :param limit: Integer. Maximum number of positions returned.
+        :param after: Sort key (see `history_key`). If present, return only
+            histories after this key. The cost of a page does not depend on
+            how far into the catalog it starts.
+        :param region: `sdpb.util.spatial` region (BBox or Polygon). If
+            present, return only histories located in it.
+        """
+        start = 0 if after is None else self.history_position_after(after)
+        if region is None:
+            indices = range(start, len(self))
+        else:
+            hits = self.history_grid.search(region)
+            indices = hits[bisect_left(hits, start) :]
+        if provinces is not None:
+            provinces = set(provinces.split(","))
+            province_column = self.history_columns["province"]
+            indices = (j for j in indices if province_column[j] in provinces)
+        if isinstance(indices, (range, list)):
+            return indices[:limit]
+        return list(islice(indices, limit))
+
+    def histories(self, provinces=None, limit=None, after=None, region=None):
+        """
+        Yield histories matching the filters (see `history_indices`), ordered
+        by station id and history id (as `get_all_histories_etc`).
+        """
+        return (
+            self.history(j)
+            for j in self.history_indices(
+                provinces, limit=limit, after=after, region=region
+            )
+        )
+
+    def station_index(self, station_id):
+        """Return position of station with id `station_id`, or None."""
+        ids = self.station_columns["id"]
+        i = bisect_left(ids, station_id)
+        if i < len(ids) and ids[i] == station_id:
+            return i
+        return None
+
+    def station_history_indices(self, i, provinces=None):
+        """
+        Return positions of the histories of the station at position `i` that
+        match the province filter.
+        """
+        hx_range = range(
+            self.station_columns["hx_start"][i], self.station_columns["hx_stop"][i]
+        )
+        if provinces is None:
+            return hx_range
+        provinces = set(provinces.split(","))
+        province_column = self.history_columns["province"]
+        return [j for j in hx_range if province_column[j] in provinces]
+
+    def station(self, i, provinces=None):
+        """
+        Return the station at position `i`, with the ids of its histories that
+        match the province filter.
+        """
+        history_ids = self.history_columns["id"]
+        return StationRecord(
+            *(self.station_columns[name][i] for name in StationRecord._fields[:-1]),
+            history_ids=[
+                history_ids[j] for j in self.station_history_indices(i, provinces)
+            ],
+        )
+
+    def station_column(self, name, indices):
+        """
+        Return the values of station column `name` at positions `indices`,
+        as a list.
+        """
+        return column_values(self.station_columns[name], indices)
+
+    def station_key(self, i):
+        """Return the sort key (station id) of the station at position `i`."""
+        return (self.station_columns["id"][i],)
+
+    def station_indices(
+        self,
+        provinces=None,
+        stride=None,
+        limit=None,
+        offset=None,
+        after=None,
+        region=None,
+    ):
+        """
+        Return positions of stations matching the filters, ordered by station
+        id. Stations match the province and spatial filters if any of their
+        histories does.
+        Filters have the same meaning as the corresponding parameters of
+        `stations.collection`. If `after` (a sort key, see `station_key`) is
+        present, only stations after it are returned; unlike `offset`, the
+        cost of such a page does not depend on how far into the catalog it
+        starts.
+        """
+        station_ids = self.station_columns["id"]
+        start = 0 if after is None else bisect_right(station_ids, after[0])
+        if region is None:
+            indices = range(start, len(station_ids))
+            if provinces is not None:
+                indices = (
+                    i for i in indices if self.station_history_indices(i, provinces)
+                )
+        else:
+            hits = self.history_indices(provinces, region=region)
+            positions = sorted({self.history_station_positions[j] for j in hits})
+            indices = positions[bisect_left(positions, start) :]
+        if stride:
+            indices = (i for i in indices if station_ids[i] % stride == 0)
+        start = offset or 0
+        stop = start + limit if limit else None
+        if isinstance(indices, (range, list)):
+            return indices[start:stop]
+        return list(islice(indices, start, stop))
+
+    def stations(
+        self,
+        provinces=None,
+        stride=None,
+        limit=None,
+        offset=None,
+        after=None,
+        region=None,
+    ):
+        """Yield stations matching the filters (see `station_indices`)."""
+        return (
+            self.station(i, provinces)
+            for i in self.station_indices(
+                provinces=provinces,
+                stride=stride,
+                limit=limit,
+                offset=offset,
+                after=after,
+                region=region,
+            )
+        )
+
+    def histories_by_station(self, provinces=None):
+        """
+        Return a mapping of station id to the histories of that station that
+        match the province filter.
+        """
+        return HistoriesByStation(self, provinces)
+
+
+def column_values(column, indices):
+    """Return the values of a column (list) at positions `indices`."""
+    if isinstance(indices, range):
+        return column[indices.start : indices.stop : indices.step]
+    return list(map(column.__getitem__, indices))
+
+
+_catalog = None
+_checked_at = None
+_lock = threading.Lock()
+
+# Data version probed by `get_catalog_version` while no catalog is loaded.
+_version = None
+_version_checked_at = None
+
+
+def refresh_interval():
+    """Return the minimum interval (seconds) between data-version probes."""
+    return current_app.config.get("CATALOG_REFRESH_INTERVAL", default_refresh_interval)
+
+
+def get_catalog(session):
+    """
+    Return the current catalog, refreshing it first if the refresh interval
+    has elapsed and the data version has changed.
+
+    Only one request at a time refreshes the catalog. Other requests arriving
+    during a refresh are served the current catalog rather than waiting,
+    except when there is no catalog yet.
+
+    :param session: SQLAlchemy database session
+    :return: Catalog
+    """
+    global _catalog, _checked_at
+    catalog = _catalog
+    if catalog is not None and monotonic() - _checked_at < refresh_interval():
+        return catalog
+    if not _lock.acquire(blocking=catalog is None):
+        return catalog
+    try:
+        catalog = _catalog
+        if catalog is not None and monotonic() - _checked_at < refresh_interval():
+            # Refreshed by another request while we waited for the lock.
+            return catalog
+        version = catalog_version(session)
+        if catalog is None:
+            catalog = Catalog.load(session, version)
+        elif version != catalog.version:
+            catalog = catalog.refreshed(session, version)
+        _catalog = catalog
+        _checked_at = monotonic()
+        return catalog
+    finally:
+        _lock.release()
+
+
+def get_catalog_version(session):
+    """
+    Return the current data version of the catalog (see `catalog_version`),
+    without loading the catalog if it is not loaded yet: it is then probed
+    directly, at most once per refresh interval.
+
+    :param session: SQLAlchemy database session
+    :return: tuple
+    """
+    global _version, _version_checked_at
+    if _catalog is not None:
+        return get_catalog(session).version
+    version, checked_at = _version, _version_checked_at
+    if checked_at is None or monotonic() - checked_at >= refresh_interval():
+        version = catalog_version(session)
+        _version, _version_checked_at = version, monotonic()
+    return version
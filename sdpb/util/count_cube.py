@@ -0,0 +1,301 @@
+"""
+In-memory observation count cube.
+
+`/observations/counts` is requested on every change of the date-range slider
+on the map. Answering it in SQL sums every history's monthly counts in
+`ObsCountPerMonthHistory` each time. Instead we hold those counts in memory,
+aggregated by (station id, province) and month, with cumulative sums along
+the month axis. The count for a row over any range of months is then the
+difference of two cumulative sums, found by two bisections; no SQL is needed.
+
+Most stations report in only a small part of the full period of record, so a
+dense station x month matrix would be mostly zeros. The cube is therefore held
+in compressed sparse row form, in flat arrays:
+
+- `station_ids`, `provinces`: the row keys;
+- `offsets`: the entries of row i are at positions
+  `offsets[i]:offsets[i + 1]` of `months`;
+- `months`: the months (see `month_of`) with counts, sorted within each row;
+- `cumulative`: `cumulative[k]` is the sum of the counts of all entries before
+  position k (so it has one more element than `months`).
+
+Rows are keyed by province as well as station because the province filter
+applies to histories, and a station's histories need not all share a province.
+
+Climatology counts (`ClimoObsCount`) do not depend on dates; their totals per
+row are held alongside.
+
+The cube is replaced when the data version of the count views changes, which
+is probed at most once per `CATALOG_REFRESH_INTERVAL`.
+"""
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from time import monotonic
+from sqlalchemy import func
+from pycds import ObsCountPerMonthHistory, ClimoObsCount, History
+from sdpb.util.catalog import refresh_interval
+from sdpb.util.parallel_queries import parallel_queries
+from sdpb.util.query import data_version
+
+
+logger = logging.getLogger("sdpb")
+
+
+def month_of(date):
+    """Return the month index (months since year 0) of a date or datetime."""
+    return date.year * 12 + date.month - 1
+
+
+def count_version(session):
+    """
+    Return the data version of the tables the cube is built from (see
+    `data_version`).
+    """
+    return data_version(session, (History, ObsCountPerMonthHistory, ClimoObsCount))
+
+
+def monthly_counts_query(session):
+    """
+    Return a query for observation counts by station, province and month,
+    ordered by those. Counts without a month (NULL `date_trunc`) come last in
+    each station and province.
+    """
+    return (
+        session.query(
+            History.station_id,
+            History.province,
+            ObsCountPerMonthHistory.date_trunc,
+            func.sum(ObsCountPerMonthHistory.count),
+        )
+        .select_from(ObsCountPerMonthHistory)
+        .join(History, History.id == ObsCountPerMonthHistory.history_id)
+        .group_by(
+            History.station_id, History.province, ObsCountPerMonthHistory.date_trunc
+        )
+        .order_by(
+            History.station_id,
+            History.province,
+            ObsCountPerMonthHistory.date_trunc.asc().nullslast(),
+        )
+    )
+
+
+def climo_counts_query(session):
+    """Return a query for climatology counts by station and province."""
+    return (
+        session.query(
+            History.station_id, History.province, func.sum(ClimoObsCount.count)
+        )
+        .select_from(ClimoObsCount)
+        .join(History, History.id == ClimoObsCount.history_id)
+        .group_by(History.station_id, History.province)
+    )
+
+
+def add_count(counts, station_id, count):
+    """
+    Add `count` to the count for a station in `counts`, as SQL `sum` adds
+    values: a NULL (None) count is ignored, except that a station with only
+    NULL counts has count NULL.
+    """
+    if count is None:
+        counts.setdefault(station_id, None)
+    else:
+        counts[station_id] = (counts.get(station_id) or 0) + count
+
+
+class CountCube:
+    """
+    Observation counts by (station, province) and month, with cumulative sums
+    along the month axis, and climatology counts by (station, province).
+
+    The counts are sums in the sense of SQL: NULL counts are ignored, but a
+    sum of only NULL counts is NULL (None). So that the cube gives the same
+    results as the queries in `sdpb.api.observations`, alongside the
+    cumulative sums of counts are cumulative numbers of non-NULL counts.
+    Observation counts without a month are held for each row separately; they
+    are included only when no range of months is given.
+    """
+
+    def __init__(self, version, monthly_counts, climo_counts):
+        """
+        :param version: Data version the cube was built from.
+        :param monthly_counts: Iterable of (station id, province, month
+            datetime or None, count or None), ordered by station id, province
+            and month, with month None last.
+        :param climo_counts: Iterable of (station id, province, count or
+            None).
+        """
+        self.version = version
+        climo = {
+            (station_id, province): total
+            for station_id, province, total in climo_counts
+        }
+        self.station_ids = array("q")
+        self.provinces = []
+        self.offsets = array("q", [0])
+        self.months = array("q")
+        self.cumulative = array("q", [0])
+        self.cumulative_known = array("q", [0])
+        # By row: whether there are counts without a month, and their total.
+        self.has_undated = []
+        self.undated_totals = []
+        # By row: whether there are climatology counts, and their total.
+        self.has_climo = []
+        self.climo_totals = []
+
+        def add_row(station_id, province, undated=()):
+            self.station_ids.append(station_id)
+            self.provinces.append(province)
+            self.offsets.append(len(self.months))
+            self.has_undated.append(bool(undated))
+            self.undated_totals.append(undated[0] if undated else None)
+            self.has_climo.append((station_id, province) in climo)
+            self.climo_totals.append(climo.pop((station_id, province), None))
+
+        key = None
+        undated = ()
+        for station_id, province, month, count in monthly_counts:
+            if (station_id, province) != key:
+                if key is not None:
+                    add_row(*key, undated)
+                key = (station_id, province)
+                undated = ()
+            if month is None:
+                undated = (count,)
+                continue
+            self.months.append(month_of(month))
+            self.cumulative.append(self.cumulative[-1] + (count or 0))
+            self.cumulative_known.append(
+                self.cumulative_known[-1] + (count is not None)
+            )
+        if key is not None:
+            add_row(*key, undated)
+        # Rows with climatology counts but no observation counts.
+        for station_id, province in list(climo):
+            add_row(station_id, province)
+
+        self.rows_by_station = {}
+        for i, station_id in enumerate(self.station_ids):
+            self.rows_by_station.setdefault(station_id, []).append(i)
+
+    @classmethod
+    def load(cls, session, version=None):
+        """Build the cube from the database."""
+        if version is None:
+            version = count_version(session)
+        monthly_counts, climo_counts = parallel_queries(
+            session,
+            lambda s: monthly_counts_query(s).all(),
+            lambda s: climo_counts_query(s).all(),
+        )
+        cube = cls(version, monthly_counts, climo_counts)
+        logger.debug(
+            f"Loaded count cube: {len(cube.station_ids)} rows, "
+            f"{len(cube.months)} station-months"
+        )
+        return cube
+
+    def rows(self, station_ids=None, provinces=None):
+        """
+        Return the positions of the rows matching the filters.
+
+        :param station_ids: Iterable of station ids, or None for all.
+        :param provinces: Collection of provinces, or None for all.
+        :return: iterable of int
+        """
+        if station_ids:
+            rows = (
+                i
+                for station_id in set(station_ids)
+                for i in self.rows_by_station.get(station_id, ())
+            )
+        else:
+            rows = range(len(self.station_ids))
+        if provinces is not None:
+            rows = (i for i in rows if self.provinces[i] in provinces)
+        return rows
+
+    def observation_counts(
+        self, start_month=None, end_month=None, station_ids=None, provinces=None
+    ):
+        """
+        Return the total observation counts by station over a range of months.
+        Stations with no counts in the range are omitted; stations with only
+        NULL counts in the range have count None. Counts without a month are
+        included only if the range is unlimited.
+
+        :param start_month: Month index (inclusive), or None for no limit.
+        :param end_month: Month index (inclusive), or None for no limit.
+        :param station_ids: Iterable of station ids, or None for all.
+        :param provinces: Collection of provinces, or None for all.
+        :return: dict of station id to count
+        """
+        counts = {}
+        dated_only = start_month is not None or end_month is not None
+        for i in self.rows(station_ids, provinces):
+            station_id = self.station_ids[i]
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            if start_month is not None:
+                lo = bisect_left(self.months, start_month, lo, hi)
+            if end_month is not None:
+                hi = bisect_right(self.months, end_month, lo, hi)
+            if hi > lo:
+                known = self.cumulative_known[hi] - self.cumulative_known[lo]
+                total = self.cumulative[hi] - self.cumulative[lo]
+                add_count(counts, station_id, total if known else None)
+            if self.has_undated[i] and not dated_only:
+                add_count(counts, station_id, self.undated_totals[i])
+        return counts
+
+    def climatology_counts(self, station_ids=None, provinces=None):
+        """
+        Return the total climatology counts by station.
+        Stations with no climatology counts are omitted; stations with only
+        NULL counts have count None.
+
+        :param station_ids: Iterable of station ids, or None for all.
+        :param provinces: Collection of provinces, or None for all.
+        :return: dict of station id to count
+        """
+        counts = {}
+        for i in self.rows(station_ids, provinces):
+            if self.has_climo[i]:
+                add_count(counts, self.station_ids[i], self.climo_totals[i])
+        return counts
+
+
+_cube = None
+_checked_at = None
+_lock = threading.Lock()
+
+
+def get_count_cube(session):
+    """
+    Return the current count cube, reloading it first if the refresh interval
+    has elapsed and the data version has changed. As for the catalog, other
+    requests are served the current cube during a reload.
+
+    :param session: SQLAlchemy database session
+    :return: CountCube
+    """
+    global _cube, _checked_at
+    cube = _cube
+    if cube is not None and monotonic() - _checked_at < refresh_interval():
+        return cube
+    if not _lock.acquire(blocking=cube is None):
+        return cube
+    try:
+        cube = _cube
+        if cube is not None and monotonic() - _checked_at < refresh_interval():
+            return cube
+        version = count_version(session)
+        if cube is None or version != cube.version:
+            cube = CountCube.load(session, version)
+        _cube = cube
+        _checked_at = monotonic()
+        return cube
+    finally:
+        _lock.release()
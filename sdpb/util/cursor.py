@@ -0,0 +1,107 @@
+"""
+Keyset ("cursor") pagination for collections.
+
+Paging with `offset` makes the cost of a page grow with its depth, because all
+the preceding items must be produced and discarded. Instead, a client can page
+with an opaque `cursor` that encodes the sort key of the last item of the
+previous page; the next page starts immediately after that key.
+
+A page that is not the last one is answered with a `Link` header (RFC 8288)
+giving the URL of the next page, i.e., the current URL with `cursor` set to the
+key of the last item (and any `offset` removed). The link is added by an
+`after_request` hook (see `init_app`), so handlers return their usual
+representation.
+
+Usage:
+
+```
+after = decode_cursor(cursor, 1)
+indices = catalog.station_indices(limit=limit and limit + 1, after=after)
+indices = paginate(indices, limit, catalog.station_key)
+```
+"""
+import base64
+from urllib.parse import urlencode
+from flask import abort, g, has_request_context, request
+
+
+def encode_cursor(key):
+    """
+    Return the opaque cursor for a sort key.
+
+    :param key: Tuple of int.
+    :return: str
+    """
+    text = ",".join(str(value) for value in key)
+    return base64.urlsafe_b64encode(text.encode("ascii")).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor, length):
+    """
+    Return the sort key encoded in a cursor, or None if there is no cursor.
+    Responds 400 Bad Request if the cursor is invalid.
+
+    :param cursor: str or None
+    :param length: Integer. Number of values in the key.
+    :return: tuple of int or None
+    """
+    if cursor is None:
+        return None
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        text = base64.urlsafe_b64decode(cursor + padding).decode("ascii")
+        key = tuple(int(value) for value in text.split(","))
+    except ValueError:
+        key = None
+    if key is None or len(key) != length:
+        abort(400, description=f"Invalid cursor: {cursor}")
+    return key
+
+
+def next_page_uri(cursor):
+    """
+    Return the URI of the next page of the current request: the request URL
+    with parameter `cursor` replaced and `offset` removed.
+    """
+    args = [
+        (name, value)
+        for name, value in request.args.items(multi=True)
+        if name not in ("cursor", "offset")
+    ]
+    args.append(("cursor", cursor))
+    return f"{request.base_url}?{urlencode(args)}"
+
+
+def paginate(indices, limit, key):
+    """
+    Return the first `limit` of `indices` (positions of the items matching a
+    request). If there are more, set the next-page link to continue after
+    the last of them.
+
+    Call with up to `limit + 1` positions, so that whether there is a next
+    page is known without a further query.
+
+    :param indices: Sequence of item positions, in sort-key order.
+    :param limit: Integer. Page size. If falsy, there is a single page.
+    :param key: Function returning the sort key of the item at a position.
+    :return: Sequence of item positions
+    """
+    if not limit or len(indices) <= limit:
+        return indices
+    indices = indices[:limit]
+    if has_request_context():
+        g.sdpb_next_page = next_page_uri(encode_cursor(key(indices[-1])))
+    return indices
+
+
+def add_link(response):
+    """`after_request` hook: Add the next-page link set by `paginate`."""
+    uri = g.pop("sdpb_next_page", None)
+    if uri is not None and response.status_code == 200:
+        response.headers.add("Link", f'<{uri}>; rel="next"')
+    return response
+
+
+def init_app(app):
+    """Register the next-page link hook."""
+    app.after_request(add_link)
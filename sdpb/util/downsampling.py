@@ -0,0 +1,124 @@
+"""
+Shape-preserving downsampling of time series.
+
+A chart is a few thousand pixels wide at most, but a sub-hourly station can
+have tens of thousands of observations in a requested range. Downsampling on
+the server reduces the response to about as many points as can be drawn,
+while keeping the visual shape of the series (peaks and troughs) that naive
+decimation would lose.
+
+Two methods are provided. Both divide the series into buckets of consecutive
+points and select actual points (not averages) from each bucket, so every
+point returned is a real observation:
+
+- "lttb": Largest-Triangle-Three-Buckets (Steinarsson, 2013). Selects from
+  each bucket the point forming the largest triangle with the point selected
+  from the previous bucket and the average of the next bucket. The first and
+  last points are always kept. Returns exactly `max_points` points.
+- "minmax": Selects the minimum and the maximum of each bucket, in time order.
+  Returns at most `max_points` points. Guarantees that extremes are kept.
+
+The functions return the positions of the selected points, so they can be
+applied to any parallel sequences (times, values, ids).
+"""
+
+methods = ("lttb", "minmax")
+
+
+def lttb_indices(xs, ys, max_points):
+    """
+    Return the positions of the points selected by LTTB.
+
+    :param xs: Sequence of numbers, increasing (e.g., timestamps).
+    :param ys: Sequence of numbers.
+    :param max_points: Integer. Number of points to select, at least 3.
+    :return: list of int
+    """
+    n = len(xs)
+    if max_points >= n:
+        return list(range(n))
+    # The first and last points are buckets of their own; the rest are
+    # divided evenly among the remaining buckets.
+    every = (n - 2) / (max_points - 2)
+    selected = [0]
+    a = 0
+    for i in range(max_points - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # Average of the next bucket (or the last point, for the last bucket).
+        next_start = end
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        ax, ay = xs[a], ys[a]
+        best = start
+        max_area = -1.0
+        for j in range(start, end):
+            # Twice the triangle area; the factor does not affect the choice.
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                best = j
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def minmax_indices(ys, max_points):
+    """
+    Return the positions of the minimum and maximum points of each bucket.
+
+    :param ys: Sequence of numbers.
+    :param max_points: Integer. Maximum number of points to select, at least 2.
+    :return: list of int
+    """
+    n = len(ys)
+    if max_points >= n:
+        return list(range(n))
+    every = n / (max_points // 2)
+    selected = []
+    for i in range(max_points // 2):
+        start = int(i * every)
+        end = min(int((i + 1) * every), n)
+        bucket = range(start, end)
+        lo = min(bucket, key=ys.__getitem__)
+        hi = max(bucket, key=ys.__getitem__)
+        selected.extend(sorted({lo, hi}))
+    return selected
+
+
+def bucket_size(n, max_points, method):
+    """
+    Return the (average) number of points per bucket used by `method` to
+    downsample `n` points to `max_points`.
+    """
+    if max_points >= n:
+        return 1
+    if method == "lttb":
+        return (n - 2) / (max_points - 2)
+    return n / (max_points // 2)
+
+
+def downsample(times, values, max_points, method="lttb"):
+    """
+    Return the positions of the points selected by downsampling a time
+    series to at most `max_points`, and the bucket size used.
+
+    :param times: Sequence of datetime, increasing.
+    :param values: Sequence of numbers.
+    :param max_points: Integer.
+    :param method: "lttb" or "minmax".
+    :return: tuple (list of int, number)
+    """
+    if method == "lttb":
+        # Seconds since the first point; works for naive and aware datetimes.
+        xs = [(time - times[0]).total_seconds() for time in times]
+        indices = lttb_indices(xs, values, max_points)
+    elif method == "minmax":
+        indices = minmax_indices(values, max_points)
+    else:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    return indices, bucket_size(len(times), max_points, method)
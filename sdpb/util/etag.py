@@ -0,0 +1,139 @@
+"""
+Conditional GET (ETag / If-None-Match) for API handlers.
+
+Some collections (stations, histories, networks, variables) are requested on
+every page load of the frontend, are large, and change only a few times a day.
+For these we compute a strong ETag from a cheap fingerprint of the underlying
+data (e.g., the version of the in-memory catalog, which is probed at most once
+per `CATALOG_REFRESH_INTERVAL`) together with the request URL, instead of from
+the response body. A request whose `If-None-Match`
+matches is answered with 304 Not Modified before the handler does any
+representation work.
+
+Usage:
+
+```
+@etagged(lambda: get_catalog_version(get_app_session()))
+def collection(provinces=None):
+    ...
+```
+
+The handler's return value is not changed, so decorated handlers can still be
+called directly. The ETag is added to the response by an `after_request` hook
+(see `init_app`), which must run before flask_compress's hook so that
+flask_compress can mark compressed representations (`"<etag>:gzip"`).
+"""
+import functools
+import hashlib
+from importlib import metadata
+from flask import Response, g, has_request_context, request
+
+
+try:
+    # Representations can change between releases without any change in the
+    # data, so the release is part of every ETag.
+    package_version = metadata.version("sdpb")
+except metadata.PackageNotFoundError:
+    package_version = ""
+
+
+def compute_etag(fingerprint):
+    """
+    Return an ETag (without quotes) for the current request and a data
+    fingerprint.
+
+    :param fingerprint: Any value with a stable repr.
+    :return: str
+    """
+    key = repr((package_version, request.url, fingerprint))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def matching_etag(etag):
+    """
+    Return the entity tag in the current request's `If-None-Match` that
+    matches `etag`, or None.
+
+    A tag matches if it is `etag` itself, or `etag` marked with a content
+    coding (`<etag>:gzip`), as flask_compress or a streamed response marks
+    a compressed representation of it.
+
+    :param etag: str
+    :return: str or None
+    """
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return etag
+    for tag in if_none_match.as_set(include_weak=True):
+        if tag == etag or tag.startswith(etag + ":"):
+            return tag
+    return None
+
+
+def not_modified_response(tag):
+    """
+    Return a 304 Not Modified response for the entity tag `tag`.
+
+    A 304 must carry the `Vary` of the full response (RFC 7232, section 4.1),
+    or a shared cache may confuse its representations. Full responses vary on
+    `Accept-Encoding`, since they may be compressed (by flask_compress or as
+    `Precompressed`).
+
+    :param tag: str
+    :return: flask.Response
+    """
+    response = Response(status=304)
+    response.set_etag(tag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def etagged(fingerprint):
+    """
+    Decorator for an API handler: tag the response to a GET request with an
+    ETag derived from `fingerprint`, and answer a matching `If-None-Match`
+    with 304.
+
+    :param fingerprint: Function (no arguments) returning a cheap value that
+        changes whenever the data the handler represents changes.
+    :return: decorator
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            if not has_request_context() or request.method not in ("GET", "HEAD"):
+                # E.g., a search whose parameters are in the request body,
+                # which is not part of the ETag.
+                return handler(*args, **kwargs)
+            etag = compute_etag(fingerprint())
+            tag = matching_etag(etag)
+            if tag is not None:
+                return not_modified_response(tag)
+            g.sdpb_etag = etag
+            return handler(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_etag(response):
+    """
+    `after_request` hook: Add the ETag computed by an `etagged` handler to a
+    successful response.
+    """
+    etag = g.pop("sdpb_etag", None)
+    if etag is None or response.status_code != 200:
+        return response
+    content_encoding = response.headers.get("Content-Encoding")
+    if content_encoding:
+        # Already encoded by the handler (e.g., a streamed gzip response).
+        etag = f"{etag}:{content_encoding}"
+    response.set_etag(etag)
+    return response
+
+
+def init_app(app):
+    """Register the ETag hook. Call after `Compress.init_app`."""
+    app.after_request(add_etag)
@@ -0,0 +1,172 @@
+"""
+JSON providers for the app.
+
+Large responses (stations, histories) are mostly datetimes, floats and nested
+lists, and Flask's default provider serializes them slowly, in pure Python.
+When orjson is installed we serialize with it instead; otherwise we fall back
+to the standard library `json` module.
+
+Both providers produce the same output, byte for byte. The standard library
+provider is Flask's default provider, with the same conventions for types
+`json` does not handle as connexion's `FlaskJSONEncoder` (which it replaces):
+
+- Naive datetimes are assumed to be UTC and serialized in ISO format with a
+  `Z` suffix; aware datetimes and dates in ISO format. (Representations
+  mostly format datetimes themselves; see `sdpb.util.representation.date_rep`.)
+- Decimals are serialized as numbers, UUIDs as strings.
+
+The orjson provider serializes with orjson whenever orjson can reproduce that
+output, and otherwise falls back to the standard library provider; see
+`OrjsonProvider`.
+
+The provider is chosen by config value `JSON_PROVIDER`: "auto" (default; orjson
+if installed), "orjson" or "stdlib".
+"""
+import datetime
+import decimal
+import json
+import re
+import uuid
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def datetime_rep(value):
+    """
+    Return the representation of a datetime: ISO format, with a `Z` suffix
+    if it is naive (assumed UTC).
+    """
+    if value.tzinfo:
+        return value.isoformat("T")
+    return value.isoformat("T") + "Z"
+
+
+def default(o):
+    """
+    Return a JSON-serializable version of an object not natively serializable.
+    """
+    if isinstance(o, datetime.datetime):
+        return datetime_rep(o)
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class StdlibJSONProvider(DefaultJSONProvider):
+    """JSON provider using the standard library `json` module."""
+
+    default = staticmethod(default)
+
+    def dumps(self, obj, **kwargs):
+        # Ignore any JSON encoder class set on the app (connexion sets one);
+        # `default` is equivalent.
+        kwargs.setdefault("default", self.default)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+
+# orjson writes some floats differently from `json` (e.g., 1e-7 as `1e-7`
+# rather than `1e-07`, and 1e-5 as `0.00001` rather than `1e-05`). Output
+# containing anything like these (possibly in a string) is re-serialized.
+inexact_number = re.compile(rb"0\.0000|e-\d(?!\d)")
+
+# Characters `json` escapes when `ensure_ascii` is set, and orjson does not.
+non_ascii = re.compile("[\x7f-\U0010ffff]")
+
+
+def escape_non_ascii_char(match):
+    code = ord(match.group())
+    if code < 0x10000:
+        return f"\\u{code:04x}"
+    code -= 0x10000
+    return f"\\u{0xD800 | (code >> 10):04x}\\u{0xDC00 | (code & 0x3FF):04x}"
+
+
+def escape_non_ascii(text):
+    """Escape non-ASCII characters of JSON text as `json` does."""
+    return non_ascii.sub(escape_non_ascii_char, text)
+
+
+class OrjsonProvider(StdlibJSONProvider):
+    """
+    JSON provider using orjson, with the same output as `StdlibJSONProvider`.
+
+    orjson supports only compact output (separators "," and ":") and indented
+    output (indent 2, separators "," and ": "); other formatting arguments
+    are handled by `StdlibJSONProvider`. So are objects orjson does not
+    serialize (e.g., non-string keys) or does not serialize the same way
+    (e.g., floats in exponent form).
+
+    The only difference is in non-finite floats, which are not valid JSON:
+    `json` writes `NaN` and `Infinity`, orjson `null`.
+    """
+
+    def orjson_option(self, indent=None, separators=None, sort_keys=None, **kwargs):
+        """
+        Return the orjson option producing output formatted as `json.dumps`
+        does with the same arguments, or None if there is no such option.
+        """
+        if set(kwargs) - {"ensure_ascii"}:
+            return None
+        if indent is None:
+            if tuple(separators or ()) != (",", ":"):
+                return None
+            option = 0
+        elif indent in (2, "  "):
+            if separators is not None and tuple(separators) != (",", ": "):
+                return None
+            option = orjson.OPT_INDENT_2
+        else:
+            return None
+        if self.sort_keys if sort_keys is None else sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        option = self.orjson_option(**kwargs)
+        if option is not None:
+            try:
+                data = orjson.dumps(obj, default=default, option=option)
+            except orjson.JSONEncodeError:
+                data = None
+            if data is not None and not inexact_number.search(data):
+                text = data.decode()
+                if kwargs.get("ensure_ascii", self.ensure_ascii):
+                    text = escape_non_ascii(text)
+                return text
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def provider_class(name="auto"):
+    """
+    Return the JSON provider class named by `name` (see module docstring).
+
+    :param name: String.
+    :return: subclass of flask.json.provider.JSONProvider
+    """
+    if name == "auto":
+        return OrjsonProvider if orjson else StdlibJSONProvider
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("JSON_PROVIDER is 'orjson', but orjson is not installed")
+        return OrjsonProvider
+    if name == "stdlib":
+        return StdlibJSONProvider
+    raise ValueError(f"Unknown JSON_PROVIDER: {name}")
+
+
+def init_app(app):
+    """Install the JSON provider selected by the app config."""
+    app.json = provider_class(app.config.get("JSON_PROVIDER", "auto"))(app)
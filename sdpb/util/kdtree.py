@@ -0,0 +1,122 @@
+"""
+KD-tree for nearest-neighbour search on the sphere.
+
+Points given by longitude and latitude are placed on the unit sphere, in 3-d
+Cartesian coordinates. The straight-line (chord) distance between two such
+points increases with their great-circle distance, so the nearest points by
+chord distance are the nearest by great-circle distance, and an ordinary
+Euclidean KD-tree answers nearest-neighbour queries without any special
+handling of the antimeridian or the poles.
+
+The tree is held implicitly, in flat arrays. Points are reordered so that each
+node is a range `[lo, hi)` of positions, split at its median `mid` on axis
+`depth % 3`: the point at `mid` belongs to the node, and its children are the
+ranges `[lo, mid)` and `[mid + 1, hi)`. Small ranges are leaves.
+
+`KDTree.nearest` yields points in order of increasing distance, by best-first
+search (Hjaltason and Samet, 1999): nodes are queued by a lower bound on the
+distance of any of their points, and points by their exact distance. A filter
+can be applied as points are reached, and the caller can stop after any
+number of results, so "the k nearest points satisfying some condition" costs
+little more than the k nearest points when the condition is not rare.
+"""
+import heapq
+import math
+from array import array
+from itertools import count
+
+
+# Mean radius of the Earth, km.
+earth_radius = 6371.0088
+
+
+def unit_vector(lon, lat):
+    """Return the point on the unit sphere at `lon`, `lat` (degrees)."""
+    lon, lat = math.radians(lon), math.radians(lat)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+def great_circle_distance(chord_squared):
+    """Return the great-circle distance (km) for a squared chord length."""
+    return 2 * earth_radius * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+class KDTree:
+    """KD-tree of points on the sphere, identified by position (int)."""
+
+    leaf_size = 8
+
+    def __init__(self, lons, lats):
+        """
+        :param lons: Sequence of longitudes (degrees), or None.
+        :param lats: Sequence of latitudes (degrees), or None.
+            Points with no location are not included.
+        """
+        items = [
+            (position,) + unit_vector(lon, lat)
+            for position, (lon, lat) in enumerate(zip(lons, lats))
+            if lon is not None and lat is not None
+        ]
+        self._build(items, 0, len(items), 0)
+        self.positions = array("q", (item[0] for item in items))
+        self.coords = [
+            array("d", (item[axis + 1] for item in items)) for axis in range(3)
+        ]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _build(self, items, lo, hi, depth):
+        """Order `items[lo:hi]` as the subtree at `depth` (see module doc)."""
+        while hi - lo > self.leaf_size:
+            axis = depth % 3 + 1
+            items[lo:hi] = sorted(items[lo:hi], key=lambda item: item[axis])
+            mid = (lo + hi) // 2
+            self._build(items, lo, mid, depth + 1)
+            lo, depth = mid + 1, depth + 1
+
+    def nearest(self, lon, lat, accept=None):
+        """
+        Yield `(distance, position)` for the points nearest to `lon`, `lat`,
+        in order of increasing great-circle distance (km).
+
+        :param lon: Longitude (degrees).
+        :param lat: Latitude (degrees).
+        :param accept: Function of a position; if given, only points for which
+            it returns true are yielded.
+        :return: generator of (float, int)
+        """
+        query = unit_vector(lon, lat)
+        xs, ys, zs = self.coords
+        qx, qy, qz = query
+        tiebreak = count()
+        # Entries: (squared distance bound, tiebreak, lo, hi, depth) for
+        # nodes; (squared distance, tiebreak, index, None, None) for points.
+        heap = [(0.0, next(tiebreak), 0, len(self.positions), 0)]
+
+        def push_point(i):
+            if accept is None or accept(self.positions[i]):
+                d2 = (xs[i] - qx) ** 2 + (ys[i] - qy) ** 2 + (zs[i] - qz) ** 2
+                heapq.heappush(heap, (d2, next(tiebreak), i, None, None))
+
+        while heap:
+            bound, _, lo, hi, depth = heapq.heappop(heap)
+            if hi is None:
+                yield great_circle_distance(bound), self.positions[lo]
+                continue
+            if hi - lo <= self.leaf_size:
+                for i in range(lo, hi):
+                    push_point(i)
+                continue
+            mid = (lo + hi) // 2
+            axis = depth % 3
+            push_point(mid)
+            diff = query[axis] - self.coords[axis][mid]
+            far_bound = max(bound, diff * diff)
+            if diff < 0:
+                near, far = (lo, mid), (mid + 1, hi)
+            else:
+                near, far = (mid + 1, hi), (lo, mid)
+            heapq.heappush(heap, (bound, next(tiebreak), *near, depth + 1))
+            heapq.heappush(heap, (far_bound, next(tiebreak), *far, depth + 1))
@@ -0,0 +1,212 @@
+"""
+Mapbox Vector Tile (MVT) encoding of point features.
+
+A vector tile is a Protocol Buffers message (see the Mapbox Vector Tile
+specification, version 2.1) containing named layers of features. Each
+feature has an integer geometry in tile coordinates (0 to `extent` across the
+tile, y increasing downwards) and properties encoded as indices into
+per-layer tables of keys and values.
+
+We need only points, so the encoder is small and written directly against the
+Protocol Buffers wire format; it depends on neither a protobuf library nor
+PostGIS (`ST_AsMVT`).
+
+Tiles are addressed by zoom `z` and column and row `x`, `y` in the Web
+Mercator (EPSG:3857) tiling scheme used by web maps.
+
+Usage:
+
+```
+layer = Layer("stations")
+for station in stations:
+    x, y = project(station.lon, station.lat, z, tx, ty, layer.extent)
+    layer.add_point(x, y, {"network_id": station.network_id}, id=station.id)
+data = encode_tile([layer])
+```
+"""
+import math
+import struct
+
+
+default_extent = 4096
+
+# Latitude limit of the Web Mercator projection, degrees.
+max_latitude = 85.0511287798066
+
+# Wire types.
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+# Geometry type and command of a point feature.
+POINT = 1
+MOVE_TO = 1
+
+
+def varint(out, value):
+    """Append the varint encoding of non-negative integer `value` to `out`."""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def zigzag(value):
+    """Return the zigzag encoding (as for sint64) of a signed integer."""
+    return (value << 1) ^ (value >> 63)
+
+
+def field_varint(out, field, value):
+    varint(out, field << 3 | VARINT)
+    varint(out, value)
+
+
+def field_bytes(out, field, data):
+    varint(out, field << 3 | LENGTH_DELIMITED)
+    varint(out, len(data))
+    out += data
+
+
+def field_packed(out, field, values):
+    data = bytearray()
+    for value in values:
+        varint(data, value)
+    field_bytes(out, field, data)
+
+
+def value_message(value):
+    """Return the encoded Value message for a property value."""
+    out = bytearray()
+    if isinstance(value, str):
+        field_bytes(out, 1, value.encode("utf-8"))
+    elif isinstance(value, bool):
+        field_varint(out, 7, int(value))
+    elif isinstance(value, int):
+        if value < 0:
+            field_varint(out, 6, zigzag(value))
+        else:
+            field_varint(out, 5, value)
+    elif isinstance(value, float):
+        varint(out, 3 << 3 | FIXED64)
+        out += struct.pack("<d", value)
+    else:
+        raise TypeError(f"Unsupported property value: {value!r}")
+    return bytes(out)
+
+
+class Layer:
+    """A tile layer of point features, encoded as they are added."""
+
+    def __init__(self, name, extent=default_extent):
+        self.name = name
+        self.extent = extent
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def __len__(self):
+        return len(self.features)
+
+    def tag(self, table, item):
+        """Return the index of `item` in `table`, adding it if necessary."""
+        index = table.get(item)
+        if index is None:
+            index = table[item] = len(table)
+        return index
+
+    def add_point(self, x, y, properties, id=None):
+        """
+        Add a point feature.
+
+        :param x: Integer. Tile coordinate, 0 (left) to `extent` (right).
+        :param y: Integer. Tile coordinate, 0 (top) to `extent` (bottom).
+        :param properties: dict of str to str, bool, int or float. Properties
+            whose value is None are omitted.
+        :param id: Non-negative integer feature id, or None.
+        """
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self.tag(self.keys, key))
+            # Distinguish e.g. True from 1, which are equal as dict keys.
+            tags.append(self.tag(self.values, (type(value), value)))
+        out = bytearray()
+        if id is not None:
+            field_varint(out, 1, id)
+        if tags:
+            field_packed(out, 2, tags)
+        field_varint(out, 3, POINT)
+        field_packed(out, 4, (MOVE_TO | 1 << 3, zigzag(x), zigzag(y)))
+        self.features.append(bytes(out))
+
+    def encode(self):
+        """Return the encoded Layer message."""
+        out = bytearray()
+        field_varint(out, 15, 2)
+        field_bytes(out, 1, self.name.encode("utf-8"))
+        for feature in self.features:
+            field_bytes(out, 2, feature)
+        for key in self.keys:
+            field_bytes(out, 3, key.encode("utf-8"))
+        for _, value in self.values:
+            field_bytes(out, 4, value_message(value))
+        field_varint(out, 5, self.extent)
+        return bytes(out)
+
+
+def encode_tile(layers):
+    """
+    Return the encoded Tile message for a list of layers. Empty layers are
+    omitted.
+
+    :param layers: List of Layer.
+    :return: bytes
+    """
+    out = bytearray()
+    for layer in layers:
+        if len(layer):
+            field_bytes(out, 3, layer.encode())
+    return bytes(out)
+
+
+def is_tile(z, x, y):
+    """Return boolean indicating whether tile `z`/`x`/`y` exists."""
+    return 0 <= z and 0 <= x < 1 << z and 0 <= y < 1 << z
+
+
+def project(lon, lat, z, x, y, extent=default_extent):
+    """
+    Return the integer coordinates of a point in tile `z`/`x`/`y`. Points
+    outside the tile have coordinates outside `[0, extent]`.
+    """
+    n = 1 << z
+    lat = max(-max_latitude, min(max_latitude, lat))
+    sin_lat = math.sin(math.radians(lat))
+    world_x = (lon + 180) / 360
+    world_y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return (
+        round((world_x * n - x) * extent),
+        round((world_y * n - y) * extent),
+    )
+
+
+def tile_bounds(z, x, y, buffer=0.0):
+    """
+    Return the bounds (min_lon, min_lat, max_lon, max_lat) of tile `z`/`x`/`y`,
+    extended by `buffer` (a fraction of the tile size) on each side.
+    """
+    n = 1 << z
+
+    def lon(column):
+        return column / n * 360 - 180
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (
+        lon(x - buffer),
+        lat(y + 1 + buffer),
+        lon(x + 1 + buffer),
+        lat(y - buffer),
+    )
@@ -0,0 +1,234 @@
+"""
+Run independent read-only queries concurrently.
+
+Some operations issue several independent queries one after another (e.g.,
+loading the catalog reads the histories and their variables). Their
+wall-clock time is the sum of the query times. Run on separate pooled
+connections, in parallel, it is instead about the time of the slowest.
+
+To give the queries a consistent view of the data, as if they ran in one
+transaction, the calling session's transaction exports its snapshot
+(`pg_export_snapshot()`); each query runs in a REPEATABLE READ transaction that
+imports that snapshot (`SET TRANSACTION SNAPSHOT`) before it starts.
+
+The queries run on a dedicated, bounded set of connections and threads (see
+`QueryRunner`), separate from the app's connection pool, of size
+`PARALLEL_QUERIES_CONNECTIONS`, but otherwise configured like the app's
+(`SQLALCHEMY_ENGINE_OPTIONS`). A call takes all the connections it needs at
+once, without waiting; if they are not all available (e.g., while other
+requests are running parallel queries) it runs its queries serially instead.
+So requests never wait on each other for connections, and parallel queries
+never take connections from the app's pool.
+
+The functions run in the app context of the caller, but not its request
+context. The queries run in the session's own transaction, one after another,
+instead when:
+
+- app config `PARALLEL_QUERIES` is false (e.g., in tests, whose data is not
+  visible outside the test session's transaction);
+- the database is not PostgreSQL;
+- there is only one query;
+- there are not enough connections available, as above.
+
+Usage:
+
+```
+rows, vars_by_hx = parallel_queries(
+    session,
+    lambda s: catalog_query(s).all(),
+    get_all_vars_by_hx,
+)
+```
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app, has_app_context
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+
+logger = logging.getLogger("sdpb")
+
+default_connections = 4
+
+
+def parallel_queries_enabled(session):
+    """Return boolean indicating whether queries can run in parallel."""
+    if has_app_context() and not current_app.config.get("PARALLEL_QUERIES", True):
+        return False
+    return session.get_bind().dialect.name == "postgresql"
+
+
+def max_connections():
+    """Return the number of connections for parallel queries."""
+    if not has_app_context():
+        return default_connections
+    return current_app.config.get("PARALLEL_QUERIES_CONNECTIONS", default_connections)
+
+
+def engine_options():
+    """
+    Return the options of the app's engine (`SQLALCHEMY_ENGINE_OPTIONS` and
+    `SQLALCHEMY_ECHO`), for creating another engine configured like it.
+    """
+    if not has_app_context():
+        return {}
+    config = current_app.config
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if config.get("SQLALCHEMY_ECHO"):
+        options["echo"] = True
+    return options
+
+
+class QueryRunner:
+    """
+    A dedicated engine, with a pool of `size` connections, and a pool of as
+    many threads, for running queries in parallel on the database of another
+    engine. Connections are reserved before they are used, so that taking one
+    never waits. Thread safe.
+    """
+
+    def __init__(self, source, size, options=None):
+        """
+        :param source: SQLAlchemy engine for the database.
+        :param size: Integer. Number of connections and threads.
+        :param options: dict. Options for the engine (see `engine_options`),
+            except for the pool, which is always a pool of `size` connections.
+        """
+        self.source = source
+        self.size = size
+        options = dict(options or {})
+        options.pop("poolclass", None)
+        self.engine = create_engine(
+            source.url, **{**options, "pool_size": size, "max_overflow": 0}
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=size, thread_name_prefix="parallel-query"
+        )
+        self._available = size
+        self._lock = threading.Lock()
+
+    def reserve(self, n):
+        """
+        Reserve `n` connections if they are available, without waiting.
+        Return boolean indicating whether they were reserved.
+        """
+        with self._lock:
+            if n > self._available:
+                return False
+            self._available -= n
+            return True
+
+    def release(self, n):
+        """Release `n` reserved connections."""
+        with self._lock:
+            self._available += n
+
+    def dispose(self, close=True):
+        """
+        Stop the threads and discard the connections. In a forked process,
+        `close=False` discards the connections inherited from the parent
+        without closing them (see `sqlalchemy.engine.Engine.dispose`).
+        """
+        self.executor.shutdown(wait=close)
+        self.engine.dispose(close=close)
+
+
+_runner = None
+_lock = threading.Lock()
+
+
+def get_runner(engine):
+    """Return the query runner for the database of `engine`."""
+    global _runner
+    with _lock:
+        if _runner is None or _runner.source is not engine:
+            if _runner is not None:
+                _runner.dispose()
+            _runner = QueryRunner(engine, max_connections(), engine_options())
+        return _runner
+
+
+def dispose():
+    """Dispose of the query runner, if any (e.g., before forking)."""
+    global _runner
+    with _lock:
+        if _runner is not None:
+            _runner.dispose()
+            _runner = None
+
+
+def _forget_runner():
+    # Connections and threads are not shared with a forked process.
+    global _runner, _lock
+    if _runner is not None:
+        _runner.engine.dispose(close=False)
+    _runner = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_runner)
+
+
+def run_in_snapshot(engine, snapshot, function, app=None):
+    """
+    Run `function` with a session on a new connection whose transaction
+    imports `snapshot`, in the app context of `app` if given, and return its
+    result.
+    """
+    if app is not None:
+        with app.app_context():
+            return run_in_snapshot(engine, snapshot, function)
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="REPEATABLE READ")
+        with connection.begin():
+            # Snapshot ids are generated by the server (e.g. "00000003-0000001B-1").
+            connection.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot}'"))
+            with Session(bind=connection) as session:
+                return function(session)
+
+
+def parallel_queries(session, *functions):
+    """
+    Run functions that query the database concurrently, each with its own
+    session on a separate connection, all seeing the same snapshot of the
+    data, and return their results in order.
+
+    Each function takes a session and must return fully fetched results
+    (e.g., `query.all()`, not a query), since its session is closed when it
+    returns.
+
+    :param session: SQLAlchemy database session; identifies the database,
+        exports the snapshot, and runs the functions if they cannot run in
+        parallel.
+    :param functions: Functions of a session.
+    :return: list of results
+    """
+    if len(functions) < 2 or not parallel_queries_enabled(session):
+        return [function(session) for function in functions]
+
+    runner = get_runner(session.get_bind())
+    if not runner.reserve(len(functions)):
+        logger.debug(
+            f"Not enough connections for {len(functions)} parallel queries; "
+            f"running them serially"
+        )
+        return [function(session) for function in functions]
+    try:
+        # The snapshot can be imported only while the exporting transaction
+        # is open; the session's transaction stays open until we return.
+        snapshot = session.execute(text("SELECT pg_export_snapshot()")).scalar()
+        app = current_app._get_current_object() if has_app_context() else None
+        futures = [
+            runner.executor.submit(
+                run_in_snapshot, runner.engine, snapshot, function, app
+            )
+            for function in functions
+        ]
+        # Wait for all, so that no connection is in use once released.
+        wait(futures)
+        return [future.result() for future in futures]
+    finally:
+        runner.release(len(functions))
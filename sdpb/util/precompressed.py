@@ -0,0 +1,74 @@
+"""
+Responses from precomputed, pre-compressed bodies.
+
+Some responses (e.g., the baseline collections, vector tiles) are computed
+once and served many times from memory. For these we hold the body both
+plain and gzip-compressed, with a strong ETag computed from the body, so that
+serving them costs neither serialization nor compression, and a client's
+cached copy can be revalidated without sending the body again.
+
+Usage:
+
+```
+body = Precompressed.of(data)
+...
+return precompressed_response(body, mimetype="application/json")
+```
+"""
+import gzip
+import hashlib
+from collections import namedtuple
+from flask import Response
+from sdpb.util.etag import matching_etag, not_modified_response
+from sdpb.util.streaming import accepts_gzip
+
+
+class Precompressed(namedtuple("Precompressed", "body gzipped etag")):
+    """
+    A response body (bytes), the same compressed with gzip, and a strong ETag
+    (without quotes) for the body.
+    """
+
+    @classmethod
+    def of(cls, body):
+        """
+        :param body: bytes
+        :return: Precompressed
+        """
+        return cls(
+            body=body,
+            gzipped=gzip.compress(body, compresslevel=9, mtime=0),
+            etag=hashlib.sha1(body).hexdigest(),
+        )
+
+    @property
+    def size(self):
+        """Approximate memory cost, in bytes."""
+        return len(self.body) + len(self.gzipped) + 200
+
+
+def precompressed_response(body, mimetype):
+    """
+    Return a response for the current request with a precompressed body: 304
+    Not Modified if its `If-None-Match` matches the ETag; otherwise the body,
+    gzip-compressed if the client accepts that.
+
+    As flask_compress does, the ETag of the compressed body is marked
+    `"<etag>:gzip"`.
+
+    :param body: Precompressed
+    :param mimetype: String.
+    :return: flask.Response
+    """
+    tag = matching_etag(body.etag)
+    if tag is not None:
+        return not_modified_response(tag)
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_gzip():
+        data, etag = body.gzipped, f"{body.etag}:gzip"
+        headers["Content-Encoding"] = "gzip"
+    else:
+        data, etag = body.body, body.etag
+    response = Response(data, mimetype=mimetype, headers=headers)
+    response.set_etag(etag)
+    return response
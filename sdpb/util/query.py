@@ -1,6 +1,6 @@
 import logging
-from flask import request
-from sqlalchemy import func
+from flask import current_app, has_app_context, request
+from sqlalchemy import func, select, text
 from sqlalchemy.sql import visitors
 from itertools import groupby
 from pycds import (
@@ -10,6 +10,7 @@ from pycds import (
     VarsPerHistory,
     StationObservationStats,
 )
+from sdpb.util.vars_index import VarsByHistory
 from sdpb.timing import log_timing
 
 
@@ -25,6 +26,124 @@ def set_logger_level_from_qp(a_logger):
         pass
 
 
+def table_name(session, table):
+    """Return the qualified, quoted name of a table (ORM class or Table)."""
+    preparer = session.get_bind().dialect.identifier_preparer
+    return preparer.format_table(getattr(table, "__table__", table))
+
+
+def fingerprint_version(session, tables):
+    """
+    Data version probe: for each table, its file node, its number of rows, the
+    maximum of its primary key (if it is a single column) and the maximum of
+    its `mod_time` column (if it has one).
+
+    These are transactional and replicated, so the version is the same on a
+    hot-standby replica as on the primary, and it is unaffected by a restart
+    or a reset of the statistics. Inserts and deletes change the count or the
+    maximum key; updates are seen through `mod_time`; a TRUNCATE, and a
+    (non-concurrent) refresh of a materialized view, change the file node. An
+    update to a table without `mod_time` that keeps its row count and keys is
+    not seen. Counting reads each table (or its primary key index), which is
+    fast for tables of the catalog's size.
+
+    :param session: SQLAlchemy database session
+    :param tables: List of ORM classes or Table objects.
+    :return: tuple
+    """
+    version = []
+    for table in tables:
+        name = table_name(session, table)
+        table = getattr(table, "__table__", table)
+        columns = [func.pg_relation_filenode(func.to_regclass(name)), func.count()]
+        primary_key = list(table.primary_key.columns)
+        if len(primary_key) == 1:
+            columns.append(func.max(primary_key[0]))
+        if "mod_time" in table.c:
+            columns.append(func.max(table.c.mod_time))
+        version.append(
+            tuple(session.execute(select(*columns).select_from(table)).one())
+        )
+    return tuple(version)
+
+
+# Statistics of the tables (or materialized views) named, as a row for each:
+# file node, and numbers of rows inserted, updated and deleted, including by
+# the current transaction.
+statistics_version_query = text(
+    """
+    SELECT
+        c.relfilenode,
+        s.n_tup_ins + x.n_tup_ins,
+        s.n_tup_upd + x.n_tup_upd,
+        s.n_tup_del + x.n_tup_del
+    FROM unnest(CAST(:names AS text[])) WITH ORDINALITY AS t (name, i)
+    JOIN pg_class c ON c.oid = to_regclass(t.name)
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    LEFT JOIN pg_stat_xact_user_tables x ON x.relid = c.oid
+    ORDER BY t.i
+    """
+)
+
+
+def statistics_version(session, tables):
+    """
+    Data version probe: for each table, its file node and its counts of
+    inserted, updated and deleted rows from the statistics collector
+    (`pg_stat_user_tables`). These are looked up in the system catalogs, so
+    the cost does not depend on the size of the tables, and every insert,
+    update or delete made on this server is seen.
+
+    But the counts are not transactional, and they are local to the server:
+
+    - On a hot-standby replica they do not count changes replicated from the
+      primary, so only a TRUNCATE or a refresh of a materialized view (which
+      changes the file node) changes the version. Do not use this probe
+      against a replica.
+    - They are zeroed by `pg_stat_reset()` and by crash recovery, which can
+      make an old version reappear.
+    - They require `track_counts` (on by default), and the counts of a
+      transaction can take a second or so after it ends to appear.
+
+    :param session: SQLAlchemy database session
+    :param tables: List of ORM classes or Table objects.
+    :return: tuple
+    """
+    names = [table_name(session, table) for table in tables]
+    return tuple(
+        tuple(row)
+        for row in session.execute(statistics_version_query, {"names": names})
+    )
+
+
+# Data version probes, by name (see `DATA_VERSION_PROBE`).
+data_version_probes = {
+    "fingerprint": fingerprint_version,
+    "statistics": statistics_version,
+}
+
+default_data_version_probe = "fingerprint"
+
+
+def data_version(session, tables):
+    """
+    Return a cheap data version for a set of tables: a value that changes
+    when their content changes. It is computed by the probe configured by
+    `DATA_VERSION_PROBE`: the name of a probe in `data_version_probes`, or a
+    function with the same signature as them.
+
+    :param session: SQLAlchemy database session
+    :param tables: Iterable of ORM classes or Table objects.
+    :return: tuple
+    """
+    probe = default_data_version_probe
+    if has_app_context():
+        probe = current_app.config.get("DATA_VERSION_PROBE", probe)
+    if not callable(probe):
+        probe = data_version_probes[probe]
+    return probe(session, list(tables))
+
+
 def get_tables(query):
     """
     Return list of tables used in query.
@@ -37,9 +156,38 @@ def get_tables(query):
     ]
 
 
+# Columns read by the history representation (`histories.single_item_rep`),
+# labelled with the attribute names it uses. Selecting these rather than the
+# History and StationObservationStats entities yields lightweight rows instead
+# of identity-mapped, change-tracked ORM objects.
+history_columns = (
+    History.id.label("id"),
+    History.station_id.label("station_id"),
+    History.station_name.label("station_name"),
+    History.lon.label("lon"),
+    History.lat.label("lat"),
+    History.elevation.label("elevation"),
+    History.province.label("province"),
+    History.freq.label("freq"),
+    History.sdate.label("sdate"),
+    History.edate.label("edate"),
+    History.tz_offset.label("tz_offset"),
+    History.country.label("country"),
+    StationObservationStats.min_obs_time.label("min_obs_time"),
+    StationObservationStats.max_obs_time.label("max_obs_time"),
+)
+
+
 def base_history_query(session):
+    """
+    Return a query for histories and their observation stats. Each row has
+    the attributes labelled in `history_columns`.
+
+    :param session: SQLAlchemy database session
+    :return: SQLAlchemy query object
+    """
     return (
-        session.query(History, StationObservationStats)
+        session.query(*history_columns)
         .select_from(History)
         .join(Station, History.station_id == Station.id)
         .outerjoin(
@@ -70,34 +218,87 @@ def get_all_histories_etc_by_station(session, provinces=None):
         return {
             station_id: list(histories)
             for station_id, histories in groupby(
-                all_histories_etc, lambda hx_etc: hx_etc.History.station_id
+                all_histories_etc, lambda hx_etc: hx_etc.station_id
             )
         }
 
 
-def get_all_vars_by_hx(session):
+def vars_by_hx_query(session):
     """
-    Return a dict keyed by history id, with each value containing a list of
-    variables associated with that history id.
+    Return a query for the variables associated with each history, grouped
+    by history id. Each row has attributes `history_id` and `variable_ids`.
 
     :param session: SQLAlchemy database session
-    :return: dict
+    :return: SQLAlchemy query object
+    """
+    return (
+        session.query(
+            History.id.label("history_id"),
+            func.array_agg(VarsPerHistory.vars_id).label("variable_ids"),
+        )
+        .select_from(History)
+        .outerjoin(VarsPerHistory, VarsPerHistory.history_id == History.id)
+        .group_by(History.id)
+    )
 
-    Grouping in database appears to be significantly (factor of ~2) faster than
-    grouping in code afterwards. Unsurprising.
+
+def history_var_pairs_query(session):
+    """
+    Return a query for (history id, variable id) pairs, ordered by history
+    id and variable id.
+
+    :param session: SQLAlchemy database session
+    :return: SQLAlchemy query object
+    """
+    return session.query(VarsPerHistory.history_id, VarsPerHistory.vars_id).order_by(
+        VarsPerHistory.history_id, VarsPerHistory.vars_id
+    )
+
+
+def get_all_vars_by_hx(session, history_ids=None):
+    """
+    Return the variables associated with each history, as a `VarsByHistory`
+    (a compact read-only mapping of history id to variable ids). Histories
+    without variables are absent.
+
+    :param session: SQLAlchemy database session
+    :param history_ids: If not None, return only these histories.
+    :return: VarsByHistory
     """
     set_logger_level_from_qp(logger)
-    with log_timing("Query and group all vars by hx", log=logger.debug):
-        rows = (
-            session.query(
-                History.id.label("history_id"),
-                func.array_agg(VarsPerHistory.vars_id).label("variable_ids"),
-            )
-            .select_from(History)
-            .outerjoin(VarsPerHistory, VarsPerHistory.history_id == History.id)
-            .group_by(History.id)
-            .all()
-        )
+    with log_timing("Query all vars by hx", log=logger.debug):
+        q = history_var_pairs_query(session)
+        if history_ids is not None:
+            q = q.filter(VarsPerHistory.history_id.in_(history_ids))
+        return VarsByHistory.from_pairs(q.yield_per(10000))
+
+
+def station_vars_by_hx_query(session, station_id):
+    """
+    Return a query for the variables associated with each history of a single
+    station, grouped by history id. See `vars_by_hx_query`.
+
+    :param session: SQLAlchemy database session
+    :param station_id: Station id
+    :return: SQLAlchemy query object
+    """
+    return vars_by_hx_query(session).filter(History.station_id == station_id)
+
+
+def get_station_vars_by_hx(session, station_id):
+    """
+    Return a dict keyed by history id, with each value containing a list of
+    variables associated with that history id, for the histories of a single
+    station. Histories without variables have the value `[None]`.
+    Aggregates only that station's histories, which is much cheaper than
+    `get_all_vars_by_hx` for a single station.
+
+    :param session: SQLAlchemy database session
+    :param station_id: Station id
+    :return: dict
+    """
+    with log_timing("Query and group vars by hx for station", log=logger.debug):
+        rows = station_vars_by_hx_query(session, station_id).all()
         return {row.history_id: row.variable_ids for row in rows}
 
 
@@ -21,6 +21,26 @@ def float_rep(x):
     return float(x) if x is not None else None
 
 
+def sparse_rep(groups, values_rep=list):
+    """
+    Return the representation of a sequence of groups of values (e.g., the
+    variable ids of each of a sequence of histories) in compressed sparse row
+    form: the values of all groups concatenated, and the offsets at which
+    each group starts and ends. Group i is `values[offsets[i]:offsets[i + 1]]`.
+
+    :param groups: Iterable of iterables.
+    :param values_rep: Function returning the representation of the
+        concatenated values (a list).
+    :return: dict
+    """
+    offsets = [0]
+    values = []
+    for group in groups:
+        values.extend(group)
+        offsets.append(len(values))
+    return {"offsets": offsets, "values": values_rep(values)}
+
+
 def is_expanded(item, expand):
     items = (expand or "").split(",")
     return item in items or "*" in items
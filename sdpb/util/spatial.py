@@ -0,0 +1,218 @@
+"""
+Spatial filters for collections.
+
+The map fetches stations for its viewport, or for a region drawn by the user.
+A filter region is either a bounding box (`BBox`, from query parameter
+`bbox`) or a GeoJSON Polygon or MultiPolygon (`Polygon`, from a request
+body). Both provide `bounds` and `contains_points`.
+
+The points to be filtered (history locations) are held in a `GridIndex`, a
+uniform grid of cells, each listing the points it contains. A search visits
+only the cells overlapping the region's bounds, and tests only the points in
+those cells against the region.
+
+Point-in-polygon tests use the even-odd (ray casting) rule. They are
+organized edge by edge over all candidate points, rather than point by point,
+so that the per-edge work is done once per edge.
+"""
+import json
+from collections import namedtuple
+from flask import abort
+
+
+def parse_bbox(bbox):
+    """
+    Return the `BBox` given by a string "min_lon,min_lat,max_lon,max_lat".
+    Responds 400 Bad Request if it is invalid.
+
+    :param bbox: str or None
+    :return: BBox or None
+    """
+    if bbox is None:
+        return None
+    try:
+        result = BBox(*(float(value) for value in bbox.split(",")))
+    except (TypeError, ValueError):
+        result = None
+    if (
+        result is None
+        or result.min_lon > result.max_lon
+        or result.min_lat > result.max_lat
+    ):
+        abort(400, description=f"Invalid bbox: {bbox}")
+    return result
+
+
+def parse_polygon(geometry):
+    """
+    Return the `Polygon` given by a GeoJSON Polygon or MultiPolygon geometry,
+    or a Feature with such a geometry. Responds 400 Bad Request if it is
+    invalid.
+
+    :param geometry: dict, str (JSON text) or None
+    :return: Polygon or None
+    """
+    if geometry is None:
+        return None
+    try:
+        if isinstance(geometry, str):
+            geometry = json.loads(geometry)
+        if geometry.get("type") == "Feature":
+            geometry = geometry["geometry"]
+        if geometry["type"] == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            polygons = None
+        rings = [
+            [(float(lon), float(lat)) for lon, lat, *_ in ring]
+            for polygon in polygons
+            for ring in polygon
+        ]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        rings = None
+    if not rings or any(len(ring) < 4 for ring in rings):
+        abort(400, description="Invalid polygon: expected GeoJSON Polygon")
+    return Polygon(rings)
+
+
+def region(bbox=None, polygon=None):
+    """
+    Return the filter region given by request parameters `bbox` and
+    `polygon` (see `parse_bbox`, `parse_polygon`), or None if neither is
+    given. If both are given, the polygon is clipped to the bbox.
+    """
+    bbox = parse_bbox(bbox)
+    polygon = parse_polygon(polygon)
+    if polygon is None:
+        return bbox
+    if bbox is not None:
+        return Polygon(polygon.rings, clip=bbox)
+    return polygon
+
+
+class BBox(namedtuple("BBox", "min_lon min_lat max_lon max_lat")):
+    """Bounding box, in degrees of longitude and latitude."""
+
+    @property
+    def bounds(self):
+        return self
+
+    def contains_points(self, lons, lats):
+        """Return a list of booleans: which of the points are in the box."""
+        min_lon, min_lat, max_lon, max_lat = self
+        return [
+            min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
+            for lon, lat in zip(lons, lats)
+        ]
+
+
+class Polygon:
+    """
+    Polygon or multipolygon: a list of closed rings (exterior and interior
+    boundaries of all parts), with the even-odd rule for containment.
+    """
+
+    def __init__(self, rings, clip=None):
+        """
+        :param rings: List of rings; each is a list of (lon, lat), with the
+            last point equal to the first.
+        :param clip: BBox. If present, contain only points also in it.
+        """
+        self.rings = rings
+        self.clip = clip
+        bounds = BBox(
+            min(lon for ring in rings for lon, _ in ring),
+            min(lat for ring in rings for _, lat in ring),
+            max(lon for ring in rings for lon, _ in ring),
+            max(lat for ring in rings for _, lat in ring),
+        )
+        if clip is not None:
+            bounds = BBox(
+                max(bounds.min_lon, clip.min_lon),
+                max(bounds.min_lat, clip.min_lat),
+                min(bounds.max_lon, clip.max_lon),
+                min(bounds.max_lat, clip.max_lat),
+            )
+        self.bounds = bounds
+
+    def contains_points(self, lons, lats):
+        """Return a list of booleans: which of the points are in the polygon."""
+        lons = list(lons)
+        lats = list(lats)
+        inside = self.bounds.contains_points(lons, lats)
+        candidates = [k for k, flag in enumerate(inside) if flag]
+        c_lons = [lons[k] for k in candidates]
+        c_lats = [lats[k] for k in candidates]
+        crossings = [False] * len(candidates)
+        for ring in self.rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+                if y1 == y2:
+                    continue
+                slope = (x2 - x1) / (y2 - y1)
+                lo, hi = min(y1, y2), max(y1, y2)
+                for m, (lon, lat) in enumerate(zip(c_lons, c_lats)):
+                    # Half-open in latitude, so a vertex is counted once.
+                    if lo <= lat < hi and lon < x1 + (lat - y1) * slope:
+                        crossings[m] = not crossings[m]
+        for k, crossed in zip(candidates, crossings):
+            inside[k] = crossed
+        return inside
+
+
+class GridIndex:
+    """
+    Uniform grid index of points, by position. Points with no location are
+    not indexed.
+    """
+
+    def __init__(self, lons, lats, cell_size=0.5):
+        """
+        :param lons: Sequence of longitudes (or None).
+        :param lats: Sequence of latitudes (or None).
+        :param cell_size: Size of a cell, in degrees.
+        """
+        self.lons = lons
+        self.lats = lats
+        self.cell_size = cell_size
+        self.cells = {}
+        for position, (lon, lat) in enumerate(zip(lons, lats)):
+            if lon is None or lat is None:
+                continue
+            self.cells.setdefault(self.cell(lon, lat), []).append(position)
+
+    def cell(self, lon, lat):
+        return int(lon // self.cell_size), int(lat // self.cell_size)
+
+    def candidates(self, bounds):
+        """Return the positions of the points in cells overlapping `bounds`."""
+        x0, y0 = self.cell(bounds.min_lon, bounds.min_lat)
+        x1, y1 = self.cell(bounds.max_lon, bounds.max_lat)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self.cells):
+            cells = (
+                self.cells.get((x, y), ())
+                for x in range(x0, x1 + 1)
+                for y in range(y0, y1 + 1)
+            )
+        else:
+            cells = (
+                positions
+                for (x, y), positions in self.cells.items()
+                if x0 <= x <= x1 and y0 <= y <= y1
+            )
+        return [position for positions in cells for position in positions]
+
+    def search(self, region):
+        """
+        Return the positions of the points in `region`, in increasing order.
+
+        :param region: BBox or Polygon.
+        :return: list of int
+        """
+        candidates = self.candidates(region.bounds)
+        inside = region.contains_points(
+            (self.lons[position] for position in candidates),
+            (self.lats[position] for position in candidates),
+        )
+        return sorted(position for position, flag in zip(candidates, inside) if flag)
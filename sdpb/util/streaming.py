@@ -0,0 +1,122 @@
+"""
+Streamed responses.
+
+A collection response is normally built as a complete list of dicts, which
+Flask serializes to a single string and flask_compress then gzips as a single
+buffer. For large collections this makes peak memory grow with the size of the
+collection, and nothing is sent until everything is done.
+
+`json_array_response` instead serializes a collection item by item as it is
+sent, and compresses it in chunks when the client accepts gzip encoding.
+flask_compress leaves such responses alone because they already carry a
+`Content-Encoding` header. `streamed_response` does the same for any text
+content (e.g., CSV) produced as a sequence of chunks.
+"""
+import zlib
+from flask import Response, current_app, json, request, stream_with_context
+
+
+# Approximate size (characters) of the JSON text serialized before a chunk is
+# sent.
+default_chunk_size = 64 * 1024
+
+
+def json_array_chunks(items, chunk_size=default_chunk_size):
+    """
+    Yield the JSON text of an array containing `items`, in chunks of
+    approximately `chunk_size` characters.
+
+    :param items: Iterable of JSON-serializable items.
+    :param chunk_size: Integer.
+    :return: generator of str
+    """
+    buffer = ["["]
+    size = 0
+    for i, item in enumerate(items):
+        text = json.dumps(item, separators=(",", ":"))
+        if i > 0:
+            buffer.append(",")
+        buffer.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    buffer.append("]")
+    yield "".join(buffer)
+
+
+def text_chunks(texts, chunk_size=default_chunk_size):
+    """
+    Yield the concatenation of a sequence of texts (e.g., lines), in chunks
+    of approximately `chunk_size` characters.
+
+    :param texts: Iterable of str.
+    :param chunk_size: Integer.
+    :return: generator of str
+    """
+    buffer = []
+    size = 0
+    for text in texts:
+        buffer.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Yield gzip-compressed content of a sequence of text chunks. Each chunk is
+    flushed as it is compressed, so that the client receives data as it is
+    produced.
+
+    :param chunks: Iterable of str.
+    :param level: Integer. Compression level.
+    :return: generator of bytes
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode("utf-8")) + compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+    yield compressor.flush()
+
+
+def accepts_gzip():
+    """Return boolean indicating whether the current request accepts gzip."""
+    return request.accept_encodings.quality("gzip") > 0
+
+
+def streamed_response(chunks, mimetype, headers=None):
+    """
+    Return a streamed response whose body is the concatenation of `chunks`,
+    gzip-compressed if the client accepts it.
+
+    :param chunks: Iterable of str, consumed only as the response is sent.
+    :param mimetype: String.
+    :param headers: dict of additional headers.
+    :return: flask.Response
+    """
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    if accepts_gzip():
+        chunks = gzip_chunks(chunks, level=current_app.config.get("COMPRESS_LEVEL", 6))
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+def json_array_response(items):
+    """
+    Return a streamed response whose body is the JSON array of `items`.
+
+    `items` is consumed only as the response is sent, so it should be a lazy
+    iterable (e.g., a generator over a server-side cursor) if memory is to
+    remain independent of the size of the collection.
+
+    :param items: Iterable of JSON-serializable items.
+    :return: flask.Response
+    """
+    return streamed_response(json_array_chunks(items), mimetype="application/json")
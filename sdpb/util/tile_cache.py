@@ -0,0 +1,223 @@
+"""
+Tile-aligned cache of observation series.
+
+Users scroll charts back and forth over overlapping date ranges. Caching
+responses by their exact date bounds would reuse almost nothing, so instead we
+cache a station variable's observation series in fixed time tiles (calendar
+months), keyed by (station id, variable id, tile). A request for a date range
+is assembled from the tiles covering it; only the missing tiles are fetched
+from the database, in one query per run of consecutive missing tiles.
+
+Eviction is least-recently-used, bounded by the (estimated) total size of the
+cached tiles in bytes. In addition each tile has a time to live: tiles for
+past months ("closed" tiles) rarely change and are kept for a long time;
+tiles for the current month (or later) are still receiving observations and
+are refetched after a short time.
+
+The cache is held in memory, per process, and configured by app config values
+`OBS_TILE_CACHE_BYTES` (0 disables it), `OBS_TILE_CACHE_OPEN_TTL` and
+`OBS_TILE_CACHE_CLOSED_TTL`.
+
+Usage:
+
+```
+rows = get_tile_cache().series(
+    (station_id, var_id), start, end, fetch=lambda lo, hi: query(lo, hi).all()
+)
+```
+"""
+import datetime
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from time import monotonic
+from flask import current_app
+
+
+default_max_bytes = 64 * 1024 * 1024
+default_open_ttl = 5 * 60
+default_closed_ttl = 24 * 60 * 60
+
+# Approximate memory cost of one cached observation: the row tuple, its
+# datetime and float, and a slot in each of the tile's two lists.
+bytes_per_observation = 160
+bytes_per_tile = 400
+
+Observation = namedtuple("Observation", "time datum")
+
+
+def tile_of(time):
+    """Return the tile (months since year 0) containing `time`."""
+    return time.year * 12 + time.month - 1
+
+
+def tile_start(tile):
+    """Return the start (datetime) of a tile."""
+    return datetime.datetime(tile // 12, tile % 12 + 1, 1)
+
+
+def utc_now():
+    """Return the current time, UTC, as a naive datetime like Obs.time."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class Tile:
+    """Observations of one series in one tile, in time order."""
+
+    __slots__ = ("times", "rows", "size", "expires")
+
+    def __init__(self, rows, expires):
+        self.rows = rows
+        self.times = [row.time for row in rows]
+        self.size = bytes_per_tile + bytes_per_observation * len(rows)
+        self.expires = expires
+
+
+class TileCache:
+    """
+    Byte-bounded LRU cache of observation series tiles. Thread safe; tiles are
+    fetched outside the lock, so concurrent requests for the same missing tile
+    may both fetch it.
+    """
+
+    def __init__(
+        self,
+        max_bytes=default_max_bytes,
+        open_ttl=default_open_ttl,
+        closed_ttl=default_closed_ttl,
+    ):
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        self.closed_ttl = closed_ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, key):
+        """Return the unexpired tile cached under `key`, or None."""
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            if tile.expires <= monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile):
+        """Cache `tile` under `key`, evicting least recently used tiles."""
+        if tile.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._tiles:
+                self._remove(key)
+            self._tiles[key] = tile
+            self.size += tile.size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._tiles)))
+
+    def _remove(self, key):
+        self.size -= self._tiles.pop(key).size
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.size = 0
+
+    def ttl(self, tile, now):
+        """Return the time to live of `tile`: longer if it is closed."""
+        if tile_start(tile + 1) <= now:
+            return self.closed_ttl
+        return self.open_ttl
+
+    def series(self, series, start, end, fetch):
+        """
+        Return the observations of a series with `start <= time <= end`,
+        assembled from cached tiles, fetching the missing ones.
+
+        :param series: Hashable series key, e.g., (station_id, var_id).
+        :param start: (datetime) Start of range, inclusive.
+        :param end: (datetime) End of range, inclusive.
+        :param fetch: Function `fetch(lo, hi)` returning the observations of
+            the series with `lo <= time < hi`, in time order, as rows with
+            attributes `time` and `datum`.
+        :return: list of Observation
+        """
+        first, last = tile_of(start), tile_of(end)
+        tiles = {tile: self.get((series, tile)) for tile in range(first, last + 1)}
+        missing = [tile for tile, cached in tiles.items() if cached is None]
+        for run in runs(missing):
+            tiles.update(self.fetch_tiles(series, run, fetch))
+
+        rows = []
+        for tile in range(first, last + 1):
+            cached = tiles[tile]
+            lo = bisect_left(cached.times, start) if tile == first else 0
+            hi = bisect_right(cached.times, end) if tile == last else None
+            rows.extend(cached.rows[lo:hi])
+        return rows
+
+    def fetch_tiles(self, series, run, fetch):
+        """
+        Fetch a run of consecutive tiles with a single query, cache them and
+        return them as a dict of tile to Tile.
+        """
+        tiles = {tile: [] for tile in run}
+        for row in fetch(tile_start(run[0]), tile_start(run[-1] + 1)):
+            tiles[tile_of(row.time)].append(Observation(row.time, row.datum))
+        now, expires_base = utc_now(), monotonic()
+        result = {}
+        for tile, rows in tiles.items():
+            result[tile] = cached = Tile(rows, expires_base + self.ttl(tile, now))
+            self.put((series, tile), cached)
+        return result
+
+
+def runs(tiles):
+    """Split an increasing list of tiles into runs of consecutive tiles."""
+    result = []
+    for tile in tiles:
+        if result and result[-1][-1] == tile - 1:
+            result[-1].append(tile)
+        else:
+            result.append([tile])
+    return result
+
+
+_tile_cache = None
+_lock = threading.Lock()
+
+
+def get_tile_cache():
+    """
+    Return the process's tile cache, created on first use from the app
+    config; None if it is disabled.
+
+    :return: TileCache or None
+    """
+    global _tile_cache
+    max_bytes = current_app.config.get("OBS_TILE_CACHE_BYTES", default_max_bytes)
+    if not max_bytes:
+        return None
+    if _tile_cache is None:
+        with _lock:
+            if _tile_cache is None:
+                _tile_cache = TileCache(
+                    max_bytes=max_bytes,
+                    open_ttl=current_app.config.get(
+                        "OBS_TILE_CACHE_OPEN_TTL", default_open_ttl
+                    ),
+                    closed_ttl=current_app.config.get(
+                        "OBS_TILE_CACHE_CLOSED_TTL", default_closed_ttl
+                    ),
+                )
+    return _tile_cache
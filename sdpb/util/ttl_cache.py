@@ -0,0 +1,49 @@
+"""
+Small in-memory result cache with per-entry time to live.
+
+Entries are evicted least recently used first when the cache is full, and are
+ignored once they have expired. The cache is per process and thread safe.
+"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    """LRU cache of at most `max_entries` entries, each with its own TTL."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        """Return the unexpired value cached under `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl):
+        """Cache `value` under `key` for `ttl` seconds."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, monotonic() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
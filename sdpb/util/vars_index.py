@@ -0,0 +1,139 @@
+"""
+Compact index of the variables associated with each history.
+
+A dict of history id to a list of variable ids costs a boxed int per entry,
+plus a list and a dict slot per history; for CRMP that is hundreds of
+thousands of Python objects. `VarsByHistory` holds the same association in
+compressed sparse row (CSR) form, in three flat integer arrays:
+
+- `history_ids`: the history ids, sorted;
+- `offsets`: for the history at position i, its variable ids are
+  `var_ids[offsets[i]:offsets[i + 1]]`;
+- `var_ids`: the variable ids of all histories, concatenated, each history's
+  sorted.
+
+Lookup by history id is a bisection, O(log n). The reverse index, variable id
+to history ids, is the same structure transposed, built on first use.
+
+`VarsByHistory` is a read-only mapping of history id to a sequence of
+variable ids, so it can be used wherever a vars-by-history dict was.
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from functools import cached_property
+from itertools import groupby
+
+
+# Array type code for ids.
+id_type = "q"
+
+
+class VarsByHistory(Mapping):
+    """
+    Read-only mapping of history id to the (sorted) ids of the variables
+    associated with it, in compressed sparse row form.
+    """
+
+    def __init__(self, history_ids, offsets, var_ids):
+        """
+        :param history_ids: array of history ids, sorted.
+        :param offsets: array of len(history_ids) + 1 offsets into `var_ids`.
+        :param var_ids: array of variable ids.
+        """
+        self.history_ids = history_ids
+        self.offsets = offsets
+        self.var_ids = var_ids
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Build from (history id, variable id) pairs ordered by history id and
+        variable id, such as the rows of `sdpb.util.query.history_var_pairs_query`.
+        Pairs with a null variable id are ignored.
+        """
+        history_ids = array(id_type)
+        offsets = array(id_type, [0])
+        var_ids = array(id_type)
+        for history_id, group in groupby(pairs, lambda pair: pair[0]):
+            history_ids.append(history_id)
+            var_ids.extend(var_id for _, var_id in group if var_id is not None)
+            offsets.append(len(var_ids))
+        return cls(history_ids, offsets, var_ids)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Build from (history id, variable ids) items ordered by history id,
+        such as the items of another `VarsByHistory`.
+        """
+        history_ids = array(id_type)
+        offsets = array(id_type, [0])
+        var_ids = array(id_type)
+        for history_id, history_var_ids in items:
+            history_ids.append(history_id)
+            var_ids.extend(sorted(history_var_ids))
+            offsets.append(len(var_ids))
+        return cls(history_ids, offsets, var_ids)
+
+    def position(self, history_id):
+        """Return the position of `history_id`, or None if it is absent."""
+        i = bisect_left(self.history_ids, history_id)
+        if i < len(self.history_ids) and self.history_ids[i] == history_id:
+            return i
+        return None
+
+    def __getitem__(self, history_id):
+        i = self.position(history_id)
+        if i is None:
+            raise KeyError(history_id)
+        return self.var_ids[self.offsets[i] : self.offsets[i + 1]]
+
+    def __contains__(self, history_id):
+        return self.position(history_id) is not None
+
+    def __iter__(self):
+        return iter(self.history_ids)
+
+    def __len__(self):
+        return len(self.history_ids)
+
+    @cached_property
+    def histories_by_var(self):
+        """
+        The reverse index: a `VarsByHistory`-like CSR structure keyed by
+        variable id, whose values are history ids. Built on first use, in
+        linear time (counting sort).
+        """
+        return transposed(self)
+
+    def histories_for(self, var_id):
+        """Return the ids of the histories associated with variable `var_id`."""
+        return self.histories_by_var.get(var_id, array(id_type))
+
+
+def transposed(csr):
+    """
+    Return the transpose of a CSR structure: for each distinct value, the
+    sorted keys with which it is associated.
+
+    :param csr: VarsByHistory
+    :return: VarsByHistory (keyed by variable id, values are history ids)
+    """
+    keys = array(id_type, sorted(set(csr.var_ids)))
+    index = {key: j for j, key in enumerate(keys)}
+    counts = [0] * len(keys)
+    for value in csr.var_ids:
+        counts[index[value]] += 1
+    offsets = array(id_type, [0])
+    for count in counts:
+        offsets.append(offsets[-1] + count)
+    values = array(id_type, bytes(array(id_type).itemsize * len(csr.var_ids)))
+    fill = list(offsets[:-1])
+    # Rows are visited in key order, so each reverse row comes out sorted.
+    for i, key in enumerate(csr.history_ids):
+        for value in csr.var_ids[csr.offsets[i] : csr.offsets[i + 1]]:
+            j = index[value]
+            values[fill[j]] = key
+            fill[j] += 1
+    return VarsByHistory(keys, offsets, values)
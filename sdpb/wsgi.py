@@ -1,9 +1,10 @@
 import logging.config
 import yaml
 from sdpb import create_app
+from sdpb.timing import log_timing
 
 logging.config.dictConfig(yaml.safe_load(open("logging.yaml")))
 logger = logging.getLogger("sdpb")
-logger.info("Creating app")
 
-connexion_app, flask_app, app_db = create_app()
+with log_timing("Create app", log=logger.info):
+    connexion_app, flask_app, app_db = create_app()
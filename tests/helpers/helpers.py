@@ -1,3 +1,4 @@
+import struct
 from itertools import groupby
 
 
@@ -31,3 +32,92 @@ def hashabledictrep(d: dict):
     Useful for comparing collections of dicts using sets.
     """
     return tuple(sorted(d.items()))
+
+
+# Decoding of Mapbox Vector Tiles of point layers (see `sdpb.util.mvt`).
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def read_fields(data):
+    """Return the (field, value) pairs of a protobuf message, in order."""
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            (value,), pos = struct.unpack("<d", data[pos : pos + 8]), pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos : pos + length], pos + length
+        else:
+            raise ValueError(wire_type)
+        fields.append((field, value))
+    return fields
+
+
+def read_packed(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_value(data):
+    ((field, value),) = read_fields(data)
+    if field == 1:
+        return value.decode("utf-8")
+    if field == 6:
+        return unzigzag(value)
+    if field == 7:
+        return bool(value)
+    return value
+
+
+def decode_tile(data):
+    """Decode a tile of point layers to {name: (extent, [features])}."""
+    layers = {}
+    for field, layer_data in read_fields(data):
+        assert field == 3
+        layer_fields = read_fields(layer_data)
+        get = lambda n: [value for f, value in layer_fields if f == n]
+        assert get(15) == [2]
+        keys = [key.decode("utf-8") for key in get(3)]
+        values = [decode_value(value) for value in get(4)]
+        features = []
+        for feature_data in get(2):
+            feature = dict(read_fields(feature_data))
+            assert feature[3] == 1
+            command, x, y = read_packed(feature[4])
+            assert command == 9
+            tags = read_packed(feature.get(2, b""))
+            features.append(
+                {
+                    "id": feature.get(1),
+                    "point": (unzigzag(x), unzigzag(y)),
+                    "properties": {
+                        keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])
+                    },
+                }
+            )
+        (name,) = get(1)
+        layers[name.decode("utf-8")] = (get(5)[0], features)
+    return layers
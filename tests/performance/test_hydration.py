@@ -0,0 +1,82 @@
+"""
+Compare the cost of loading all histories as ORM entities (History,
+StationObservationStats) and as the lightweight column rows of
+`sdpb.util.query.base_history_query`.
+"""
+import tracemalloc
+import pytest
+from pycds import History, Station, StationObservationStats
+from sdpb import get_app_session
+from sdpb.util.query import base_history_query
+from sdpb.timing import timing
+from .test_performance import print_div, print_tabular, time_stat_values
+
+
+# Use this fixture in all tests in this file.
+pytestmark = pytest.mark.usefixtures("flask_app")
+
+
+def orm_history_query(session):
+    """The entity query that `base_history_query` replaced."""
+    return (
+        session.query(History, StationObservationStats)
+        .select_from(History)
+        .join(Station, History.station_id == Station.id)
+        .outerjoin(
+            StationObservationStats,
+            StationObservationStats.history_id == History.id,
+        )
+    )
+
+
+def load(query):
+    session = get_app_session()
+    try:
+        return query(session).all()
+    finally:
+        # Don't let entities loaded by one run be reused by the next.
+        session.expunge_all()
+
+
+def peak_memory(query):
+    """Return peak memory allocated (MB) while loading and holding the rows."""
+    tracemalloc.start()
+    try:
+        rows = load(query)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del rows
+    return round(peak / 2**20, 1)
+
+
+def test_history_hydration(repeats):
+    formats = (
+        "query!s:<8",
+        "rows!s:>8",
+        "time_min!s:>14",
+        "time_mean!s:>14",
+        "memory!s:>12",
+    )
+    print()
+    print_div()
+    print("Load all histories")
+    print()
+    print_tabular(
+        formats,
+        query="query",
+        rows="rows",
+        time_min="min time (ms)",
+        time_mean="mean time (ms)",
+        memory="peak (MB)",
+    )
+    for label, query in (("ORM", orm_history_query), ("Core", base_history_query)):
+        ts = timing(load, repeats=repeats, query=query)
+        print_tabular(
+            formats,
+            query=label,
+            rows=len(ts[0]["value"]),
+            **time_stat_values(ts),
+            memory=peak_memory(query),
+        )
+    print_div()
@@ -0,0 +1,41 @@
+"""
+Compare the cost of serializing the `stations.collection` representation with
+the JSON providers of `sdpb.util.json_provider`.
+"""
+import pytest
+from sdpb.api import stations
+from sdpb.timing import timing
+from sdpb.util.json_provider import StdlibJSONProvider, OrjsonProvider, orjson
+from .test_performance import print_div, print_tabular, time_stat_values
+
+
+# Use this fixture in all tests in this file.
+pytestmark = pytest.mark.usefixtures("flask_app")
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+def test_json_provider_timing(flask_app, repeats):
+    formats = ("provider!s:<12", "time_min!s:>14", "time_mean!s:>14")
+    rep = stations.collection(compact=False, expand="histories")
+    print()
+    print_div()
+    print(f"JSON serialization of stations.collection ({len(rep)} stations)")
+    print()
+    print_tabular(
+        formats,
+        provider="provider",
+        time_min="min time (ms)",
+        time_mean="mean time (ms)",
+    )
+    results = {}
+    for label, provider_class in (
+        ("stdlib", StdlibJSONProvider),
+        ("orjson", OrjsonProvider),
+    ):
+        provider = provider_class(flask_app)
+        # Formatted as connexion formats responses.
+        ts = timing(provider.dumps, repeats=repeats, obj=rep, indent=2)
+        results[label] = ts[0]["value"]
+        print_tabular(formats, provider=label, **time_stat_values(ts))
+    print_div()
+    assert results["orjson"] == results["stdlib"]
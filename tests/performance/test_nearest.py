@@ -0,0 +1,62 @@
+"""
+Compare the cost of finding the stations nearest to a point with the catalog
+KD-tree (`stations.nearest_station_indices`) and by brute force over all
+histories.
+"""
+import pytest
+from itertools import islice
+from sdpb import get_app_session
+from sdpb.api import stations
+from sdpb.timing import timing
+from sdpb.util.catalog import get_catalog
+from sdpb.util.kdtree import great_circle_distance, unit_vector
+from .test_performance import print_div, print_tabular, time_stat_values
+
+
+# Use this fixture in all tests in this file.
+pytestmark = pytest.mark.usefixtures("flask_app")
+
+
+def brute_force_nearest(catalog, lon, lat, k):
+    """Return the k nearest stations, as `nearest_station_indices` does."""
+    q = unit_vector(lon, lat)
+    distances = sorted(
+        (sum((a - b) ** 2 for a, b in zip(unit_vector(x, y), q)), j)
+        for j, (x, y) in enumerate(
+            zip(catalog.history_columns["lon"], catalog.history_columns["lat"])
+        )
+        if x is not None and y is not None
+    )
+    result = {}
+    for d2, j in distances:
+        if len(result) == k:
+            break
+        result.setdefault(
+            catalog.history_station_positions[j], great_circle_distance(d2)
+        )
+    return list(result.items())
+
+
+@pytest.mark.parametrize("k", [1, 10, 100])
+def test_nearest_timing(flask_app, repeats, k):
+    formats = ("method!s:<12", "time_min!s:>14", "time_mean!s:>14")
+    catalog = get_catalog(get_app_session())
+    catalog.history_tree  # Build the index before timing.
+    lon, lat = -123.4, 48.4
+    print()
+    print_div()
+    print(f"{k} nearest stations ({len(catalog)} histories)")
+    print()
+    print_tabular(
+        formats, method="method", time_min="min time (ms)", time_mean="mean time (ms)"
+    )
+    results = {}
+    for label, function in (
+        ("kd-tree", stations.nearest_station_indices),
+        ("brute force", brute_force_nearest),
+    ):
+        ts = timing(function, repeats=repeats, catalog=catalog, lon=lon, lat=lat, k=k)
+        results[label] = ts[0]["value"]
+        print_tabular(formats, method=label, **time_stat_values(ts))
+    print_div()
+    assert [i for i, _ in results["kd-tree"]] == [i for i, _ in results["brute force"]]
@@ -0,0 +1,42 @@
+"""
+Compare the cost of building history URIs with `url_for` and with the
+precompiled URI templates of `sdpb.util.uri`.
+"""
+import pytest
+from flask import url_for
+from sdpb.api import histories
+from sdpb.timing import timing
+from .test_performance import print_div, print_tabular, time_stat_values
+
+
+# Use this fixture in all tests in this file.
+pytestmark = pytest.mark.usefixtures("flask_app")
+
+
+def url_for_uri(history):
+    return url_for("sdpb_api_histories_single", id=histories.id_(history))
+
+
+def test_history_uri_timing(monkeypatch, repeats):
+    formats = ("uri builder!s:<12", "time_min!s:>14", "time_mean!s:>14")
+    print()
+    print_div()
+    print("histories.collection(include_uri=True)")
+    print()
+    print_tabular(
+        formats,
+        **{"uri builder": "uri builder"},
+        time_min="min time (ms)",
+        time_mean="mean time (ms)",
+    )
+    results = {}
+    for label, uri in (("url_for", url_for_uri), ("uri_for", histories.uri)):
+        # Note: histories.uri is evaluated before the loop patches it.
+        monkeypatch.setattr(histories, "uri", uri)
+        # The first call loads the catalog; time only representation.
+        histories.collection(include_uri=True)
+        ts = timing(histories.collection, repeats=repeats, include_uri=True)
+        results[label] = ts[0]["value"]
+        print_tabular(formats, **{"uri builder": label}, **time_stat_values(ts))
+    print_div()
+    assert results["uri_for"] == results["url_for"]
@@ -50,7 +50,8 @@ from pycds import (
 import pycds.alembic
 from pycds.climate_baseline_helpers import pcic_climate_variable_network_name
 
-from sdpb.api import networks, stations
+from sdpb.api import networks, station_tiles, stations
+from sdpb.util import catalog, count_cube
 from sdpb.util.representation import date_rep, float_rep
 from helpers import groupby_dict, find
 
@@ -91,10 +92,34 @@ def config_override(database_uri):
         "TESTING": True,
         "SQLALCHEMY_DATABASE_URI": database_uri,
         "SERVER_NAME": "test",
+        "CATALOG_REFRESH_INTERVAL": 0,
+        # Test data varies between tests; do not cache results across them.
+        "OBS_TILE_CACHE_BYTES": 0,
+        "WEATHER_CACHE_ENTRIES": 0,
+        "BASELINE_CACHE_TTL": 0,
+        "STATION_TILE_CACHE_BYTES": 0,
+        # Test data is visible only in the test session's transaction.
+        "PARALLEL_QUERIES": False,
         #        "SQLALCHEMY_ECHO": True,
     }
 
 
+@pytest.fixture(autouse=True)
+def reset_caches(monkeypatch):
+    """
+    Start each test with empty in-process caches. They are refreshed when the
+    data version changes, but tests must not depend on that: test data
+    differs between tests in ways the version probe may not see.
+    """
+    monkeypatch.setattr(catalog, "_catalog", None)
+    monkeypatch.setattr(catalog, "_checked_at", None)
+    monkeypatch.setattr(catalog, "_version", None)
+    monkeypatch.setattr(catalog, "_version_checked_at", None)
+    monkeypatch.setattr(count_cube, "_cube", None)
+    monkeypatch.setattr(count_cube, "_checked_at", None)
+    monkeypatch.setattr(station_tiles, "_cache", None)
+
+
 def initialize_database(engine, schema_name):
     """Initialize an empty database"""
     # Add role required by PyCDS migrations for privileged operations.
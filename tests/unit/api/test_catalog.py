@@ -0,0 +1,49 @@
+from sdpb.util.catalog import get_catalog
+
+
+def test_catalog_unchanged(flask_app, everything_session):
+    catalog = get_catalog(everything_session)
+    assert get_catalog(everything_session) is catalog
+
+
+def test_catalog_refresh(flask_app, everything_session, tst_histories, monkeypatch):
+    """
+    Test that a change to a history produces a new catalog in which only that
+    history differs.
+    """
+    # An update within the test's transaction changes no count or key, nor
+    # `mod_time` (the transaction's start time), so the fingerprint probe
+    # cannot see it; the statistics probe can.
+    monkeypatch.setitem(flask_app.config, "DATA_VERSION_PROBE", "statistics")
+    catalog = get_catalog(everything_session)
+    history = tst_histories[0]
+
+    # The data version includes the changes of the current transaction, so the
+    # catalog sees the change; the savepoint only serves to roll it back.
+    savepoint = everything_session.begin_nested()
+    history.station_name = "Renamed"
+    everything_session.flush()
+    refreshed = get_catalog(everything_session)
+    savepoint.rollback()
+
+    assert refreshed is not catalog
+    assert refreshed.version != catalog.version
+    before = {hx.id: hx for hx in catalog.histories()}
+    after = {hx.id: hx for hx in refreshed.histories()}
+    assert after.keys() == before.keys()
+    assert after[history.id].station_name == "Renamed"
+    assert {id_: hx for id_, hx in after.items() if id_ != history.id} == {
+        id_: hx for id_, hx in before.items() if id_ != history.id
+    }
+
+
+def test_catalog_build_indices(flask_app, everything_session):
+    catalog = get_catalog(everything_session)
+    catalog.build_indices()
+    for name in (
+        "history_grid",
+        "history_tree",
+        "history_station_positions",
+        "station_location_positions",
+    ):
+        assert name in vars(catalog)
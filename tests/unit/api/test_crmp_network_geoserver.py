@@ -0,0 +1,135 @@
+import json
+import re
+from collections import namedtuple
+import flask
+import pytest
+from sdpb.api import crmp_network_geoserver
+from sdpb.api.crmp_network_geoserver import (
+    item_keys,
+    feature_rep,
+    feature_collection_rep,
+    feature_collection_chunks,
+    split,
+)
+
+Item = namedtuple("Item", item_keys)
+
+
+def make_item(history_id, lon, lat):
+    return Item(
+        **{key: None for key in item_keys},
+    )._replace(history_id=history_id, lon=lon, lat=lat, network_id=1, freq="daily")
+
+
+def test_feature_rep():
+    feature = feature_rep(make_item(10, -123.0, 50.0))
+    assert feature["type"] == "Feature"
+    assert feature["id"] == 10
+    assert feature["geometry"] == {"type": "Point", "coordinates": [-123.0, 50.0]}
+    assert set(feature["properties"]) == set(item_keys) - {"lon", "lat"}
+    assert feature["properties"]["freq"] == "daily"
+
+    assert feature_rep(make_item(11, None, None))["geometry"] is None
+
+
+def test_feature_collection_chunks(flask_app):
+    items = [make_item(i, -123.0 + i, 50.0) for i in range(3)]
+    with flask_app.app_context():
+        text = "".join(feature_collection_chunks(items))
+    assert json.loads(text) == feature_collection_rep(items)
+
+
+@pytest.mark.parametrize(
+    "values, expected",
+    [(None, None), ("BC", ["BC"]), ("BC, AB,", ["BC", "AB"])],
+)
+def test_split(values, expected):
+    assert split(values) == expected
+
+
+def var_names(item):
+    """Return the list of (whole) variable names of a CNG item rep."""
+    return re.split(r"\s*,\s*", item["vars"]) if item["vars"] else []
+
+
+def in_bbox(item):
+    return -124 <= item["lon"] <= -122 and 48 <= item["lat"] <= 49
+
+
+@pytest.mark.parametrize(
+    "filters, selected",
+    [
+        (
+            {"province": "Province Hx P, Province Hx Q"},
+            lambda item: item["province"] in ("Province Hx P", "Province Hx Q"),
+        ),
+        ({"freq": "1-hourly"}, lambda item: item["freq"] == "1-hourly"),
+        ({"bbox": "-124,48,-122,49"}, in_bbox),
+        (
+            {"bbox": "-124,48,-122,49", "freq": "1-hourly, Freq Hx P"},
+            lambda item: in_bbox(item) and item["freq"] in ("1-hourly", "Freq Hx P"),
+        ),
+    ],
+)
+def test_collection_filters(flask_app, everything_session, filters, selected):
+    """Test that each filter selects exactly the matching items, in order."""
+    items = crmp_network_geoserver.collection()
+    expected = [item["history_id"] for item in items if selected(item)]
+    assert expected
+    result = crmp_network_geoserver.collection(**filters)
+    assert [item["history_id"] for item in result] == expected
+
+
+def test_collection_network_id(flask_app, everything_session):
+    items = crmp_network_geoserver.collection()
+    network_ids = {item["network_id"] for item in items}
+    assert len(network_ids) > 1
+    network_id = items[0]["network_id"]
+    result = crmp_network_geoserver.collection(network_id=[network_id])
+    assert [item["history_id"] for item in result] == [
+        item["history_id"] for item in items if item["network_id"] == network_id
+    ]
+
+
+def test_collection_vars(flask_app, everything_session):
+    """
+    Test that the `vars` filter matches whole variable names: a name that is a
+    prefix of another (as "Tma" of "Tmax") does not match it.
+    """
+    items = crmp_network_geoserver.collection()
+    names = sorted({name for item in items for name in var_names(item)})
+    assert names
+    for name in names:
+        result = crmp_network_geoserver.collection(vars=f"{name}, Unknown")
+        assert [item["history_id"] for item in result] == [
+            item["history_id"] for item in items if name in var_names(item)
+        ]
+        prefix = name[:-1]
+        assert prefix not in names
+        assert crmp_network_geoserver.collection(vars=prefix) == []
+
+
+@pytest.mark.parametrize("bbox", [None, "-124,48,-122,49"])
+def test_collection_cursor(flask_app, everything_session, bbox):
+    """
+    Test that following the next-page links of a paged collection yields the
+    whole collection, each item once and in order, with or without a region.
+    """
+    expected = [
+        item["history_id"] for item in crmp_network_geoserver.collection(bbox=bbox)
+    ]
+    assert len(expected) > 1
+    received = []
+    url = "/crmp_network_geoserver?limit=1" + (f"&bbox={bbox}" if bbox else "")
+    while url is not None:
+        with flask_app.test_request_context(url):
+            args = flask.request.args
+            page = crmp_network_geoserver.collection(
+                limit=1, bbox=args.get("bbox"), cursor=args.get("cursor")
+            )
+            response = flask_app.process_response(flask_app.make_response(page))
+        assert len(page) <= 1
+        received.extend(item["history_id"] for item in page)
+        link = response.headers.get("Link")
+        url = link and link[link.index("<") + 1 : link.index(">")]
+    assert received == expected
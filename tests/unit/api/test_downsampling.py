@@ -0,0 +1,54 @@
+import math
+import pytest
+from datetime import datetime, timedelta
+from sdpb.util.downsampling import downsample, lttb_indices, minmax_indices
+
+
+@pytest.fixture
+def series():
+    times = [datetime(2000, 1, 1) + timedelta(hours=i) for i in range(1000)]
+    values = [math.sin(i / 50) for i in range(1000)]
+    # A spike that naive decimation would miss.
+    values[333] = 10.0
+    return times, values
+
+
+@pytest.mark.parametrize("max_points", [3, 10, 100, 999])
+def test_lttb_indices(series, max_points):
+    times, values = series
+    xs = list(range(len(times)))
+    indices = lttb_indices(xs, values, max_points)
+    assert len(indices) == max_points
+    assert indices[0] == 0
+    assert indices[-1] == len(xs) - 1
+    assert indices == sorted(set(indices))
+    if max_points >= 10:
+        assert 333 in indices
+
+
+@pytest.mark.parametrize("max_points", [2, 10, 101])
+def test_minmax_indices(series, max_points):
+    _, values = series
+    indices = minmax_indices(values, max_points)
+    assert len(indices) <= max_points
+    assert indices == sorted(set(indices))
+    assert 333 in indices
+    assert values.index(min(values)) in indices
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_downsample(series, method):
+    times, values = series
+    indices, bucket_size = downsample(times, values, 100, method=method)
+    assert len(indices) <= 100
+    assert bucket_size > 1
+
+    # Short series are returned whole.
+    indices, bucket_size = downsample(times[:50], values[:50], 100, method=method)
+    assert indices == list(range(50))
+    assert bucket_size == 1
+
+
+def test_downsample_bad_method(series):
+    with pytest.raises(ValueError):
+        downsample(*series, 100, method="mean")
@@ -0,0 +1,81 @@
+import pytest
+from pycds import Network
+from sdpb.api import histories, networks, stations, variables
+from sdpb.util import catalog
+
+
+def etag_of(flask_app, handler, **kwargs):
+    """
+    Return the ETag of the response to a request, with query parameters
+    `kwargs`, handled by `handler`.
+    """
+    with flask_app.test_request_context(query_string=kwargs):
+        response = flask_app.process_response(
+            flask_app.make_response(handler(**kwargs))
+        )
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+@pytest.mark.parametrize(
+    "handler",
+    [
+        histories.collection,
+        networks.collection,
+        stations.collection,
+        variables.collection,
+    ],
+)
+def test_if_none_match(flask_app, everything_session, handler):
+    etag = etag_of(flask_app, handler)
+    assert etag == etag_of(flask_app, handler)
+
+    with flask_app.test_request_context(headers={"If-None-Match": etag}):
+        response = handler()
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert "Accept-Encoding" in response.vary
+
+    # A compressed representation of the same content also matches.
+    compressed_etag = f'{etag[:-1]}:gzip"'
+    with flask_app.test_request_context(headers={"If-None-Match": compressed_etag}):
+        response = handler()
+    assert response.status_code == 304
+    assert response.headers["ETag"] == compressed_etag
+
+
+def test_etag_depends_on_request(flask_app, everything_session):
+    assert etag_of(flask_app, networks.collection) != etag_of(
+        flask_app, networks.collection, provinces="BC"
+    )
+
+
+@pytest.mark.parametrize("probe", ["fingerprint", "statistics"])
+def test_etag_depends_on_data(flask_app, everything_session, monkeypatch, probe):
+    monkeypatch.setitem(flask_app.config, "DATA_VERSION_PROBE", probe)
+    etag = etag_of(flask_app, networks.collection)
+
+    # The savepoint only serves to roll the change back.
+    savepoint = everything_session.begin_nested()
+    everything_session.add(Network(id=9999, name="Added"))
+    everything_session.flush()
+    changed_etag = etag_of(flask_app, networks.collection)
+    savepoint.rollback()
+
+    assert changed_etag != etag
+
+
+@pytest.mark.parametrize("handler", [networks.collection, variables.collection])
+def test_etag_without_catalog(flask_app, everything_session, monkeypatch, handler):
+    """Test that these ETags do not load the catalog if it is not loaded."""
+    monkeypatch.setattr(catalog, "_catalog", None)
+    monkeypatch.setattr(catalog, "_version_checked_at", None)
+
+    def load(cls, session, version):
+        raise AssertionError("Catalog loaded")
+
+    monkeypatch.setattr(catalog.Catalog, "load", classmethod(load))
+    etag = etag_of(flask_app, handler)
+    assert catalog._catalog is None
+    assert catalog._version == catalog.catalog_version(everything_session)
+    assert etag_of(flask_app, handler) == etag
@@ -1,4 +1,7 @@
+import flask
+import gzip
 import pytest
+from flask import json
 from pycds import History
 from sdpb.api import histories
 
@@ -26,3 +29,91 @@ def test_collection(
         hx["variable_ids"] = set(hx["variable_ids"])
     expected = expected_history_collection(compact)
     assert result == expected
+
+
+@pytest.mark.parametrize("accept_encoding", [None, "gzip"])
+def test_collection_stream(flask_app, everything_session, accept_encoding):
+    """
+    Test that the streamed history collection contains the same items as the
+    non-streamed one, and is compressed only when the client accepts gzip.
+    """
+    headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+    with flask_app.test_request_context(headers=headers):
+        expected = json.loads(json.dumps(histories.collection()))
+        response = histories.collection(stream=True)
+        assert response.is_streamed
+        assert response.headers.get("Content-Encoding") == accept_encoding
+        body = response.get_data()
+    if accept_encoding == "gzip":
+        body = gzip.decompress(body)
+    assert json.loads(body) == expected
+
+
+def test_collection_cursor(flask_app, everything_session):
+    """
+    Test that following the next-page links of a paged collection yields the
+    whole collection, in order.
+    """
+    expected = [hx["id"] for hx in histories.collection()]
+    received = []
+    url = "/histories?limit=2"
+    while url is not None:
+        with flask_app.test_request_context(url):
+            page = histories.collection(
+                limit=2, cursor=flask.request.args.get("cursor")
+            )
+            response = flask_app.process_response(flask_app.make_response(page))
+        received.extend(hx["id"] for hx in page)
+        link = response.headers.get("Link")
+        url = link and link[link.index("<") + 1 : link.index(">")]
+    assert received == expected
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("provinces", [None, "Province Hx P"])
+def test_collection_columnar(flask_app, everything_session, compact, provinces):
+    """
+    Test that the columnar representation contains the same values as the
+    list of items.
+    """
+    items = histories.collection(compact=compact, provinces=provinces)
+    columns = histories.collection(
+        compact=compact, provinces=provinces, format="columnar"
+    )
+    variable_ids = columns.pop("variable_ids")
+    assert items
+    assert set(columns) == set(items[0]) - {"variable_ids"}
+    for name, values in columns.items():
+        assert values == [item[name] for item in items]
+    offsets = variable_ids["offsets"]
+    assert [
+        variable_ids["values"][offsets[i] : offsets[i + 1]] for i in range(len(items))
+    ] == [sorted(item["variable_ids"]) for item in items]
+
+
+square = {
+    "type": "Polygon",
+    "coordinates": [[[-124, 49], [-122, 49], [-122, 51], [-124, 51], [-124, 49]]],
+}
+
+
+@pytest.mark.parametrize(
+    "bbox, polygon, in_region",
+    [
+        ("-124,49,-122,51", None, lambda lon, lat: lat > 49),
+        ("-124,48,-122,49", None, lambda lon, lat: lat < 49),
+        ("0,0,1,1", None, lambda lon, lat: False),
+        (None, square, lambda lon, lat: lat > 49),
+        ("-124,48,-122,49", square, lambda lon, lat: False),
+    ],
+)
+def test_collection_spatial(flask_app, everything_session, bbox, polygon, in_region):
+    """
+    Test that spatial filters return exactly those histories located in the
+    region.
+    """
+    expected = [
+        hx["id"] for hx in histories.collection() if in_region(hx["lon"], hx["lat"])
+    ]
+    received = histories.collection(bbox=bbox, polygon=polygon)
+    assert [hx["id"] for hx in received] == expected
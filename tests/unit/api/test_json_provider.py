@@ -0,0 +1,74 @@
+import datetime
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+from sdpb.api import histories
+from sdpb.util.json_provider import OrjsonProvider, StdlibJSONProvider, orjson
+
+
+history = SimpleNamespace(
+    id=1,
+    station_name="Rivière-du-Loup",
+    lon=Decimal("-123.5"),
+    lat=Decimal("49.25"),
+    elevation=None,
+    province="QC",
+    freq="daily",
+    min_obs_time=datetime.datetime(2001, 1, 1),
+    max_obs_time=datetime.datetime(2010, 12, 31, 23, 30),
+    sdate=datetime.datetime(2000, 6, 1),
+    edate=None,
+    tz_offset=-5,
+    country="CA",
+)
+
+observations = {
+    "uri": "/stations/1/variables/2/observations",
+    "start_date": datetime.date(2001, 1, 1),
+    "end_date": datetime.datetime(2001, 1, 3),
+    "station": {"id": 1, "uri": "/stations/1", "network_uri": "/networks/1"},
+    "variable": {"id": 2, "uri": "/variables/2", "name": "Precip", "unit": "°C"},
+    "observations": [
+        {"value": 1.5, "time": datetime.datetime(2001, 1, 1)},
+        {"value": 1e-05, "time": datetime.datetime(2001, 1, 2, 12)},
+        {"value": Decimal("2.25"), "time": datetime.datetime(2001, 1, 3)},
+        {"value": None, "time": datetime.datetime(2001, 1, 3, 6)},
+    ],
+    "downsampling": None,
+}
+
+
+@pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+@pytest.mark.parametrize(
+    "payload",
+    [
+        histories.single_item_rep(history, vars=[3, 1, 2]),
+        [histories.single_item_rep(history, vars=[1], compact=True)] * 2,
+        observations,
+        {10: observations["observations"][:1], 9: "nine"},
+    ],
+)
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"indent": 2},
+        {"separators": (",", ":")},
+        {"separators": (",", ":"), "sort_keys": False},
+        {"separators": (",", ":"), "ensure_ascii": False},
+    ],
+)
+def test_providers_identical(payload, kwargs):
+    app = Flask(__name__)
+    expected = StdlibJSONProvider(app).dumps(payload, **kwargs)
+    assert OrjsonProvider(app).dumps(payload, **kwargs) == expected
+
+
+def test_date_rep():
+    text = StdlibJSONProvider(Flask(__name__)).dumps(histories.single_item_rep(history))
+    rep = json.loads(text)
+    assert rep["sdate"] == "2000-06-01T00:00:00"
+    assert rep["max_obs_time"] == "2010-12-31T23:30:00"
+    assert rep["lon"] == -123.5
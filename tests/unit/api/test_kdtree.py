@@ -0,0 +1,54 @@
+import random
+import pytest
+from itertools import islice
+from sdpb.util.kdtree import KDTree, great_circle_distance, unit_vector
+
+
+def chord_squared(p, q):
+    return sum((a - b) ** 2 for a, b in zip(p, q))
+
+
+def brute_force(lons, lats, lon, lat, accept=None):
+    q = unit_vector(lon, lat)
+    return sorted(
+        (chord_squared(unit_vector(x, y), q), position)
+        for position, (x, y) in enumerate(zip(lons, lats))
+        if x is not None and (accept is None or accept(position))
+    )
+
+
+@pytest.fixture(scope="module")
+def points():
+    rng = random.Random(1)
+    lons = [rng.uniform(-180, 180) for _ in range(2000)] + [None]
+    lats = [rng.uniform(-90, 90) for _ in range(2000)] + [None]
+    return lons, lats
+
+
+def test_great_circle_distance():
+    # A quarter of a great circle.
+    d2 = chord_squared(unit_vector(0, 0), unit_vector(90, 0))
+    assert great_circle_distance(d2) == pytest.approx(10007.5, abs=0.1)
+
+
+@pytest.mark.parametrize("accept", [None, lambda position: position % 5 == 0])
+@pytest.mark.parametrize(
+    "lon, lat", [(-123, 49), (179.9, 0), (-179.9, 0), (0, 90), (0, -89)]
+)
+def test_nearest(points, lon, lat, accept):
+    lons, lats = points
+    tree = KDTree(lons, lats)
+    assert len(tree) == 2000
+    expected = brute_force(lons, lats, lon, lat, accept)[:25]
+    received = list(islice(tree.nearest(lon, lat, accept=accept), 25))
+    assert [p for _, p in received] == [p for _, p in expected]
+    assert [d for d, _ in received] == pytest.approx(
+        [great_circle_distance(d2) for d2, _ in expected]
+    )
+
+
+def test_nearest_all(points):
+    lons, lats = points
+    tree = KDTree(lons, lats)
+    received = [p for _, p in tree.nearest(0, 0)]
+    assert sorted(received) == list(range(2000))
@@ -0,0 +1,74 @@
+import pytest
+from sdpb.util.mvt import (
+    Layer,
+    encode_tile,
+    is_tile,
+    project,
+    tile_bounds,
+    zigzag,
+)
+from helpers import decode_tile
+
+
+@pytest.mark.parametrize(
+    "value, expected", [(0, 0), (-1, 1), (1, 2), (-2, 3), (2**31, 2**32)]
+)
+def test_zigzag(value, expected):
+    assert zigzag(value) == expected
+
+
+def test_encode_tile():
+    layer = Layer("things")
+    layer.add_point(10, 20, {"name": "a", "n": 1, "flag": True, "x": 1.5}, id=7)
+    layer.add_point(-5, 4100, {"name": "b", "n": -3, "flag": False, "skip": None})
+    layer.add_point(0, 0, {"name": "a", "n": 1, "flag": True})
+    empty = Layer("empty")
+
+    layers = decode_tile(encode_tile([layer, empty]))
+    assert list(layers) == ["things"]
+    extent, features = layers["things"]
+    assert extent == 4096
+    assert features == [
+        {
+            "id": 7,
+            "point": (10, 20),
+            "properties": {"name": "a", "n": 1, "flag": True, "x": 1.5},
+        },
+        {
+            "id": None,
+            "point": (-5, 4100),
+            "properties": {"name": "b", "n": -3, "flag": False},
+        },
+        {
+            "id": None,
+            "point": (0, 0),
+            "properties": {"name": "a", "n": 1, "flag": True},
+        },
+    ]
+    # Repeated keys and values are stored once; True and 1 are distinct.
+    assert len(layer.keys) == 4
+    assert len(layer.values) == 7
+
+
+@pytest.mark.parametrize(
+    "z, x, y, expected",
+    [(0, 0, 0, True), (2, 3, 3, True), (2, 4, 0, False), (1, 0, -1, False)],
+)
+def test_is_tile(z, x, y, expected):
+    assert is_tile(z, x, y) == expected
+
+
+@pytest.mark.parametrize("z, x, y", [(0, 0, 0), (5, 4, 10), (12, 650, 1380)])
+def test_project_tile_bounds(z, x, y):
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    assert project(min_lon, max_lat, z, x, y) == (0, 0)
+    assert project(max_lon, min_lat, z, x, y) == (4096, 4096)
+    mid = project((min_lon + max_lon) / 2, (min_lat + max_lat) / 2, z, x, y)
+    assert mid[0] == 2048
+    assert 0 < mid[1] < 4096
+
+
+def test_tile_bounds_buffer():
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(5, 4, 10, 0.5)
+    assert project(min_lon, max_lat, 5, 4, 10) == (-2048, -2048)
+    assert project(max_lon, min_lat, 5, 4, 10) == (6144, 6144)
@@ -0,0 +1,110 @@
+import pytest
+from datetime import datetime
+from sdpb.api import observations
+from sdpb.util.count_cube import CountCube, month_of
+
+
+@pytest.mark.parametrize(
+    "start_date, end_date, station_ids, provinces",
+    [
+        (None, None, None, None),
+        ("2000-01-01", "2000-01-31", None, None),
+        ("2000-02-01", None, None, None),
+        (None, "1999-12-31", None, None),
+        (None, None, [0, 4, 5], None),
+        (None, None, [], None),
+        (None, None, None, "Province Hx P,Province Hx R"),
+        ("2000-01-15", "2000-03-01", [4], "Province Hx R"),
+    ],
+)
+def test_get_counts(
+    flask_app, everything_session, start_date, end_date, station_ids, provinces
+):
+    """The count cube gives the same counts as the queries."""
+    expected_obs_counts = {
+        r.station_id: r.total
+        for r in observations.obs_counts_by_station_query(
+            everything_session,
+            start_date=start_date,
+            end_date=end_date,
+            station_ids=station_ids,
+            provinces=provinces,
+        )
+    }
+    expected_climo_counts = {
+        r.station_id: r.total
+        for r in observations.climo_counts_by_station_query(
+            everything_session, station_ids=station_ids, provinces=provinces
+        )
+    }
+
+    received = observations.get_counts(
+        start_date=start_date,
+        end_date=end_date,
+        station_ids=station_ids,
+        provinces=provinces,
+    )
+
+    assert received["observationCounts"] == expected_obs_counts
+    assert received["climatologyCounts"] == expected_climo_counts
+
+
+def test_count_cube():
+    monthly_counts = [
+        (1, "BC", datetime(2000, 1, 1), 10),
+        (1, "BC", datetime(2000, 3, 1), 20),
+        (1, "BC", datetime(2001, 1, 1), 30),
+        (1, "BC", None, 3),
+        (1, "YT", datetime(2000, 2, 1), 5),
+        (2, "AB", datetime(1999, 12, 1), 7),
+        (2, "AB", datetime(2000, 2, 1), None),
+        (4, "BC", datetime(2000, 2, 1), None),
+        (5, "BC", None, 8),
+        (6, None, None, None),
+    ]
+    climo_counts = [(1, "BC", 12), (3, "BC", 24), (5, "BC", None)]
+    cube = CountCube("v", monthly_counts, climo_counts)
+
+    def expected(start=None, end=None, station_ids=None, provinces=None):
+        """
+        Return the counts as `observations.obs_counts_by_station_query`
+        computes them: a comparison with a NULL month is false, and NULL
+        counts are ignored by `sum`, unless all counts are NULL.
+        """
+        counts = {}
+        for station_id, province, month, count in monthly_counts:
+            if (
+                (start is None or (month and month_of(month) >= start))
+                and (end is None or (month and month_of(month) <= end))
+                and (not station_ids or station_id in station_ids)
+                and (provinces is None or province in provinces)
+            ):
+                if count is None:
+                    counts.setdefault(station_id, None)
+                else:
+                    counts[station_id] = (counts.get(station_id) or 0) + count
+        return counts
+
+    jan, feb, mar = (month_of(datetime(2000, m, 1)) for m in (1, 2, 3))
+    for kwargs in [
+        {},
+        {"start": jan},
+        {"end": feb},
+        {"start": feb, "end": mar},
+        {"start": feb, "end": feb, "provinces": {"BC"}},
+        {"station_ids": [2, 3]},
+        {"station_ids": [5, 6]},
+        {"provinces": {"AB", "YT"}},
+    ]:
+        assert cube.observation_counts(
+            start_month=kwargs.get("start"),
+            end_month=kwargs.get("end"),
+            station_ids=kwargs.get("station_ids"),
+            provinces=kwargs.get("provinces"),
+        ) == expected(**kwargs)
+
+    assert cube.observation_counts() == {1: 68, 2: 7, 4: None, 5: 8, 6: None}
+    assert cube.observation_counts(start_month=feb) == {1: 55, 2: None, 4: None}
+    assert cube.climatology_counts() == {1: 12, 3: 24, 5: None}
+    assert cube.climatology_counts(provinces={"YT"}) == {}
+    assert cube.climatology_counts(station_ids=[3]) == {3: 24}
@@ -0,0 +1,176 @@
+import threading
+import pytest
+from sqlalchemy.dialects import postgresql
+from pycds import History
+from sdpb.util.catalog import HistoryRecord
+from flask import current_app
+from sqlalchemy import text
+from sdpb.util import parallel_queries as parallel_queries_module
+from sdpb.util.parallel_queries import parallel_queries, parallel_queries_enabled
+from sdpb.util.query import (
+    data_version,
+    data_version_probes,
+    get_all_histories_etc,
+    get_all_vars_by_hx,
+    get_station_vars_by_hx,
+    station_vars_by_hx_query,
+)
+
+
+def compiled_sql(query):
+    return str(
+        query.statement.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+def test_station_vars_by_hx_query_filters_station(session):
+    sql = compiled_sql(station_vars_by_hx_query(session, 12345))
+    assert "WHERE" in sql
+    assert "meta_history.station_id = 12345" in sql.split("WHERE", 1)[1]
+
+
+@pytest.mark.parametrize("station_index", [0, 3, 4])
+def test_get_station_vars_by_hx(
+    everything_session, tst_stations, tst_histories, station_index
+):
+    station = tst_stations[station_index]
+    all_vars_by_hx = get_all_vars_by_hx(everything_session)
+    hx_ids = {hx.id for hx in tst_histories if hx.station_id == station.id}
+    received = get_station_vars_by_hx(everything_session, station.id)
+    assert received.keys() == hx_ids
+    assert {
+        hx_id: sorted(var_id for var_id in variable_ids if var_id is not None)
+        for hx_id, variable_ids in received.items()
+    } == {hx_id: list(all_vars_by_hx.get(hx_id, [])) for hx_id in hx_ids}
+
+
+@pytest.mark.parametrize("probe", sorted(data_version_probes))
+def test_data_version(flask_app, everything_session, tst_histories, monkeypatch, probe):
+    monkeypatch.setitem(flask_app.config, "DATA_VERSION_PROBE", probe)
+    version = data_version(everything_session, (History,))
+    assert len(version) == 1
+    assert data_version(everything_session, (History,)) == version
+
+    # The savepoint only serves to roll the change back.
+    savepoint = everything_session.begin_nested()
+    everything_session.add(
+        History(id=9999, station_id=tst_histories[0].station_id, freq="daily")
+    )
+    everything_session.flush()
+    changed = data_version(everything_session, (History,))
+    savepoint.rollback()
+    assert changed != version
+
+
+def test_data_version_custom_probe(flask_app, everything_session, monkeypatch):
+    calls = []
+
+    def probe(session, tables):
+        calls.append(tables)
+        return ("custom",)
+
+    monkeypatch.setitem(flask_app.config, "DATA_VERSION_PROBE", probe)
+    assert data_version(everything_session, (History,)) == ("custom",)
+    assert calls == [[History]]
+
+
+def test_get_all_histories_etc(everything_session, tst_histories):
+    """
+    Test that histories are loaded as plain rows carrying the attributes of
+    the history representation, for published stations only.
+    """
+    rows = get_all_histories_etc(everything_session)
+    assert all(row._fields == HistoryRecord._fields for row in rows)
+    by_id = {hx.id: hx for hx in tst_histories}
+    for row in rows:
+        history = by_id[row.id]
+        assert (row.station_id, row.station_name, row.province) == (
+            history.station_id,
+            history.station_name,
+            history.province,
+        )
+
+
+def test_parallel_queries(flask_app, everything_session, tst_histories):
+    # Disabled in the test config, so the queries run in the test session,
+    # which sees the (uncommitted) test data.
+    assert not parallel_queries_enabled(everything_session)
+    histories, history_ids = parallel_queries(
+        everything_session,
+        lambda s: s.query(History).all(),
+        lambda s: [id for id, in s.query(History.id)],
+    )
+    assert len(histories) == len(tst_histories)
+    assert sorted(history_ids) == sorted(h.id for h in tst_histories)
+
+
+@pytest.fixture
+def enable_parallel_queries(flask_app, monkeypatch):
+    """Enable parallel queries with `connections` connections."""
+
+    def enable(connections):
+        monkeypatch.setitem(flask_app.config, "PARALLEL_QUERIES", True)
+        monkeypatch.setitem(
+            flask_app.config, "PARALLEL_QUERIES_CONNECTIONS", connections
+        )
+        parallel_queries_module.dispose()
+
+    yield enable
+    parallel_queries_module.dispose()
+
+
+def test_parallel_queries_in_parallel(everything_session, enable_parallel_queries):
+    """Queries run in other threads, in the app context of the caller."""
+    enable_parallel_queries(2)
+    results = parallel_queries(
+        everything_session,
+        lambda s: (current_app.name, threading.current_thread().name),
+        lambda s: s.execute(text("SELECT 1")).scalar(),
+    )
+    name, thread_name = results[0]
+    assert name == current_app.name
+    assert thread_name.startswith("parallel-query")
+    assert results[1] == 1
+
+
+def test_parallel_queries_pool_size_1(
+    everything_session, tst_histories, enable_parallel_queries
+):
+    """
+    With too few connections for the queries, they run serially in the
+    caller's session (which sees the uncommitted test data).
+    """
+    enable_parallel_queries(1)
+    histories, history_ids = parallel_queries(
+        everything_session,
+        lambda s: s.query(History).all(),
+        lambda s: [id for id, in s.query(History.id)],
+    )
+    assert len(histories) == len(tst_histories)
+    assert sorted(history_ids) == sorted(h.id for h in tst_histories)
+    assert parallel_queries_module.get_runner(everything_session.get_bind()).size == 1
+
+
+def test_parallel_queries_engine_options(
+    flask_app, everything_session, enable_parallel_queries, monkeypatch
+):
+    """Parallel queries use connections configured like the app's."""
+    options = {
+        **flask_app.config["SQLALCHEMY_ENGINE_OPTIONS"],
+        "connect_args": {"application_name": "sdpb-test"},
+    }
+    monkeypatch.setitem(flask_app.config, "SQLALCHEMY_ENGINE_OPTIONS", options)
+    monkeypatch.setitem(flask_app.config, "SQLALCHEMY_ECHO", True)
+    enable_parallel_queries(2)
+    show_application_name = text("SHOW application_name")
+    results = parallel_queries(
+        everything_session,
+        lambda s: s.execute(show_application_name).scalar(),
+        lambda s: s.execute(show_application_name).scalar(),
+    )
+    assert results == ["sdpb-test", "sdpb-test"]
+    runner = parallel_queries_module.get_runner(everything_session.get_bind())
+    assert runner.engine.echo
+    assert runner.engine.pool.size() == 2
@@ -0,0 +1,81 @@
+import random
+import pytest
+import werkzeug.exceptions
+from sdpb.util.spatial import BBox, GridIndex, parse_bbox, parse_polygon, region
+
+
+# A 4 x 4 square with a 2 x 2 hole in the middle.
+square_with_hole = {
+    "type": "Polygon",
+    "coordinates": [
+        [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]],
+        [[1, 1], [3, 1], [3, 3], [1, 3], [1, 1]],
+    ],
+}
+
+
+def test_parse_bbox():
+    assert parse_bbox(None) is None
+    assert parse_bbox("-124,48.5,-122,50") == BBox(-124, 48.5, -122, 50)
+
+
+@pytest.mark.parametrize("bbox", ["", "1,2,3", "a,b,c,d", "1,2,0,3", "1,2,3,1"])
+def test_parse_bad_bbox(bbox):
+    with pytest.raises(werkzeug.exceptions.BadRequest):
+        parse_bbox(bbox)
+
+
+@pytest.mark.parametrize(
+    "geometry",
+    [
+        {"type": "Point", "coordinates": [0, 0]},
+        {"type": "Polygon", "coordinates": [[[0, 0], [1, 1]]]},
+        {"type": "Polygon"},
+        "not json",
+    ],
+)
+def test_parse_bad_polygon(geometry):
+    with pytest.raises(werkzeug.exceptions.BadRequest):
+        parse_polygon(geometry)
+
+
+@pytest.mark.parametrize(
+    "lon, lat, expected",
+    [
+        (0.5, 0.5, True),
+        (2, 2, False),
+        (3.5, 2, True),
+        (5, 2, False),
+        (-1, 2, False),
+    ],
+)
+def test_polygon_contains(lon, lat, expected):
+    polygon = parse_polygon(square_with_hole)
+    assert polygon.contains_points([lon], [lat]) == [expected]
+    feature = {"type": "Feature", "geometry": square_with_hole}
+    multi = {"type": "MultiPolygon", "coordinates": [square_with_hole["coordinates"]]}
+    for geometry in (feature, multi):
+        assert parse_polygon(geometry).contains_points([lon], [lat]) == [expected]
+
+
+@pytest.mark.parametrize(
+    "bbox, polygon",
+    [
+        ("-1,-1,2.5,2.5", None),
+        ("10,10,20,20", None),
+        (None, square_with_hole),
+        ("0,0,2,4", square_with_hole),
+    ],
+)
+def test_grid_index_search(bbox, polygon):
+    rng = random.Random(1)
+    lons = [rng.uniform(-2, 6) for _ in range(500)] + [None]
+    lats = [rng.uniform(-2, 6) for _ in range(500)] + [None]
+    index = GridIndex(lons, lats, cell_size=0.5)
+    area = region(bbox=bbox, polygon=polygon)
+    expected = [
+        k
+        for k, (lon, lat) in enumerate(zip(lons, lats))
+        if lon is not None and area.contains_points([lon], [lat])[0]
+    ]
+    assert index.search(area) == expected
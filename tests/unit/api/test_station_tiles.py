@@ -0,0 +1,104 @@
+import gzip
+import pytest
+import werkzeug.exceptions
+from sdpb.api import station_tiles
+from sdpb.api.station_tiles import VectorTileCache, encode_station_tile, tile
+from sdpb.util.catalog import get_catalog
+from sdpb.util.mvt import project
+from sdpb.util.precompressed import Precompressed
+from helpers import decode_tile
+
+
+def test_tile_world(flask_app, everything_session):
+    catalog = get_catalog(everything_session)
+    layers = decode_tile(encode_station_tile(catalog, 0, 0, 0))
+
+    _, histories = layers["histories"]
+    located = [
+        j
+        for j in range(len(catalog))
+        if catalog.history_columns["lon"][j] is not None
+        and catalog.history_columns["lat"][j] is not None
+    ]
+    assert sorted(f["id"] for f in histories) == sorted(
+        catalog.history_columns["id"][j] for j in located
+    )
+    for feature in histories:
+        j = catalog.history_columns["id"].index(feature["id"])
+        assert feature["properties"]["station_id"] == (
+            catalog.history_columns["station_id"][j]
+        )
+        assert feature["properties"]["freq"] == catalog.history_columns["freq"][j]
+        assert feature["point"] == project(
+            catalog.history_columns["lon"][j],
+            catalog.history_columns["lat"][j],
+            0,
+            0,
+            0,
+        )
+
+    _, stations = layers["stations"]
+    located_stations = {catalog.history_columns["station_id"][j] for j in located}
+    assert sorted(f["id"] for f in stations) == sorted(located_stations)
+
+
+def test_tile_region(flask_app, everything_session):
+    """A zoomed-in tile contains only the nearby histories."""
+    catalog = get_catalog(everything_session)
+    z = 10
+    x, y = (coordinate // 4096 for coordinate in project(-123, 50, z, 0, 0))
+    _, histories = decode_tile(encode_station_tile(catalog, z, x, y))["histories"]
+    expected = [
+        catalog.history_columns["id"][j]
+        for j in range(len(catalog))
+        if catalog.history_columns["lat"][j] == 50
+    ]
+    assert expected
+    assert sorted(f["id"] for f in histories) == sorted(expected)
+
+
+def test_tile_response(flask_app, everything_session):
+    with flask_app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = tile(0, 0, 0)
+    assert response.mimetype == "application/vnd.mapbox-vector-tile"
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "histories" in decode_tile(gzip.decompress(response.get_data()))
+
+    with flask_app.test_request_context():
+        with pytest.raises(werkzeug.exceptions.NotFound):
+            tile(1, 2, 0)
+
+
+def test_tile_cache(flask_app, everything_session, monkeypatch):
+    monkeypatch.setitem(flask_app.config, "STATION_TILE_CACHE_BYTES", 1024 * 1024)
+    monkeypatch.setattr(station_tiles, "_cache", None)
+    catalog = get_catalog(everything_session)
+    first = station_tiles.station_tile(catalog, 0, 0, 0)
+    assert station_tiles.station_tile(catalog, 0, 0, 0) is first
+
+
+def test_vector_tile_cache():
+    def tile_of_size(n):
+        return Precompressed.of(bytes(range(256)) * n)
+
+    size = tile_of_size(4).size
+    cache = VectorTileCache(max_bytes=3 * size)
+    assert cache.get("v1", 5, 0, 0) is None
+    for x in range(3):
+        cache.put("v1", 5, x, 0, tile_of_size(4))
+    cache.put("v1", 2, 0, 0, tile_of_size(4))
+    assert cache.get("v1", 5, 0, 0) is not None
+
+    # Evicts the least recently used tile of the same zoom level only.
+    cache.put("v1", 5, 3, 0, tile_of_size(4))
+    assert cache.get("v1", 5, 1, 0) is None
+    assert cache.get("v1", 5, 0, 0) is not None
+    assert cache.get("v1", 2, 0, 0) is not None
+    assert cache.size(5) == 3 * size
+
+    # A tile for an old version is not cached; a new version clears the cache.
+    cache.put("v0", 5, 9, 9, tile_of_size(1))
+    assert cache.get("v1", 5, 9, 9) is None
+    assert cache.get("v2", 5, 0, 0) is None
+    assert cache.get("v2", 2, 0, 0) is None
+    assert cache.size(5) == 0
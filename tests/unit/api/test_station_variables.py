@@ -1,5 +1,7 @@
 import pytest
-from pycds import Station
+from contextlib import contextmanager
+from sqlalchemy import event
+from pycds import History, Obs, Station, VarsPerHistory
 from sdpb.api import station_variables, variables, networks
 from helpers import omit
 from datetime import datetime
@@ -32,6 +34,59 @@ def test_station_variables(flask_app, everything_session, tst_variables):
         }
 
 
+@contextmanager
+def count_queries(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_station_variables_query_count(flask_app, engine, everything_session):
+    with count_queries(engine) as statements:
+        received = station_variables.get_station_variables(0)
+    assert len(received["variables"]) == 2
+    # Station, variable timespans, variables; independent of number of variables.
+    assert len(statements) == 3
+
+
+def test_station_variables_history_without_stats(
+    flask_app, everything_session, tst_variables
+):
+    """
+    A history of the station without observation stats contributes to the
+    timespans of the variables of the station, but not its own variables, as
+    for a single station variable.
+    """
+    savepoint = everything_session.begin_nested()
+    everything_session.add(History(id=9999, station_id=0, station_name="No stats"))
+    everything_session.flush()
+    everything_session.add_all(
+        Obs(
+            id=99990 + i,
+            history_id=9999,
+            vars_id=variable.id,
+            time=datetime(2005, 1, 1),
+            datum=1.0,
+        )
+        for i, variable in enumerate((tst_variables[0], tst_variables[4]))
+    )
+    everything_session.flush()
+    everything_session.execute(VarsPerHistory.refresh())
+    received = station_variables.get_station_variables(0)
+    expected = [station_variables.get_station_variable(0, var) for var in (0, 1)]
+    savepoint.rollback()
+
+    assert received["variables"] == expected
+    assert received["variables"][0]["max_obs_time"] == datetime(2005, 1, 1)
+
+
 def test_station_variable(flask_app, everything_session, tst_variables):
     received_var = station_variables.get_station_variable(0, 0)
     expected_var = next(v for v in tst_variables if v.id == 0)
@@ -84,3 +139,89 @@ def test_station_variable_observations(
         station, variable, start_date=start_date, end_date=end_date
     )
     assert len(received["observations"]) == expected_obs
+
+
+@pytest.mark.parametrize("format", ["csv", "ndjson"])
+@pytest.mark.parametrize(
+    "station, variable, start, end, expected_obs",
+    [
+        (4, 7, datetime(1999, 1, 31), datetime(2000, 1, 31), 721),
+        (4, 7, datetime(2000, 1, 15), datetime(2000, 1, 31), 385),
+        (4, 0, datetime(1999, 1, 31), datetime(2000, 1, 31), 0),
+    ],
+)
+def test_station_variable_observations_export(
+    flask_app,
+    everything_session,
+    tst_variables,
+    tst_networks,
+    format,
+    station,
+    variable,
+    start,
+    end,
+    expected_obs,
+):
+    with flask_app.test_request_context():
+        response = station_variables.get_observations(
+            station,
+            variable,
+            start_date=start.isoformat(),
+            end_date=end.isoformat(),
+            format=format,
+        )
+        assert response.headers["Content-Disposition"].startswith("attachment")
+        lines = response.get_data(as_text=True).splitlines()
+
+    if format == "csv":
+        assert lines[0] == "time,value"
+        lines = lines[1:]
+    assert len(lines) == expected_obs
+
+
+def test_station_variable_observations_export_unlimited(
+    flask_app, everything_session, tst_variables, tst_networks
+):
+    # The JSON representation is limited to the 26 weeks before the end date;
+    # an export covers the whole range.
+    start_date, end_date = "1990-01-01", "2010-01-01"
+    received = station_variables.get_observations(
+        4, 7, start_date=start_date, end_date=end_date
+    )
+    assert len(received["observations"]) == 0
+
+    with flask_app.test_request_context():
+        response = station_variables.get_observations(
+            4, 7, start_date=start_date, end_date=end_date, format="csv"
+        )
+        lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) - 1 >= 721
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("max_points, expected_obs", [(100, 100), (1000, 721)])
+def test_station_variable_observations_downsampled(
+    flask_app,
+    everything_session,
+    tst_variables,
+    tst_networks,
+    method,
+    max_points,
+    expected_obs,
+):
+    received = station_variables.get_observations(
+        4,
+        7,
+        start_date=datetime(1999, 1, 31).isoformat(),
+        end_date=datetime(2000, 1, 31).isoformat(),
+        max_points=max_points,
+        downsample_method=method,
+    )
+    observations = received["observations"]
+    assert len(observations) <= expected_obs
+    if method == "lttb":
+        assert len(observations) == expected_obs
+    times = [o["time"] for o in observations]
+    assert times == sorted(times)
+    assert received["downsampling"]["method"] == method
+    assert (received["downsampling"]["bucket_size"] > 1) == (max_points < 721)
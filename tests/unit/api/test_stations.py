@@ -1,6 +1,8 @@
+import flask
 import pytest
+import werkzeug.exceptions
 from pycds import Station
-from sdpb.api import stations, variables, station_variables
+from sdpb.api import networks, stations, variables, station_variables
 from helpers import omit
 
 
@@ -71,3 +73,101 @@ def test_single_station(
 
     # check histories
     assert {h for h in expected_histories} == {h["id"] for h in received["histories"]}
+
+
+@pytest.mark.parametrize("limit", [1, 2])
+def test_station_collection_cursor(flask_app, everything_session, limit):
+    """
+    Test that following the next-page links of a paged collection yields the
+    whole collection, in order, and that the last page has no next link.
+    """
+    expected = [s["id"] for s in stations.collection()]
+    received = []
+    url = f"/stations?limit={limit}"
+    while url is not None:
+        with flask_app.test_request_context(url):
+            page = stations.collection(
+                limit=limit, cursor=flask.request.args.get("cursor")
+            )
+            response = flask_app.process_response(flask_app.make_response(page))
+        assert len(page) <= limit
+        received.extend(s["id"] for s in page)
+        link = response.headers.get("Link")
+        url = link and link[link.index("<") + 1 : link.index(">")]
+    assert received == expected
+
+
+def test_station_collection_bad_cursor(flask_app, everything_session):
+    with pytest.raises(werkzeug.exceptions.BadRequest):
+        stations.collection(limit=1, cursor="not a cursor")
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("expand", [None, "histories"])
+def test_station_collection_columnar(flask_app, everything_session, compact, expand):
+    """
+    Test that the columnar representation contains the same values as the
+    list of items.
+    """
+    items = stations.collection(compact=compact, expand=expand)
+    columns = stations.collection(compact=compact, expand=expand, format="columnar")
+    assert columns["id"] == [item["id"] for item in items]
+    assert columns["native_id"] == [item["native_id"] for item in items]
+    assert [networks.uri(id_) for id_ in columns["network_id"]] == [
+        item["network_uri"] for item in items
+    ]
+    if not compact:
+        for name in ("min_obs_time", "max_obs_time"):
+            assert columns[name] == [item[name] for item in items]
+    offsets = columns["histories"]["offsets"]
+    values = columns["histories"]["values"]
+    history_ids = values["id"] if expand == "histories" else values
+    assert [history_ids[offsets[i] : offsets[i + 1]] for i in range(len(items))] == [
+        [hx["id"] for hx in item["histories"]] for item in items
+    ]
+
+
+@pytest.mark.parametrize("bbox", ["-124,49,-122,51", "-124,48,-122,49", "0,0,1,1"])
+def test_station_collection_bbox(flask_app, everything_session, bbox):
+    """
+    Test that the bbox filter returns exactly those stations with a history
+    located in the box.
+    """
+    min_lon, min_lat, max_lon, max_lat = map(float, bbox.split(","))
+    expected = [
+        s["id"]
+        for s in stations.collection()
+        if any(
+            min_lon <= hx["lon"] <= max_lon and min_lat <= hx["lat"] <= max_lat
+            for hx in s["histories"]
+        )
+    ]
+    received = stations.collection(bbox=bbox)
+    assert [s["id"] for s in received] == expected
+
+
+def test_station_collection_bad_bbox(flask_app, everything_session):
+    with pytest.raises(werkzeug.exceptions.BadRequest):
+        stations.collection(bbox="-122,49,-124")
+
+
+@pytest.mark.parametrize("k", [1, 2, 10])
+@pytest.mark.parametrize("lon, lat", [(-123, 50), (-123, 48)])
+def test_nearest(flask_app, everything_session, lon, lat, k):
+    """
+    Test that the nearest stations are those whose nearest history is
+    nearest, in order.
+    """
+    everything = stations.collection(expand="histories")
+    expected = sorted(
+        (min(abs(hx["lat"] - lat) for hx in s["histories"]), s["id"])
+        for s in everything
+    )[:k]
+    received = stations.nearest(lon=lon, lat=lat, k=k)
+    assert len(received) == len(expected)
+    # Test histories are all at the same longitude.
+    assert [s["distance"] for s in received] == pytest.approx(
+        [d * 111.19 for d, _ in expected], rel=1e-3, abs=0.01
+    )
+    distances = [s["distance"] for s in received]
+    assert distances == sorted(distances)
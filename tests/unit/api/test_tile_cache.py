@@ -0,0 +1,98 @@
+import pytest
+from datetime import datetime, timedelta
+from sdpb.util.tile_cache import (
+    TileCache,
+    Observation,
+    bytes_per_observation,
+    runs,
+    tile_of,
+    tile_start,
+)
+
+
+# Hourly observations from Jan 2000 through Jun 2000.
+observations = [
+    Observation(datetime(2000, 1, 1) + timedelta(hours=i), float(i))
+    for i in range(24 * 182)
+]
+
+
+class Fetcher:
+    """Fetch observations in a range, recording the ranges fetched."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, lo, hi):
+        self.calls.append((lo, hi))
+        return [o for o in observations if lo <= o.time < hi]
+
+
+def expected(start, end):
+    return [o for o in observations if start <= o.time <= end]
+
+
+def test_tiles():
+    assert tile_start(tile_of(datetime(2000, 12, 31, 23))) == datetime(2000, 12, 1)
+    assert tile_start(tile_of(datetime(2000, 12, 1)) + 1) == datetime(2001, 1, 1)
+    assert runs([1, 2, 3, 5, 7, 8]) == [[1, 2, 3], [5], [7, 8]]
+
+
+def test_series():
+    cache = TileCache()
+    fetch = Fetcher()
+
+    start, end = datetime(2000, 2, 10), datetime(2000, 3, 5)
+    assert cache.series("s", start, end, fetch) == expected(start, end)
+    assert fetch.calls == [(datetime(2000, 2, 1), datetime(2000, 4, 1))]
+
+    # Overlapping range: only the missing tiles are fetched, in runs.
+    fetch.calls = []
+    start, end = datetime(2000, 1, 15), datetime(2000, 4, 20)
+    assert cache.series("s", start, end, fetch) == expected(start, end)
+    assert fetch.calls == [
+        (datetime(2000, 1, 1), datetime(2000, 2, 1)),
+        (datetime(2000, 4, 1), datetime(2000, 5, 1)),
+    ]
+
+    # Covered range: nothing is fetched.
+    fetch.calls = []
+    start, end = datetime(2000, 1, 1), datetime(2000, 4, 1)
+    assert cache.series("s", start, end, fetch) == expected(start, end)
+    assert fetch.calls == []
+
+    # Another series is cached separately.
+    cache.series("t", start, end, fetch)
+    assert len(fetch.calls) == 1
+
+
+def test_eviction():
+    # Room for about two monthly tiles.
+    cache = TileCache(max_bytes=2 * 31 * 24 * bytes_per_observation + 1000)
+    fetch = Fetcher()
+    for month in (1, 2, 3):
+        cache.series("s", datetime(2000, month, 1), datetime(2000, month, 2), fetch)
+    assert len(cache) == 2
+    assert cache.size <= cache.max_bytes
+
+    # January, least recently used, was evicted.
+    fetch.calls = []
+    cache.series("s", datetime(2000, 1, 1), datetime(2000, 1, 2), fetch)
+    assert fetch.calls == [(datetime(2000, 1, 1), datetime(2000, 2, 1))]
+
+
+@pytest.mark.parametrize(
+    "now, expected_ttl",
+    [(datetime(2000, 3, 1), 1000), (datetime(2000, 2, 29, 23), 10)],
+)
+def test_ttl(now, expected_ttl):
+    cache = TileCache(open_ttl=10, closed_ttl=1000)
+    assert cache.ttl(tile_of(datetime(2000, 2, 1)), now) == expected_ttl
+
+
+def test_expiry():
+    cache = TileCache(open_ttl=0, closed_ttl=0)
+    fetch = Fetcher()
+    cache.series("s", datetime(2000, 1, 1), datetime(2000, 1, 2), fetch)
+    cache.series("s", datetime(2000, 1, 1), datetime(2000, 1, 2), fetch)
+    assert len(fetch.calls) == 2
@@ -0,0 +1,32 @@
+import pytest
+from flask import url_for
+from sdpb.util.uri import uri_for
+
+
+endpoint_values = [
+    ("sdpb_api_histories_single", {"id": 99}),
+    ("sdpb_api_stations_single", {"id": 99}),
+    ("sdpb_api_networks_single", {"id": 99}),
+    ("sdpb_api_variables_single", {"id": 99}),
+    ("sdpb_api_station_variables_get_station_variables", {"station_id": 99}),
+    # Not compiled (string parameter); falls back to url_for.
+    (
+        "sdpb_api_station_variables_get_station_variable",
+        {"station_id": 99, "var_id": "1"},
+    ),
+]
+
+
+@pytest.mark.parametrize("endpoint, values", endpoint_values)
+def test_uri_for_app_context(flask_app, endpoint, values):
+    assert uri_for(endpoint, **values) == url_for(endpoint, **values)
+
+
+@pytest.mark.parametrize("endpoint, values", endpoint_values)
+@pytest.mark.parametrize(
+    "base_url",
+    [None, "http://test/", "http://test/script/root", "https://test/", "http://other/"],
+)
+def test_uri_for_request_context(flask_app, endpoint, values, base_url):
+    with flask_app.test_request_context(base_url=base_url):
+        assert uri_for(endpoint, **values) == url_for(endpoint, **values)
@@ -0,0 +1,47 @@
+import pytest
+from sdpb.util.vars_index import VarsByHistory
+
+
+pairs = [(3, 1), (3, 2), (5, None), (8, 0), (8, 2), (8, 7), (13, 2)]
+
+expected = {3: [1, 2], 5: [], 8: [0, 2, 7], 13: [2]}
+
+
+@pytest.fixture
+def vars_by_hx():
+    return VarsByHistory.from_pairs(pairs)
+
+
+def test_mapping(vars_by_hx):
+    assert len(vars_by_hx) == len(expected)
+    assert list(vars_by_hx) == sorted(expected)
+    assert {hx_id: list(var_ids) for hx_id, var_ids in vars_by_hx.items()} == expected
+
+
+@pytest.mark.parametrize("hx_id", [0, 4, 9, 14])
+def test_missing(vars_by_hx, hx_id):
+    assert hx_id not in vars_by_hx
+    assert vars_by_hx.get(hx_id) is None
+    with pytest.raises(KeyError):
+        vars_by_hx[hx_id]
+
+
+@pytest.mark.parametrize(
+    "var_id, hx_ids", [(0, [8]), (1, [3]), (2, [3, 8, 13]), (7, [8]), (99, [])]
+)
+def test_histories_for(vars_by_hx, var_id, hx_ids):
+    assert list(vars_by_hx.histories_for(var_id)) == hx_ids
+
+
+def test_from_items(vars_by_hx):
+    rebuilt = VarsByHistory.from_items(
+        (hx_id, reversed(var_ids)) for hx_id, var_ids in vars_by_hx.items()
+    )
+    assert dict(rebuilt.items()) == dict(vars_by_hx.items())
+
+
+def test_empty():
+    vars_by_hx = VarsByHistory.from_pairs([])
+    assert len(vars_by_hx) == 0
+    assert 1 not in vars_by_hx
+    assert list(vars_by_hx.histories_for(1)) == []
@@ -0,0 +1,71 @@
+import pytest
+from sdpb.api.weather.monthly.anomaly import anomalies, collection
+
+pytestmark = pytest.mark.usefixtures("flask_app", "everything_session")
+
+
+@pytest.mark.parametrize(
+    "variable, year, month, statistic",
+    [
+        ("tmax", 2000, 1, 23.0),
+        ("tmin", 2000, 1, 0.0),
+        ("precip", 2000, 1, float(24 * 31)),
+    ],
+)
+def test_collection(tst_histories, variable, year, month, statistic):
+    result = collection(variable, year, month)
+    expected = {
+        history.id: history
+        for history in tst_histories
+        if history.station.publish and history.station.network.publish
+    }
+    assert {item["history_db_id"] for item in result} == set(expected)
+    for item in result:
+        history = expected[item["history_db_id"]]
+        assert item["station_db_id"] == history.station.id
+        assert item["station_name"] == history.station_name
+        assert item["statistic"] == pytest.approx(statistic)
+        assert item["baseline"] == float(month)
+        assert item["anomaly"] == pytest.approx(statistic - float(month))
+        assert item["data_coverage"] == pytest.approx(1.0)
+
+
+def test_anomalies():
+    def weather_item(history_id, statistic):
+        return {
+            "network_name": "Net",
+            "station_db_id": history_id * 10,
+            "station_native_id": str(history_id),
+            "history_db_id": history_id,
+            "station_name": f"Station {history_id}",
+            "lon": -123.0,
+            "lat": 50.0,
+            "elevation": 100.0,
+            "frequency": "daily",
+            "network_variable_name": "Tx",
+            "cell_method": "time: maximum",
+            "statistic": statistic,
+            "data_coverage": 0.5,
+        }
+
+    result = anomalies(
+        [weather_item(1, 12.5), weather_item(2, 3.0), weather_item(3, None)],
+        {1: 10.0, 3: 4.0, 4: 5.0},
+    )
+    assert [
+        (item["history_db_id"], item["baseline"], item["anomaly"]) for item in result
+    ] == [(1, 10.0, 2.5), (3, 4.0, None)]
+    assert set(result[0]) == {
+        "network_name",
+        "station_db_id",
+        "station_native_id",
+        "history_db_id",
+        "station_name",
+        "lon",
+        "lat",
+        "elevation",
+        "statistic",
+        "baseline",
+        "anomaly",
+        "data_coverage",
+    }
@@ -1,10 +1,20 @@
+import gzip
+import hashlib
+import json
 import pytest
+from sdpb.api.weather.monthly import baseline
 from sdpb.api.weather.monthly.baseline import collection
 from helpers import hashabledictrep
 
 pytestmark = pytest.mark.usefixtures("flask_app", "everything_session")
 
 
+def get_collection(flask_app, variable, month, headers=None):
+    """Return the processed response of `collection` to a request."""
+    with flask_app.test_request_context(headers=headers):
+        return flask_app.process_response(collection(variable, month))
+
+
 @pytest.mark.parametrize(
     "variable, month",
     [
@@ -13,8 +23,9 @@ pytestmark = pytest.mark.usefixtures("flask_app", "everything_session")
         ("precip", 3),
     ],
 )
-def test_collection(tst_histories, variable, month):
-    result = collection(variable, month)
+def test_collection(flask_app, tst_histories, variable, month):
+    response = get_collection(flask_app, variable, month)
+    result = json.loads(response.get_data())
     expected = [
         {
             "network_name": history.station.network.name,
@@ -32,3 +43,53 @@ def test_collection(tst_histories, variable, month):
     assert {hashabledictrep(r) for r in result} == {
         hashabledictrep(e) for e in expected
     }
+
+
+def test_representations(flask_app):
+    plain = get_collection(flask_app, "tmax", 1)
+    assert plain.headers.get("Content-Encoding") is None
+    assert plain.get_etag() == (
+        hashlib.sha1(plain.get_data()).hexdigest(),
+        False,
+    )
+
+    gzipped = get_collection(flask_app, "tmax", 1, {"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzipped.get_data()) == plain.get_data()
+    assert gzipped.get_etag() == (f"{plain.get_etag()[0]}:gzip", False)
+    assert "Accept-Encoding" in gzipped.headers["Vary"]
+
+    for response in (plain, gzipped):
+        not_modified = get_collection(
+            flask_app,
+            "tmax",
+            1,
+            {"If-None-Match": response.headers["ETag"], "Accept-Encoding": "gzip"},
+        )
+        assert not_modified.status_code == 304
+        assert not_modified.vary == response.vary
+        assert not_modified.cache_control.public
+        assert not_modified.cache_control.max_age == response.cache_control.max_age
+
+
+def test_store(flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, "BASELINE_CACHE_TTL", 3600)
+    monkeypatch.setattr(baseline, "_store", None)
+    session = baseline.get_app_session()
+    store = baseline.get_store(session)
+    assert set(store.representations) == {
+        (variable, month) for variable in baseline.variables for month in range(1, 13)
+    }
+    for variable in baseline.variables:
+        for month in (1, 2, 12):
+            uncached = baseline.representation_of(
+                baseline.collection_rep(baseline.baseline(session, variable, month))
+            )
+            assert {
+                hashabledictrep(r) for r in json.loads(store[(variable, month)].body)
+            } == {hashabledictrep(r) for r in json.loads(uncached.body)}
+    assert baseline.get_store(session) is store
+
+    cache_control = get_collection(flask_app, "tmin", 2).cache_control
+    assert cache_control.public
+    assert cache_control.max_age == 3600
@@ -1,5 +1,10 @@
+import flask
 import pytest
-from sdpb.api.weather.monthly.weather import collection
+import werkzeug.exceptions
+from datetime import date, datetime
+from types import SimpleNamespace
+from sdpb.api.weather.monthly import weather
+from sdpb.api.weather.monthly.weather import collection, is_closed, series
 
 pytestmark = pytest.mark.usefixtures("flask_app", "everything_session")
 
@@ -46,3 +51,132 @@ def test_collection(
     assert sorted(result, key=lambda r: r["station_name"]) == sorted(
         result, key=lambda r: r["station_name"]
     )
+
+
+@pytest.mark.parametrize(
+    "year, month, now, expected",
+    [
+        (2000, 1, datetime(2000, 1, 15), False),
+        (2000, 1, datetime(2000, 2, 15), False),
+        (2000, 1, datetime(2000, 3, 1), True),
+        (2000, 12, datetime(2001, 1, 28), False),
+        (2000, 12, datetime(2001, 1, 29), True),
+    ],
+)
+def test_is_closed(year, month, now, expected):
+    assert is_closed(year, month, now) == expected
+
+
+@pytest.mark.parametrize(
+    "year, month, immutable", [(2000, 1, True), (date.today().year + 1, 1, False)]
+)
+def test_cache_control(flask_app, year, month, immutable):
+    with flask_app.test_request_context():
+        response = flask_app.process_response(
+            flask_app.make_response(collection("tmax", year, month))
+        )
+    cache_control = response.cache_control
+    assert cache_control.public
+    assert cache_control.immutable == immutable
+    assert (cache_control.max_age > 24 * 60 * 60) == immutable
+
+
+@pytest.mark.parametrize(
+    "year, month, immutable", [(2000, 1, True), (date.today().year + 1, 1, False)]
+)
+def test_cache_control_not_modified(flask_app, year, month, immutable):
+    # A 304 Not Modified (e.g., from an intermediary's revalidation) carries the
+    # same Cache-Control as the full response.
+    with flask_app.test_request_context():
+        weather.set_month_cache_control(is_closed(year, month))
+        response = flask_app.process_response(flask.Response(status=304))
+    cache_control = response.cache_control
+    assert cache_control.public
+    assert cache_control.immutable == immutable
+    assert (cache_control.max_age > 24 * 60 * 60) == immutable
+
+
+def test_cache(flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, "WEATHER_CACHE_ENTRIES", 10)
+    monkeypatch.setattr(weather, "_cache", None)
+    calls = []
+    original = weather.weather
+
+    def counted(*args):
+        calls.append(args[1:])
+        return original(*args)
+
+    monkeypatch.setattr(weather, "weather", counted)
+    first = collection("tmax", 2000, 1)
+    assert collection("tmax", 2000, 1) == first
+    assert calls == [("tmax", 2000, 1)]
+
+    weather.warm_up(weather.get_app_session(), 2, now=datetime(2000, 2, 10))
+    assert len(calls) == 1 + 2 * len(weather.variables)
+    collection("precip", 2000, 1)
+    assert len(calls) == 1 + 2 * len(weather.variables)
+
+
+@pytest.mark.parametrize("station_ids", [None, "first"])
+def test_series(tst_histories, station_ids):
+    histories = [
+        history
+        for history in tst_histories
+        if history.station.publish and history.station.network.publish
+    ]
+    if station_ids == "first":
+        station_ids = [histories[0].station.id]
+        histories = [h for h in histories if h.station.id in station_ids]
+    result = series("tmax", "1999-11", "2000-03", station_ids)
+    assert {item["history_db_id"] for item in result} == {h.id for h in histories}
+    for item in result:
+        assert item["months"] == ["2000-01"]
+        assert item["statistics"] == [pytest.approx(23.0)]
+        assert item["data_coverages"] == [pytest.approx(1.0)]
+        assert item["cell_method"] == "time: point"
+
+
+def test_series_rep_interleaved():
+    # Two variables of one history with the same name (e.g., from different
+    # Variable rows) whose rows interleave must still form one item.
+    def row(history_id, name, month, statistic):
+        return SimpleNamespace(
+            **{
+                **{k: None for k in weather.series_keys},
+                "history_db_id": history_id,
+                "network_variable_name": name,
+                "obs_month": datetime(2000, month, 1),
+                "statistic": statistic,
+                "data_coverage": 1.0,
+            }
+        )
+
+    rows = [
+        row(1, "Tmax", 1, 1.0),
+        row(1, "Tmin", 1, 2.0),
+        row(1, "Tmax", 2, 3.0),
+        row(2, "Tmax", 1, 4.0),
+        row(1, "Tmin", 2, 5.0),
+    ]
+    result = weather.series_rep(rows)
+    assert [
+        (item["history_db_id"], item["network_variable_name"]) for item in result
+    ] == [(1, "Tmax"), (1, "Tmin"), (2, "Tmax")]
+    assert result[0]["months"] == ["2000-01", "2000-02"]
+    assert result[0]["statistics"] == [1.0, 3.0]
+    assert result[1]["statistics"] == [2.0, 5.0]
+    assert result[2]["statistics"] == [4.0]
+
+
+def test_series_min_coverage():
+    session = weather.get_app_session()
+    start, end = datetime(2000, 1, 1), datetime(2000, 1, 1)
+    assert weather.weather_range(session, "tmin", start, end, min_coverage=0.5)
+    assert not weather.weather_range(session, "tmin", start, end, min_coverage=1.5)
+
+
+@pytest.mark.parametrize("start, end", [("2000-13", "2001-01"), ("2000-02", "2000-01")])
+def test_series_invalid(flask_app, start, end):
+    with flask_app.test_request_context():
+        with pytest.raises(werkzeug.exceptions.BadRequest):
+            series("tmax", start, end)